@@ -0,0 +1,226 @@
+"""
+在子进程中执行IP列表聚合，避免长时间占用GIL影响decision stream和心跳线程。
+
+封禁列表打包为 (address, prefixlen) 的u32数组写入共享内存，所有worker共用一份；
+聚合结果同样以u32数组返回，不需要序列化字符串列表。
+"""
+
+import logging
+import multiprocessing
+import socket
+import struct
+from array import array
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+from netaddr import IPNetwork
+
+from app.ip_list import IpListBuilder
+from app.target_backend import IpListResult, IpListSpec
+
+LOG = logging.getLogger(__name__)
+
+DISCARD_REASON_S = ("full", "ignore", "not ipv4")
+
+# 没有前缀长度的单个IP地址
+_PLAIN_ADDRESS = 255
+
+# 子进程中已打开的前缀数据库
+_PREFIX_DB_D: dict = {}
+
+
+def _parse_ipv4(ip: str) -> tuple[int, int] | None:
+    address, sep, prefixlen = ip.partition("/")
+    try:
+        packed = socket.inet_pton(socket.AF_INET, address)
+    except OSError:
+        return None
+    if not sep:
+        return struct.unpack("!I", packed)[0], _PLAIN_ADDRESS
+    if not prefixlen.isdigit() or int(prefixlen) > 32:
+        return None
+    return struct.unpack("!I", packed)[0], int(prefixlen)
+
+
+def _format_ipv4(address: int, prefixlen: int) -> str:
+    text = socket.inet_ntop(socket.AF_INET, struct.pack("!I", address))
+    if prefixlen == _PLAIN_ADDRESS:
+        return text
+    return f"{text}/{prefixlen}"
+
+
+def pack_ip_list(ip_list: list[str]):
+    """
+    返回 (u32数组[address, prefixlen, ...], 原始序号, 非IPv4地址)，无效的地址和IpListBuilder一样报错
+    """
+    packed = array("I")
+    index_s = array("I")
+    other_ip_s: list[str] = []
+    for index, ip in enumerate(ip_list):
+        item = _parse_ipv4(ip)
+        if item is None:
+            ip_net = IPNetwork(ip)
+            if ip_net.version != 4:
+                other_ip_s.append(ip)
+                continue
+            prefixlen = ip_net.prefixlen if "/" in ip else _PLAIN_ADDRESS
+            item = (int(ip_net.ip), prefixlen)
+        packed.extend(item)
+        index_s.append(index)
+    return packed, index_s, other_ip_s
+
+
+def _unpack_ip_list(packed: memoryview):
+    return [_format_ipv4(packed[i], packed[i + 1]) for i in range(0, len(packed), 2)]
+
+
+def _get_prefix_db(path: str | None):
+    if not path:
+        return None
+    db = _PREFIX_DB_D.get(path)
+    if db is None:
+        from app.prefix_db import PrefixDB
+
+        db = _PREFIX_DB_D[path] = PrefixDB(path)
+    return db
+
+
+def _build_ip_list(
+    ip_list: list[str],
+    spec: IpListSpec,
+    prefix_db_path: str | None,
+    prefix_merge_density: float,
+):
+    builder = IpListBuilder(
+        max_size=spec.max_size,
+        ignore_ip_s=list(spec.ignore_ip_s),
+        prefix_db=_get_prefix_db(prefix_db_path),
+        prefix_merge_density=prefix_merge_density,
+    )
+    builder.update(ip_list)
+    return builder
+
+
+def _aggregate_worker(
+    shm_name: str,
+    num_item: int,
+    spec: IpListSpec,
+    prefix_db_path: str | None,
+    prefix_merge_density: float,
+):
+    shm = SharedMemory(name=shm_name)
+    try:
+        view = shm.buf[: num_item * 8].cast("I")
+        try:
+            ip_list = _unpack_ip_list(view)
+        finally:
+            view.release()
+    finally:
+        shm.close()
+    builder = _build_ip_list(ip_list, spec, prefix_db_path, prefix_merge_density)
+    result = array("I")
+    for ip in builder.to_list():
+        item = _parse_ipv4(ip)
+        assert item is not None
+        result.extend(item)
+    index_d = {ip: i for i, ip in enumerate(ip_list)}
+    discard = array("I")
+    for ip, reason in builder.get_discard_list():
+        discard.append(index_d[ip])
+        discard.append(DISCARD_REASON_S.index(reason))
+    return result.tobytes(), discard.tobytes()
+
+
+class AggregationPool:
+    """
+    聚合进程池，不同聚合参数的目标并行计算
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = self._create_executor()
+
+    def _create_executor(self):
+        # 主进程有crowdsec stream线程，使用spawn避免fork时复制锁状态
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _reset_executor(self):
+        """
+        worker异常退出(例如被OOM kill)后进程池不再可用，重新创建
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._create_executor()
+
+    def compute(
+        self,
+        ban_ip_list: list[str],
+        spec_s: Iterable[IpListSpec],
+        *,
+        prefix_db_path: str | None = None,
+        prefix_merge_density: float = 0.0,
+    ) -> dict[IpListSpec, IpListResult]:
+        spec_s = list(dict.fromkeys(spec_s))
+        if not spec_s:
+            return {}
+        try:
+            return self._compute(ban_ip_list, spec_s, prefix_db_path, prefix_merge_density)
+        except BrokenProcessPool as ex:
+            LOG.error(f"aggregation worker died, recreate pool and aggregate in main process: {ex}")
+            self._reset_executor()
+        # 本轮在主进程中聚合
+        ret: dict[IpListSpec, IpListResult] = {}
+        for spec in spec_s:
+            builder = _build_ip_list(ban_ip_list, spec, prefix_db_path, prefix_merge_density)
+            ret[spec] = IpListResult(
+                ip_s=builder.to_list(), discard_ip_s=builder.get_discard_list()
+            )
+        return ret
+
+    def _compute(
+        self,
+        ban_ip_list: list[str],
+        spec_s: list[IpListSpec],
+        prefix_db_path: str | None,
+        prefix_merge_density: float,
+    ) -> dict[IpListSpec, IpListResult]:
+        packed, index_s, other_ip_s = pack_ip_list(ban_ip_list)
+        # 非IPv4地址不会下发，和IpListBuilder一样记录为丢弃
+        other_discard_s = [(ip, "not ipv4") for ip in other_ip_s]
+        shm = SharedMemory(create=True, size=max(len(packed) * packed.itemsize, 1))
+        try:
+            shm.buf[: len(packed) * packed.itemsize] = packed.tobytes()
+            future_s = [
+                self._executor.submit(
+                    _aggregate_worker,
+                    shm.name,
+                    len(index_s),
+                    spec,
+                    prefix_db_path,
+                    prefix_merge_density,
+                )
+                for spec in spec_s
+            ]
+            LOG.debug(f"aggregate {len(ban_ip_list)} ips for {len(spec_s)} specs in worker process")
+            ret: dict[IpListSpec, IpListResult] = {}
+            for spec, future in zip(spec_s, future_s):
+                result_bytes, discard_bytes = future.result()
+                result = array("I", result_bytes)
+                discard = array("I", discard_bytes)
+                ip_s = _unpack_ip_list(memoryview(result))
+                discard_ip_s = list(other_discard_s)
+                for i in range(0, len(discard), 2):
+                    ip = ban_ip_list[index_s[discard[i]]]
+                    discard_ip_s.append((ip, DISCARD_REASON_S[discard[i + 1]]))
+                ret[spec] = IpListResult(ip_s=ip_s, discard_ip_s=discard_ip_s)
+            return ret
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
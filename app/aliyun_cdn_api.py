@@ -0,0 +1,207 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import uuid
+from urllib.parse import quote
+
+import requests
+
+from app.config import AppSettings
+from app.log_render import ApplyDecisionMessage
+from app.target_backend import IpListResult, PreparedDecision, TargetBackend
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINT = "https://cdn.aliyuncs.com"
+API_VERSION = "2018-05-10"
+BLACKLIST_FUNCTION = "ip_black_list_set"
+
+
+class AliyunApiError(Exception):
+    def __init__(self, code: str, message: str, request_id: str | None = None):
+        super().__init__(f"[{code}] {message} requestId={request_id}")
+        self.code = code
+        self.message = message
+        self.request_id = request_id
+
+
+def _percent_encode(value: str) -> str:
+    return quote(str(value), safe="~")
+
+
+def sign_rpc_request(params: dict[str, str], access_key_secret: str, method: str = "POST"):
+    """
+    阿里云RPC风格接口签名(SignatureVersion 1.0)
+    https://help.aliyun.com/zh/sdk/product-overview/rpc-mechanism
+    """
+    canonical = "&".join(
+        f"{_percent_encode(k)}={_percent_encode(v)}" for k, v in sorted(params.items())
+    )
+    string_to_sign = f"{method}&{_percent_encode('/')}&{_percent_encode(canonical)}"
+    key = (access_key_secret + "&").encode()
+    digest = hmac.new(key, string_to_sign.encode(), hashlib.sha1).digest()
+    return base64.b64encode(digest).decode()
+
+
+def _parse_result(resp: requests.Response) -> dict | None:
+    try:
+        result = resp.json()
+    except ValueError:
+        return None
+    return result if isinstance(result, dict) else None
+
+
+class AliyunCdnAPI(TargetBackend):
+    """
+    阿里云CDN IP黑名单(ip_black_list_set)
+
+    黑名单是域名级别的一条配置，由bouncer整体管理。
+    """
+
+    kind = "aliyun_cdn"
+
+    def __init__(
+        self,
+        *,
+        access_key_id: str,
+        access_key_secret: str,
+        endpoint: str | None = None,
+        max_ip: int = 500,
+    ):
+        self._access_key_id = access_key_id
+        self._access_key_secret = access_key_secret
+        self._endpoint = endpoint or DEFAULT_ENDPOINT
+        self._max_ip = max_ip
+        self._session: requests.Session | None = None
+
+    @classmethod
+    def from_config(cls, config: AppSettings):
+        return cls(
+            access_key_id=config.aliyun_access_key_id,
+            access_key_secret=config.aliyun_access_key_secret,
+            endpoint=config.aliyun_endpoint,
+            max_ip=config.aliyun_cdn_max_ip,
+        )
+
+    @property
+    def max_ip(self):
+        return self._max_ip
+
+    def _get_session(self):
+        if not self._session:
+            self._session = requests.Session()
+        return self._session
+
+    def _request(self, action: str, params: dict[str, str]) -> dict:
+        req_params = {
+            "Action": action,
+            "Format": "JSON",
+            "Version": API_VERSION,
+            "AccessKeyId": self._access_key_id,
+            "SignatureMethod": "HMAC-SHA1",
+            "SignatureVersion": "1.0",
+            "SignatureNonce": uuid.uuid4().hex,
+            "Timestamp": datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            **params,
+        }
+        req_params["Signature"] = sign_rpc_request(req_params, self._access_key_secret)
+        resp = self._get_session().post(self._endpoint + "/", data=req_params, timeout=60)
+        # 网关错误时响应可能是HTML或者空内容
+        result = _parse_result(resp)
+        if resp.status_code != 200 or result is None or "Code" in result:
+            result = result or {}
+            raise AliyunApiError(
+                code=result.get("Code") or f"HTTP{resp.status_code}",
+                message=result.get("Message") or resp.text[:200],
+                request_id=result.get("RequestId"),
+            )
+        return result
+
+    def get_domain_config(self, domain: str) -> dict | None:
+        """
+        返回IP黑名单配置: {"ConfigId": ..., "ip_list": [...]}，未配置时ip_list为空，
+        域名不存在时返回None
+        """
+        try:
+            result = self._request(
+                "DescribeCdnDomainConfigs",
+                {"DomainName": domain, "FunctionNames": BLACKLIST_FUNCTION},
+            )
+        except AliyunApiError as ex:
+            if ex.code.startswith("InvalidDomain"):
+                return None
+            raise
+        config_s = (result.get("DomainConfigs") or {}).get("DomainConfig") or []
+        for config in config_s:
+            if config.get("FunctionName") != BLACKLIST_FUNCTION:
+                continue
+            arg_s = (config.get("FunctionArgs") or {}).get("FunctionArg") or []
+            ip_list: list[str] = []
+            for arg in arg_s:
+                if arg.get("ArgName") == "ip_list":
+                    ip_list = [x.strip() for x in (arg.get("ArgValue") or "").split(",")]
+            return {
+                "ConfigId": config.get("ConfigId"),
+                "ip_list": [x for x in ip_list if x],
+            }
+        return {"ConfigId": None, "ip_list": []}
+
+    def check_target(self, domain: str):
+        if self.get_domain_config(domain) is None:
+            raise RuntimeError(f"aliyun cdn domain {domain} not found")
+
+    def set_domain_blacklist(self, domain: str, ip_list: list[str], config_id=None):
+        function: dict = {
+            "functionArgs": [{"argName": "ip_list", "argValue": ",".join(ip_list)}],
+            "functionName": BLACKLIST_FUNCTION,
+        }
+        if config_id is not None:
+            function["configId"] = config_id
+        return self._request(
+            "BatchSetCdnDomainConfig",
+            {"DomainNames": domain, "Functions": json.dumps([function])},
+        )
+
+    def prepare_decision(self, domain: str):
+        domain_config = self.get_domain_config(domain)
+        if domain_config is None:
+            LOG.warning(f"domain not found: {domain}")
+            return None
+        return self.load_state(domain, domain_config)
+
+    def dump_state(self, prepared: PreparedDecision):
+        return prepared.state
+
+    def load_state(self, domain: str, domain_config: dict):
+        spec = self.get_ip_list_spec()
+        return PreparedDecision(
+            domain=domain,
+            spec=spec,
+            state=domain_config,
+            current_ip_s=list(domain_config["ip_list"]),
+        )
+
+    def commit_decision(self, prepared: PreparedDecision, result: IpListResult):
+        domain = prepared.domain
+        domain_config: dict = prepared.state
+        if domain_config["ip_list"] == result.ip_s:
+            LOG.info(f"IP list no change, no need to apply to {domain}")
+            return True
+        self._log_apply_decision(domain, result.ip_s, result.discard_ip_s)
+        resp = self.set_domain_blacklist(
+            domain, result.ip_s, config_id=domain_config.get("ConfigId")
+        )
+        LOG.info(f"modify domain {domain} success, requestId={resp.get('RequestId')}")
+        return True
+
+    def _log_apply_decision(
+        self,
+        domain: str,
+        ip_s: list[str],
+        discard_ip_s: list[tuple[str, str]],
+    ):
+        title = f"apply decision to {domain} blacklist={len(ip_s)} discard={len(discard_ip_s)}"
+        LOG.info("%s", ApplyDecisionMessage(title, ip_s, discard_ip_s))
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+LOG = logging.getLogger(__name__)
+
+
+@dataclass
+class JournalEntry:
+    ts: float
+    target: str
+    kind: str
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    # 相对上一次记录新丢弃的IP: [(ip, reason)]
+    discarded: list[tuple[str, str]] = field(default_factory=list)
+    # 相对上一次记录不再丢弃的IP
+    undiscarded: list[str] = field(default_factory=list)
+    # 本次丢弃的IP总数
+    num_discard: int = 0
+
+    def to_dict(self):
+        return {
+            "ts": self.ts,
+            "target": self.target,
+            "kind": self.kind,
+            "added": self.added,
+            "removed": self.removed,
+            "discarded": [list(x) for x in self.discarded],
+            "undiscarded": self.undiscarded,
+            "num_discard": self.num_discard,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            ts=data["ts"],
+            target=data["target"],
+            kind=data.get("kind") or "",
+            added=data.get("added") or [],
+            removed=data.get("removed") or [],
+            discarded=[tuple(x) for x in data.get("discarded") or []],  # type: ignore
+            undiscarded=data.get("undiscarded") or [],
+            num_discard=data.get("num_discard") or 0,
+        )
+
+
+class ApplyJournal:
+    """
+    下发日志：每次修改目标时追加一行JSON，记录新增、移除的IP，以及丢弃列表的变化。
+
+    丢弃列表只记录和同一个目标上一次记录相比的变化，进程启动后的第一条记录包含完整的丢弃列表。
+
+    文件超过max_bytes时轮转为 path.1 ... path.N，和RotatingFileHandler一致。
+    """
+
+    def __init__(self, path: str, *, max_bytes: int = 16 * 1024 * 1024, backup_count: int = 5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = open(path, "a", encoding="utf-8")
+        # (kind, target) -> 上一次记录时丢弃的IP
+        self._discard_d: dict[tuple[str, str], dict[str, str]] = {}
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, entry: JournalEntry):
+        line = json.dumps(entry.to_dict(), ensure_ascii=False, separators=(",", ":"))
+        if self.max_bytes > 0 and self._file.tell() + len(line) + 1 > self.max_bytes:
+            if self._file.tell() > 0:
+                self._rotate()
+        self._file.write(line + "\n")
+        self._file.flush()
+
+    def record(
+        self,
+        *,
+        target: str,
+        kind: str,
+        current_ip_s: list[str],
+        ip_s: list[str],
+        discard_ip_s: list[tuple[str, str]],
+        ts: float | None = None,
+    ):
+        current_ip_set = set(current_ip_s)
+        ip_set = set(ip_s)
+        last_discard_d = self._discard_d.get((kind, target), {})
+        discard_d = dict(discard_ip_s)
+        entry = JournalEntry(
+            ts=time.time() if ts is None else ts,
+            target=target,
+            kind=kind,
+            added=[x for x in ip_s if x not in current_ip_set],
+            removed=[x for x in current_ip_s if x not in ip_set],
+            discarded=[x for x in discard_ip_s if last_discard_d.get(x[0]) != x[1]],
+            undiscarded=[x for x in last_discard_d if x not in discard_d],
+            num_discard=len(discard_ip_s),
+        )
+        if entry.added or entry.removed or entry.discarded or entry.undiscarded:
+            self.write(entry)
+            self._discard_d[(kind, target)] = discard_d
+        return entry
+
+    def close(self):
+        self._file.close()
+
+
+def get_journal_path_s(path: str) -> list[str]:
+    """
+    返回从旧到新的日志文件列表
+    """
+    dirname = os.path.dirname(path) or "."
+    basename = os.path.basename(path)
+    backup_s: list[tuple[int, str]] = []
+    for name in os.listdir(dirname):
+        suffix = name[len(basename) + 1 :]
+        if name.startswith(basename + ".") and suffix.isdigit():
+            backup_s.append((int(suffix), os.path.join(dirname, name)))
+    ret = [x[1] for x in sorted(backup_s, reverse=True)]
+    if os.path.exists(path):
+        ret.append(path)
+    return ret
+
+
+def read_journal(path: str) -> Iterator[JournalEntry]:
+    for journal_path in get_journal_path_s(path):
+        with open(journal_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程异常退出时最后一行可能不完整
+                    LOG.warning(f"skip invalid journal line in {journal_path}")
+                    continue
+                yield JournalEntry.from_dict(data)
+
+
+def query_journal(
+    path: str,
+    *,
+    target: str | None = None,
+    ip: str | None = None,
+    since: float | None = None,
+    until: float | None = None,
+) -> Iterator[JournalEntry]:
+    """
+    按目标、IP和时间范围查询下发日志
+    """
+    for entry in read_journal(path):
+        if target is not None and entry.target != target:
+            continue
+        if since is not None and entry.ts < since:
+            continue
+        if until is not None and entry.ts >= until:
+            continue
+        if ip is not None:
+            if (
+                ip not in entry.added
+                and ip not in entry.removed
+                and ip not in entry.undiscarded
+                and all(x[0] != ip for x in entry.discarded)
+            ):
+                continue
+        yield entry
@@ -1,44 +1,174 @@
 import logging
 import os
 import sys
+from collections.abc import Mapping
 from typing import TextIO
 
-from dotenv import load_dotenv
-from pydantic import Field
+from dotenv import dotenv_values, load_dotenv
+from pydantic import Field, model_validator
 from pydantic_settings import BaseSettings
 
 
 class AppSettings(BaseSettings):
     log_level: str = Field(default="INFO")
+    config_watch: bool = Field(
+        default=False,
+        description="reload config when envfile changes, SIGHUP always reloads config",
+    )
     crowdsec_lapi_key: str = Field(
-        description="crowdsec local api key",
+        description="crowdsec local api key, multiple keys separated by comma",
     )
     crowdsec_lapi_url: str = Field(
         default="http://localhost:8080/",
-        description="crowdsec local api url",
+        description="crowdsec local api url, multiple urls separated by comma",
     )
     crowdsec_stream_interval: int = Field(
         default=10,
         description="crowdsec stream interval",
     )
+    crowdsec_stream_direct: bool = Field(
+        default=False,
+        description="stream threads write decisions into the decision store in chunks instead of the queue",
+    )
+    crowdsec_record_path: str | None = Field(
+        default=None,
+        description="record crowdsec decision stream to file, for offline replay",
+    )
+    apply_journal_path: str | None = Field(
+        default=None,
+        description="append added/removed/discarded ips of each apply to a json lines journal",
+    )
+    apply_journal_max_bytes: int = Field(
+        default=16 * 1024 * 1024,
+        description="rotate apply journal when it exceeds this size",
+    )
+    apply_journal_backup_count: int = Field(
+        default=5,
+        description="number of rotated apply journal files to keep",
+    )
+    prefix_db_path: str | None = Field(
+        default=None,
+        description="prefix to asn database built by `python -m app.prefix_db build`",
+    )
+    prefix_merge_density: float = Field(
+        default=0.25,
+        description="merge banned ips into announced prefix when ratio of hit /24 exceeds it",
+    )
+    aggregation_workers: int = Field(
+        default=0,
+        description="aggregate ip lists in worker processes, 0 means in the main process",
+    )
+    decision_grace_window: int = Field(
+        default=0,
+        description="keep unbanned ips in the pushed list for seconds while within budget, 0 means disabled",
+    )
+    decision_grace_max_size: int = Field(
+        default=10000,
+        description="max number of unbanned ips kept in the grace window",
+    )
     tencent_secret_id: str = Field(
+        default="",
         description="tencent cloud secret id",
     )
     tencent_secret_key: str = Field(
+        default="",
         description="tencent cloud secret key",
     )
+    coordination_url: str | None = Field(
+        default=None,
+        description="lease store shared by replicas, eg: sqlite:///data/lease.db or file:///data/lease",
+    )
+    coordination_lease_ttl: int = Field(
+        default=90,
+        description="replica heartbeat and target lease ttl in seconds, must exceed api timeout",
+    )
+    replica_id: str | None = Field(
+        default=None,
+        description="replica id for coordination, default is hostname-pid",
+    )
+    tencent_endpoint: str | None = Field(
+        default=None,
+        description="tencent cloud api endpoint, eg: http://127.0.0.1:8000 for fake backend",
+    )
+    tencent_http_pool_size: int = Field(
+        default=10,
+        description="max keep-alive connections per tencent cloud api endpoint",
+    )
+    tencent_http_connect_timeout: float = Field(
+        default=5,
+        description="tencent cloud api connect timeout in seconds",
+    )
+    tencent_http_read_timeout: float = Field(
+        default=60,
+        description="tencent cloud api read timeout in seconds",
+    )
+    tencent_http_action_timeout: str | None = Field(
+        default=None,
+        description="read timeout per action, eg: ModifySecurityPolicy=120,DescribeZones=10",
+    )
+    tencent_http_compress_min_bytes: int = Field(
+        default=0,
+        description="gzip request bodies larger than this size, 0 means disabled",
+    )
     tencent_cdn_domain: str | None = Field(
         default=None,
-        description="tencent cloud cdn domain",
+        description="tencent cloud cdn domain, multiple domains separated by comma",
     )
     tencent_teo_zone_id: str | None = Field(
         default=None,
-        description="tencent cloud edgeone zone id",
+        description="tencent cloud edgeone zone id, multiple zones separated by comma",
     )
     tencent_teo_max_rule: int = Field(
         default=10,
         description="tencent cloud edgeone max rule count",
     )
+    aliyun_access_key_id: str = Field(
+        default="",
+        description="aliyun access key id",
+    )
+    aliyun_access_key_secret: str = Field(
+        default="",
+        description="aliyun access key secret",
+    )
+    aliyun_endpoint: str | None = Field(
+        default=None,
+        description="aliyun cdn api endpoint, default is https://cdn.aliyuncs.com",
+    )
+    aliyun_cdn_domain: str | None = Field(
+        default=None,
+        description="aliyun cdn domain, multiple domains separated by comma",
+    )
+    aliyun_cdn_max_ip: int = Field(
+        default=500,
+        description="aliyun cdn ip blacklist max size, adjust to the quota of your account",
+    )
+
+    @model_validator(mode="after")
+    def check_credential(self):
+        # 配置了目标时必须配置对应的密钥，避免启动后才出现鉴权错误
+        if (self.tencent_cdn_domain or self.tencent_teo_zone_id) and not (
+            self.tencent_secret_id and self.tencent_secret_key
+        ):
+            raise ValueError(
+                "tencent_secret_id and tencent_secret_key are required for tencent targets"
+            )
+        if self.aliyun_cdn_domain and not (
+            self.aliyun_access_key_id and self.aliyun_access_key_secret
+        ):
+            raise ValueError(
+                "aliyun_access_key_id and aliyun_access_key_secret are required for aliyun targets"
+            )
+        return self
+
+
+def get_envfile_path(*, env_prefix: str, default_envfile: str | None = None):
+    envfile_path = os.getenv(f"{env_prefix}CONFIG")
+    if not envfile_path:
+        if default_envfile and os.path.exists(default_envfile):
+            envfile_path = default_envfile
+    if envfile_path:
+        envfile_path = os.path.abspath(os.path.expanduser(envfile_path))
+    return envfile_path
 
 
 def load_env_config(
@@ -46,25 +176,79 @@ def load_env_config(
     env_prefix: str,
     default_envfile: str | None = None,
     output: TextIO = sys.stderr,
+    base_env: Mapping[str, str] | None = None,
 ):
     """
     Load envfile and convert to config model type.
+
+    base_env 不为空时用于重新加载配置：不修改os.environ，只使用 base_env 和envfile的当前内容，
+    envfile中删除的配置项恢复默认值，base_env 中的值优先。
     """
-    envfile_path = os.getenv(f"{env_prefix}CONFIG")
-    if not envfile_path:
-        if default_envfile and os.path.exists(default_envfile):
-            envfile_path = default_envfile
+    envfile_path = get_envfile_path(env_prefix=env_prefix, default_envfile=default_envfile)
+    if base_env is None:
+        if envfile_path:
+            output.write(f"* Load envfile at {envfile_path}\n")
+            load_dotenv(envfile_path)
+        return AppSettings(_env_prefix=env_prefix)  # type: ignore
+    env_d: dict[str, str] = {}
     if envfile_path:
-        envfile_path = os.path.abspath(os.path.expanduser(envfile_path))
-        output.write(f"* Load envfile at {envfile_path}\n")
-        load_dotenv(envfile_path)
-    return AppSettings(_env_prefix=env_prefix)  # type: ignore
+        output.write(f"* Reload envfile at {envfile_path}\n")
+        env_d.update({k: v for k, v in dotenv_values(envfile_path).items() if v is not None})
+    env_d.update(base_env)
+    prefix = env_prefix.lower()
+    data = {
+        k.lower()[len(prefix):]: v for k, v in env_d.items() if k.lower().startswith(prefix)
+    }
+    data = {k: v for k, v in data.items() if k in AppSettings.model_fields}
+    # model_validate 不读取os.environ
+    return AppSettings.model_validate(data)
 
 
-CONFIG = load_env_config(env_prefix="CSCDN_")
+def diff_config(old: AppSettings, new: AppSettings) -> set[str]:
+    """
+    返回值发生变化的配置项名称
+    """
+    return {
+        name for name in type(old).model_fields if getattr(old, name) != getattr(new, name)
+    }
+
+
+ENV_PREFIX = "CSCDN_"
+
+_CONFIG: AppSettings | None = None
+# 启动时的环境变量，加载envfile之前
+_STARTUP_ENV: dict[str, str] = dict(os.environ)
+
+
+def get_config() -> AppSettings:
+    """
+    Load config on first access, so importing app modules stays cheap.
+    """
+    global _CONFIG
+    if _CONFIG is None:
+        _CONFIG = load_env_config(env_prefix=ENV_PREFIX)
+    return _CONFIG
+
+
+def reload_config() -> AppSettings:
+    """
+    重新读取envfile，和启动时的环境变量合并后替换全局配置
+    """
+    global _CONFIG
+    _CONFIG = load_env_config(env_prefix=ENV_PREFIX, base_env=_STARTUP_ENV)
+    return _CONFIG
+
+
+def __getattr__(name: str):
+    # 兼容 from app.config import CONFIG
+    if name == "CONFIG":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 LOG_FORMAT = "%(levelname)1.1s %(asctime)s %(name)s:%(lineno)d %(message)s"
 LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
-logging.basicConfig(format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT, level=CONFIG.log_level)
+
+def setup_logging(log_level: str):
+    logging.basicConfig(format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT, level=log_level)
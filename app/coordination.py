@@ -0,0 +1,253 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Iterable
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+LOG = logging.getLogger(__name__)
+
+
+class LeaseStore(ABC):
+    """
+    多个副本共享的租约存储，记录存活的副本和每个目标的持有者。
+    """
+
+    @abstractmethod
+    def heartbeat(self, member: str, ttl: float, now: float) -> None: ...
+
+    @abstractmethod
+    def get_live_member_s(self, now: float) -> list[str]: ...
+
+    @abstractmethod
+    def try_acquire(self, key: str, holder: str, ttl: float, now: float) -> bool:
+        """租约空闲、已过期或者已经由holder持有时获取(续期)成功"""
+
+    @abstractmethod
+    def release(self, key: str, holder: str) -> None: ...
+
+    @abstractmethod
+    def get_holder(self, key: str, now: float) -> str | None: ...
+
+
+class SqliteLeaseStore(LeaseStore):
+    """
+    使用SQLite文件保存租约，适用于共享同一个数据卷的副本。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lease"
+            " (key TEXT PRIMARY KEY, holder TEXT NOT NULL, expire_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS member (member TEXT PRIMARY KEY, expire_at REAL NOT NULL)"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def heartbeat(self, member: str, ttl: float, now: float):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO member (member, expire_at) VALUES (?, ?)",
+                (member, now + ttl),
+            )
+            conn.execute("DELETE FROM member WHERE expire_at <= ?", (now,))
+
+    def get_live_member_s(self, now: float):
+        row_s = self._conn.execute(
+            "SELECT member FROM member WHERE expire_at > ? ORDER BY member", (now,)
+        ).fetchall()
+        return [x[0] for x in row_s]
+
+    def try_acquire(self, key: str, holder: str, ttl: float, now: float):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT holder, expire_at FROM lease WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO lease (key, holder, expire_at) VALUES (?, ?, ?)",
+                (key, holder, now + ttl),
+            )
+            return True
+
+    def release(self, key: str, holder: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM lease WHERE key = ? AND holder = ?", (key, holder))
+
+    def get_holder(self, key: str, now: float):
+        row = self._conn.execute(
+            "SELECT holder FROM lease WHERE key = ? AND expire_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else None
+
+
+class FileLeaseStore(LeaseStore):
+    """
+    使用目录下的json文件保存租约，通过文件锁(flock)保证多进程互斥。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, "lease.lock")
+        self._data_path = os.path.join(directory, "lease.json")
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                data = {"lease": {}, "member": {}}
+                if os.path.exists(self._data_path):
+                    with open(self._data_path) as f:
+                        data = json.load(f)
+                yield data
+                tmp_path = self._data_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self._data_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def heartbeat(self, member: str, ttl: float, now: float):
+        with self._locked() as data:
+            member_d: dict[str, float] = data["member"]
+            member_d[member] = now + ttl
+            for key in [k for k, v in member_d.items() if v <= now]:
+                member_d.pop(key)
+
+    def get_live_member_s(self, now: float):
+        with self._locked() as data:
+            return sorted(k for k, v in data["member"].items() if v > now)
+
+    def try_acquire(self, key: str, holder: str, ttl: float, now: float):
+        with self._locked() as data:
+            lease = data["lease"].get(key)
+            if lease and lease[0] != holder and lease[1] > now:
+                return False
+            data["lease"][key] = [holder, now + ttl]
+            return True
+
+    def release(self, key: str, holder: str):
+        with self._locked() as data:
+            lease = data["lease"].get(key)
+            if lease and lease[0] == holder:
+                data["lease"].pop(key)
+
+    def get_holder(self, key: str, now: float):
+        with self._locked() as data:
+            lease = data["lease"].get(key)
+            if lease and lease[1] > now:
+                return lease[0]
+            return None
+
+
+def create_lease_store(url: str) -> LeaseStore:
+    """
+    sqlite:///var/lib/cscdn/lease.db 或者 file:///var/lib/cscdn/lease
+    """
+    parsed = urlparse(url)
+    path = parsed.netloc + parsed.path
+    if parsed.scheme == "sqlite":
+        return SqliteLeaseStore(path)
+    if parsed.scheme == "file":
+        return FileLeaseStore(path)
+    raise ValueError(f"unsupported coordination url {url}")
+
+
+def default_member_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _rendezvous_score(key: str, member: str):
+    return hashlib.sha1(f"{key}\n{member}".encode()).digest()
+
+
+class TargetCoordinator:
+    """
+    多副本协调：每个目标只由一个副本下发规则，其他副本作为备用，继续消费decision保持状态。
+
+    使用最高随机权重(rendezvous hashing)在存活副本之间分配目标，
+    副本下线后心跳过期，目标会在租约过期后由新的首选副本接管。
+    """
+
+    def __init__(self, store: LeaseStore, member_id: str, ttl: float = 60):
+        self.store = store
+        self.member_id = member_id
+        self.ttl = ttl
+        self._owned_key_s: set[str] = set()
+        # 接管后已经成功下发过完整状态的目标
+        self._synced_key_s: set[str] = set()
+
+    def get_preferred_member(self, key: str, member_s: Iterable[str]) -> str | None:
+        member_s = list(member_s)
+        if not member_s:
+            return None
+        return max(member_s, key=lambda m: _rendezvous_score(key, m))
+
+    def update(self, key_s: Iterable[str], now: float | None = None):
+        """
+        续期心跳和租约，返回 (当前持有的目标, 需要下发完整状态的目标)。
+
+        新接管的目标在 mark_synced 之前每次都会返回，下发失败时在下个周期重试。
+        """
+        if now is None:
+            now = time.time()
+        key_s = list(key_s)
+        self.store.heartbeat(self.member_id, self.ttl, now)
+        member_s = self.store.get_live_member_s(now)
+        owned_key_s: set[str] = set()
+        for key in key_s:
+            preferred = self.get_preferred_member(key, member_s)
+            if preferred == self.member_id:
+                if self.store.try_acquire(key, self.member_id, self.ttl, now):
+                    owned_key_s.add(key)
+            elif key in self._owned_key_s:
+                self.store.release(key, self.member_id)
+        # 配置中已经移除的目标
+        for key in self._owned_key_s - set(key_s):
+            self.store.release(key, self.member_id)
+        for key in sorted(owned_key_s - self._owned_key_s):
+            LOG.info(f"replica {self.member_id} acquired target {key}")
+        for key in sorted(self._owned_key_s - owned_key_s):
+            LOG.info(f"replica {self.member_id} released target {key}")
+        self._owned_key_s = owned_key_s
+        self._synced_key_s &= owned_key_s
+        return owned_key_s, owned_key_s - self._synced_key_s
+
+    def mark_synced(self, key: str):
+        """目标已经成功下发完整状态"""
+        if key in self._owned_key_s:
+            self._synced_key_s.add(key)
+
+    def renew(self, key: str, now: float | None = None) -> bool:
+        """
+        修改目标前续期租约，租约已经被其他副本获取时返回False，不能再修改该目标
+        """
+        if now is None:
+            now = time.time()
+        if key in self._owned_key_s and self.store.try_acquire(key, self.member_id, self.ttl, now):
+            return True
+        LOG.warning(f"replica {self.member_id} lost target {key}, skip apply")
+        self._owned_key_s.discard(key)
+        self._synced_key_s.discard(key)
+        return False
@@ -1,75 +1,484 @@
+import functools
+import itertools
 import logging
+import os
+import signal
+import sys
+import threading
 import time
-from collections import OrderedDict
+from collections.abc import Callable
+from typing import TYPE_CHECKING
 
-from pycrowdsec.client import QueryClient, StreamDecisionClient
+from app.apply_journal import ApplyJournal
+from app.config import (
+    ENV_PREFIX,
+    AppSettings,
+    diff_config,
+    get_config,
+    get_envfile_path,
+    reload_config,
+)
+from app.coordination import TargetCoordinator, create_lease_store, default_member_id
+from app.decision_recorder import DecisionRecorder
+from app.decision_store import DecisionStore, GraceLRU
+from app.ip_list import AppliedIpList
+from app.log_render import CappedList
+from app.prefix_db import PrefixDB
+from app.target_backend import (
+    AggregationCache,
+    PreparedDecision,
+    TargetBackend,
+    TargetKey,
+    get_target_key,
+)
+from app.target_registry import create_target_s, update_target_s
 
-from app.config import CONFIG
-from app.tencent_cdn_api import TencentCdnAPI
-from app.tencent_edgeone_api import TencentEdgeoneAPI
+if TYPE_CHECKING:
+    from pycrowdsec.client import StreamDecisionClient
 
 LOG = logging.getLogger(__name__)
 
+# 不可用的LAPI重试间隔
+CROWDSEC_RETRY_INTERVAL = 60
 
-class CrowdsecDecisionHandler:
-    def __init__(self) -> None:
-        self.crowdsec_client = StreamDecisionClient(
-            lapi_url=CONFIG.crowdsec_lapi_url,
-            api_key=CONFIG.crowdsec_lapi_key,
-            interval=CONFIG.crowdsec_stream_interval,
+# 每次从stream client取出的decision数量，启动时的全量decision分块处理
+DECISION_CHUNK_SIZE = 10000
+
+# 日志中最多保留的新封禁IP数量
+NEW_DECISION_LOG_SIZE = 1000
+
+# 重新加载时不生效的配置，需要重启
+RESTART_REQUIRED_FIELD_S = {
+    "crowdsec_lapi_key",
+    "crowdsec_lapi_url",
+    "crowdsec_stream_interval",
+    "crowdsec_stream_direct",
+    "coordination_url",
+    "coordination_lease_ttl",
+    "replica_id",
+}
+
+
+def get_lapi_s(config: AppSettings) -> list[tuple[str, str]]:
+    """
+    crowdsec LAPI列表: [(url, key)]，多个url和key使用逗号分隔，
+    只配置一个key时所有LAPI共用。
+    """
+    url_s = [x.strip() for x in config.crowdsec_lapi_url.split(",") if x.strip()]
+    key_s = [x.strip() for x in config.crowdsec_lapi_key.split(",") if x.strip()]
+    if len(key_s) == 1:
+        key_s = key_s * len(url_s)
+    if not url_s or len(key_s) != len(url_s):
+        raise ValueError(
+            f"crowdsec lapi url count {len(url_s)} not match key count {len(key_s)}"
+        )
+    return list(zip(url_s, key_s))
+
+
+def create_crowdsec_client_s(
+    config: AppSettings,
+    sink_factory: Callable[[str], Callable[[list[dict], list[dict], float], None]] | None = None,
+) -> list[tuple[str, "StreamDecisionClient"]]:
+    """
+    每个LAPI创建一个stream client: [(source, client)]，只有一个LAPI时source为空。
+    配置了 crowdsec_stream_direct 时，sink_factory(source) 返回该LAPI的decision处理函数，
+    stream线程解析后直接调用。
+    """
+    from app.decision_stream import StreamingDecisionClient
+
+    lapi_s = get_lapi_s(config)
+    ret = []
+    for url, key in lapi_s:
+        client = StreamingDecisionClient(
+            lapi_url=url,
+            api_key=key,
+            interval=config.crowdsec_stream_interval,
             scopes=["ip", "range"],
             only_include_decisions_from=["crowdsec"],
         )
-        if CONFIG.tencent_cdn_domain:
-            self.cdn_api = TencentCdnAPI(
-                secret_id=CONFIG.tencent_secret_id,
-                secret_key=CONFIG.tencent_secret_key,
+        source = url if len(lapi_s) > 1 else ""
+        if config.crowdsec_stream_direct and sink_factory is not None:
+            client.sink = sink_factory(source)
+        ret.append((source, client))
+    return ret
+
+
+def _get_lease_key(key: TargetKey):
+    kind, target_id = key
+    return f"{kind}:{target_id}"
+
+
+class CrowdsecDecisionHandler:
+    def __init__(
+        self,
+        crowdsec_client: "StreamDecisionClient | None" = None,
+        config: AppSettings | None = None,
+    ) -> None:
+        self.config = config or get_config()
+        # stream线程和主循环共用decision状态
+        self._lock = threading.RLock()
+        # stream client list: (source, client)
+        if crowdsec_client is None:
+            self.crowdsec_client_s = create_crowdsec_client_s(
+                self.config, sink_factory=self._get_decision_sink
             )
         else:
-            self.cdn_api = None
-        if CONFIG.tencent_teo_zone_id:
-            self.teo_api = TencentEdgeoneAPI(
-                secret_id=CONFIG.tencent_secret_id,
-                secret_key=CONFIG.tencent_secret_key,
+            self.crowdsec_client_s = [("", crowdsec_client)]
+        # target list: (domain or zone_id, api)，只导入已配置目标的SDK
+        self.target_s: list[tuple[str, TargetBackend]] = create_target_s(self.config)
+        self.recorder = self._create_recorder(self.config)
+        self.journal = self._create_journal(self.config)
+        # 可选的前缀数据库，用于按公告前缀合并IP
+        self.prefix_db = self._create_prefix_db(self.config)
+        self.aggregation_pool = self._create_aggregation_pool(self.config)
+        # 所有LAPI的decision合并去重
+        self._decision_store = DecisionStore()
+        # 最近解封的IP，宽限期内仍然下发，避免反复封禁时频繁修改规则
+        self._grace = GraceLRU(self.config.decision_grace_window, self.config.decision_grace_max_size)
+        # 每个目标最近一次成功下发的IP列表(聚合后)
+        self._applied_ip_d: dict[TargetKey, AppliedIpList] = {}
+        # 当前收集周期的标识(上一轮处理的时间)，录制时同一个周期的批次回放为一个周期
+        self._cycle_key = time.time()
+        # 本轮开始时的 (时间, monotonic)
+        self._cycle_start = (time.time(), time.monotonic())
+        # 上次处理后新增的封禁，只保留数量和用于日志的前一部分IP
+        self._num_new_decision = 0
+        self._new_decision_ip_s: list[str] = []
+        # 宽限期内再次封禁的IP
+        self._reban_ip_s: list[str] = []
+        # 宽限期结束(或被淘汰)的IP
+        self._release_ip_s: list[str] = []
+        # 多副本时每个目标只由一个副本下发，未配置时下发所有目标
+        self.coordinator: TargetCoordinator | None = None
+        if self.config.coordination_url:
+            self.coordinator = TargetCoordinator(
+                create_lease_store(self.config.coordination_url),
+                member_id=self.config.replica_id or default_member_id(),
+                ttl=self.config.coordination_lease_ttl,
             )
-        else:
-            self.teo_api = None
-        # decision dict: value(ip) -> decision
-        self._current_decision_d = OrderedDict()
+            # 租约在修改前续期，单次修改需要在租约过期前完成
+            push_timeout = (
+                self.config.tencent_http_connect_timeout + self.config.tencent_http_read_timeout
+            )
+            if self.config.coordination_lease_ttl <= push_timeout:
+                LOG.warning(
+                    f"coordination_lease_ttl {self.config.coordination_lease_ttl}s should be"
+                    f" longer than the api timeout {push_timeout}s"
+                )
+        # 重新加载配置后需要下发的目标
+        self._pending_target_key_s: set[TargetKey] = set()
+        self._reload_requested = False
+        self._envfile_path: str | None = None
+        self._envfile_mtime: float | None = None
+        # 已启动stream的LAPI来源，其他来源不可用时定期重试
+        self._started_source_s: set[str] = set()
+        self._next_crowdsec_retry_at = 0.0
+
+    def _create_recorder(self, config: AppSettings):
+        if not config.crowdsec_record_path:
+            return None
+        return DecisionRecorder(config.crowdsec_record_path)
+
+    def _create_journal(self, config: AppSettings):
+        if not config.apply_journal_path:
+            return None
+        return ApplyJournal(
+            config.apply_journal_path,
+            max_bytes=config.apply_journal_max_bytes,
+            backup_count=config.apply_journal_backup_count,
+        )
+
+    def _create_prefix_db(self, config: AppSettings):
+        if not config.prefix_db_path:
+            return None
+        return PrefixDB(config.prefix_db_path)
+
+    def _create_aggregation_pool(self, config: AppSettings):
+        if config.aggregation_workers <= 0:
+            return None
+        from app.aggregation_pool import AggregationPool
+
+        return AggregationPool(config.aggregation_workers)
+
+    def reload_config(self, config: AppSettings):
+        """
+        应用新的配置，只重新创建变化的目标后端，保留decision状态。
+        返回变化的配置项。
+        """
+        changed_field_s = diff_config(self.config, config)
+        if not changed_field_s:
+            LOG.info("config not changed")
+            return changed_field_s
+        LOG.info(f"reload config, changed: {', '.join(sorted(changed_field_s))}")
+        restart_field_s = changed_field_s & RESTART_REQUIRED_FIELD_S
+        if restart_field_s:
+            LOG.warning(f"config requires restart to take effect: {', '.join(sorted(restart_field_s))}")
+            config = config.model_copy(
+                update={name: getattr(self.config, name) for name in restart_field_s}
+            )
+        # 先创建新的目标和组件，创建失败时保持原配置不变
+        target_s, changed_key_s = update_target_s(self.target_s, self.config, config)
+        replace_d = {}
+        try:
+            if "crowdsec_record_path" in changed_field_s:
+                replace_d["recorder"] = self._create_recorder(config)
+            if changed_field_s & {
+                "apply_journal_path",
+                "apply_journal_max_bytes",
+                "apply_journal_backup_count",
+            }:
+                replace_d["journal"] = self._create_journal(config)
+            if "prefix_db_path" in changed_field_s:
+                replace_d["prefix_db"] = self._create_prefix_db(config)
+            if "aggregation_workers" in changed_field_s:
+                replace_d["aggregation_pool"] = self._create_aggregation_pool(config)
+        except Exception:
+            for item in replace_d.values():
+                if item:
+                    item.close()
+            raise
+        # 全部创建成功后一起替换
+        if "log_level" in changed_field_s:
+            logging.getLogger().setLevel(config.log_level)
+        self.target_s = target_s
+        if changed_key_s:
+            LOG.info(f"targets to apply after reload: {', '.join(x[1] for x in changed_key_s)}")
+        self._pending_target_key_s.update(changed_key_s)
+        if any(x.startswith("tencent_http_") for x in changed_field_s):
+            self._close_tencent_session_s(config)
+        with self._lock:
+            for name, item in replace_d.items():
+                old_item = getattr(self, name)
+                if old_item:
+                    old_item.close()
+                setattr(self, name, item)
+        if changed_field_s & {"decision_grace_window", "decision_grace_max_size"}:
+            with self._lock:
+                self._grace.ttl = config.decision_grace_window
+                self._grace.max_size = config.decision_grace_max_size
+                is_grace_cleared = config.decision_grace_window <= 0 and self._grace.clear()
+            if is_grace_cleared:
+                # 关闭宽限期，移除仍在下发列表中的已解封IP
+                self._pending_target_key_s.update(get_target_key(*x) for x in self.target_s)
+        if changed_field_s & {"prefix_db_path", "prefix_merge_density"}:
+            # 聚合方式变化，所有目标都需要重新下发
+            self._pending_target_key_s.update(get_target_key(*x) for x in self.target_s)
+        self.config = config
+        return changed_field_s
+
+    def _close_tencent_session_s(self, config: AppSettings):
+        """
+        腾讯云连接参数变化后，目标已经使用新的会话，关闭旧的连接池
+        """
+        # 没有导入时不存在共享会话，也不需要导入SDK
+        if "app.tencent_client" not in sys.modules:
+            return
+        from app.tencent_client import TransportOptions, close_shared_session_s
+
+        num_close = close_shared_session_s([TransportOptions.from_config(config)])
+        if num_close:
+            LOG.info(f"closed {num_close} unused tencent http session")
+
+    def request_reload(self, *args):
+        """SIGHUP信号处理，在主循环中重新加载配置"""
+        self._reload_requested = True
+
+    def _get_envfile_mtime(self):
+        if not self._envfile_path:
+            return None
+        try:
+            return os.stat(self._envfile_path).st_mtime
+        except OSError:
+            return None
+
+    def _check_reload(self):
+        if self.config.config_watch:
+            mtime = self._get_envfile_mtime()
+            if mtime != self._envfile_mtime:
+                LOG.info(f"envfile {self._envfile_path} changed")
+                self._envfile_mtime = mtime
+                self._reload_requested = True
+        if not self._reload_requested:
+            return
+        self._reload_requested = False
+        try:
+            self.reload_config(reload_config())
+        except Exception as ex:
+            LOG.error(f"reload config error {ex}", exc_info=ex)
+
+    def _check_crowdsec_client(self, crowdsec_client: "StreamDecisionClient"):
+        from pycrowdsec.client import QueryClient
 
-    def _check_crowdsec_client(self):
         client = QueryClient(
-            api_key=self.crowdsec_client.api_key,
-            lapi_url=self.crowdsec_client.lapi_url,
+            api_key=crowdsec_client.api_key,
+            lapi_url=crowdsec_client.lapi_url,
         )
         client.get_decisions_for("1.1.1.1")
 
+    def _start_crowdsec_client_s(self, now: float | None = None):
+        """
+        启动还没有运行的LAPI stream，不可用的LAPI在下次重试，返回运行中的LAPI数量。
+        stream线程退出的LAPI也会重新启动，启动时重新拉取全量decision。
+        """
+        if now is None:
+            now = time.time()
+        num_running = 0
+        for source, crowdsec_client in self.crowdsec_client_s:
+            if source in self._started_source_s:
+                if crowdsec_client.is_running():
+                    num_running += 1
+                    continue
+                LOG.error(f"crowdsec stream {crowdsec_client.lapi_url} stopped")
+                self._started_source_s.discard(source)
+            if now < self._next_crowdsec_retry_at:
+                continue
+            try:
+                self._check_crowdsec_client(crowdsec_client)
+                crowdsec_client.run()
+            except Exception as ex:
+                LOG.error(f"crowdsec lapi {crowdsec_client.lapi_url} not available: {ex}")
+                continue
+            LOG.info(f"crowdsec stream {crowdsec_client.lapi_url} started")
+            self._started_source_s.add(source)
+            num_running += 1
+        if num_running < len(self.crowdsec_client_s) and now >= self._next_crowdsec_retry_at:
+            self._next_crowdsec_retry_at = now + CROWDSEC_RETRY_INTERVAL
+        return num_running
+
     def _check_target_api(self):
-        domain = CONFIG.tencent_cdn_domain
-        if self.cdn_api and domain:
-            result = self.cdn_api.get_domain_config(domain)
-            if result is None:
-                raise RuntimeError(f"tencent cdn domain {domain} not found")
-        zone_id = CONFIG.tencent_teo_zone_id
-        if self.teo_api and zone_id:
-            result = self.teo_api.get_zone_config(zone_id)
-            if result is None:
-                raise RuntimeError(f"tencent teo zone {zone_id} not found")
+        for domain, api in self.target_s:
+            api.check_target(domain)
 
-    def _get_ban_ip_list(self):
-        ret = [x["value"] for x in self._current_decision_d.values()]
+    def _get_active_ip_list(self):
+        ret = self._decision_store.ip_list()
         # 按倒序排列，decision中越新的越靠后
-        return list(reversed(ret))
+        ret.reverse()
+        return ret
+
+    def _get_ban_ip_list(self):
+        """
+        下发列表: 生效的封禁在前，宽限期内的IP在末尾，每个目标按自己的剩余容量保留
+        """
+        return self._get_active_ip_list() + self._grace.ip_list()
+
+    def _unban(self, ip_s: list[str], now: float) -> list[str]:
+        """
+        解封的IP进入宽限期，返回不再保留的IP列表
+        """
+        ret: list[str] = []
+        for ip in ip_s:
+            ret.extend(self._grace.add(ip, now))
+        return ret
+
+    def _apply_decision(
+        self,
+        ban_ip_list: list[str],
+        target_s: list[tuple[str, TargetBackend]] | None = None,
+        grace_ip_list: list[str] | None = None,
+    ):
+        """
+        下发到目标，单个目标出错时继续下发其他目标，返回下发成功的目标
+        """
+        if target_s is None:
+            target_s = self.target_s
+        # 限制相同的目标共用聚合结果，宽限期IP只占用每个目标聚合后剩余的容量
+        cache = AggregationCache(
+            ban_ip_list,
+            grace_ip_list=grace_ip_list,
+            prefix_db=self.prefix_db,
+            prefix_merge_density=self.config.prefix_merge_density,
+            pool=self.aggregation_pool,
+        )
+        # 先读取所有目标的远端状态，不同的聚合参数可以在进程池中并行计算
+        prepared_s: list[tuple[str, TargetBackend, PreparedDecision]] = []
+        for domain, api in target_s:
+            try:
+                prepared = api.prepare_decision(domain)
+            except Exception as ex:
+                LOG.error(f"prepare decision for {domain} error {ex}", exc_info=ex)
+                continue
+            if prepared is not None:
+                prepared_s.append((domain, api, prepared))
+        cache.prefetch([prepared.spec for _, _, prepared in prepared_s])
+        applied_target_s: list[tuple[str, TargetBackend]] = []
+        for domain, api, prepared in prepared_s:
+            result = cache.get(prepared.spec)
+            # 读取和聚合可能耗时较长，修改前按当前时间确认租约仍由本副本持有
+            lease_key = _get_lease_key(get_target_key(domain, api))
+            if self.coordinator is not None and not self.coordinator.renew(
+                lease_key, now=self._get_current_time()
+            ):
+                continue
+            try:
+                ok = api.apply_prepared(prepared, result, journal=self.journal)
+            except Exception as ex:
+                LOG.error(f"apply decision to {domain} error {ex}", exc_info=ex)
+                continue
+            if ok:
+                applied_target_s.append((domain, api))
+                self._applied_ip_d[get_target_key(domain, api)] = AppliedIpList(result.ip_s)
+        LOG.debug(f"apply decision to {len(target_s)} targets, aggregation={cache.num_compute}")
+        return applied_target_s
+
+    def _get_current_time(self):
+        """
+        本轮开始的时间加上已经经过的时间
+        """
+        cycle_now, cycle_monotonic = self._cycle_start
+        return cycle_now + time.monotonic() - cycle_monotonic
+
+    def _get_decision_sink(self, source: str):
+        return functools.partial(self._consume_decision_s, source)
+
+    def _consume_decision_s(
+        self,
+        source: str,
+        new_decision_s: list[dict],
+        deleted_decision_s: list[dict],
+        now: float | None = None,
+    ):
+        """
+        一块decision写入DecisionStore，stream线程中直接调用，也用于从队列中取出的decision
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            for decision in deleted_decision_s:
+                if self._decision_store.remove(decision, source=source):
+                    self._release_ip_s.extend(self._unban([decision["value"]], now))
+            if self.recorder:
+                self.recorder.record(
+                    new_decision_s,
+                    deleted_decision_s,
+                    ts=now,
+                    source=source,
+                    cycle=self._cycle_key,
+                )
+            for decision in new_decision_s:
+                # 已经被其他LAPI封禁的IP不需要重新下发
+                if not self._decision_store.add(decision, source=source, now=now):
+                    continue
+                ip = decision["value"]
+                if self._grace.pop(ip):
+                    self._reban_ip_s.append(ip)
+                    continue
+                self._num_new_decision += 1
+                if len(self._new_decision_ip_s) < NEW_DECISION_LOG_SIZE:
+                    self._new_decision_ip_s.append(ip)
 
-    def _apply_decision(self, ban_ip_list: list[str]):
-        domain = CONFIG.tencent_cdn_domain
-        if self.cdn_api and domain:
-            self.cdn_api.apply_decision(domain=domain, ban_ip_list=ban_ip_list)
-        zone_id = CONFIG.tencent_teo_zone_id
-        if self.teo_api and zone_id:
-            self.teo_api.apply_decision(domain=zone_id, ban_ip_list=ban_ip_list)
+    def _get_owned_target_s(self, now: float):
+        """
+        返回 (本副本负责的目标, 接管后还没有成功下发的目标)
+        """
+        if self.coordinator is None:
+            return self.target_s, []
+        lease_key_d = {_get_lease_key(get_target_key(*x)): x for x in self.target_s}
+        owned_key_s, unsynced_key_s = self.coordinator.update(lease_key_d.keys(), now=now)
+        owned_target_s = [x for k, x in lease_key_d.items() if k in owned_key_s]
+        unsynced_target_s = [x for k, x in lease_key_d.items() if k in unsynced_key_s]
+        return owned_target_s, unsynced_target_s
 
-    def _handle_crowdsec_decision(self):
+    def _handle_crowdsec_decision(self, now: float | None = None):
         """
         Decision example: {
             "duration": "1m43s",
@@ -82,34 +491,121 @@ class CrowdsecDecisionHandler:
             "value": "x.x.x.x"
         }
         """
-        for decision in self.crowdsec_client.get_deleted_decision():
-            ip = decision["value"]
-            self._current_decision_d.pop(ip, None)
-        new_decision_ip_s = []
-        for decision in self.crowdsec_client.get_new_decision():
-            ip = decision["value"]
-            self._current_decision_d[ip] = decision
-            new_decision_ip_s.append(ip)
-        num_new = len(new_decision_ip_s)
+        if now is None:
+            now = time.time()
+        self._cycle_start = (now, time.monotonic())
+        with self._lock:
+            # 没有sink的client(例如回放)从队列中取出
+            for source, crowdsec_client in self.crowdsec_client_s:
+                deleted_decision_s = list(crowdsec_client.get_deleted_decision())
+                # 分块处理，启动时不需要同时保存完整的decision列表
+                new_decision_iter = crowdsec_client.get_new_decision()
+                while True:
+                    new_decision_s = list(itertools.islice(new_decision_iter, DECISION_CHUNK_SIZE))
+                    if new_decision_s or deleted_decision_s:
+                        self._consume_decision_s(source, new_decision_s, deleted_decision_s, now)
+                    deleted_decision_s = []
+                    if len(new_decision_s) < DECISION_CHUNK_SIZE:
+                        break
+            # 兜底清理过期的decision，例如某个LAPI长时间不可用
+            self._release_ip_s.extend(self._unban(self._decision_store.expire(now), now))
+            self._release_ip_s.extend(self._grace.expire(now))
+            num_new = self._num_new_decision
+            new_decision_ip_s = self._new_decision_ip_s
+            reban_ip_s = self._reban_ip_s
+            release_ip_s = self._release_ip_s
+            self._num_new_decision = 0
+            self._new_decision_ip_s = []
+            self._reban_ip_s = []
+            self._release_ip_s = []
+            self._cycle_key = now
+        owned_target_s, unsynced_target_s = self._get_owned_target_s(now)
+        # 已经移除的目标不再需要下发
+        target_key_s = {get_target_key(*x) for x in self.target_s}
+        self._pending_target_key_s &= target_key_s
+        self._applied_ip_d = {k: v for k, v in self._applied_ip_d.items() if k in target_key_s}
+        # 宽限期内再次封禁的IP，只有所有目标的规则中都还有时才不需要修改
+        reban_ip_s, missing_ip_s = self._split_applied_ip_s(reban_ip_s, owned_target_s)
+        num_new += len(missing_ip_s)
+        new_decision_ip_s.extend(missing_ip_s[: NEW_DECISION_LOG_SIZE])
+        if reban_ip_s:
+            LOG.info("reban within grace window num=%d: %s", len(reban_ip_s), CappedList(reban_ip_s))
         if num_new > 0:
-            ip_list_str = "\n".join(new_decision_ip_s)
-            LOG.info(f"new crowdsec decision num={num_new}:\n{ip_list_str}")
-            ban_ip_list = self._get_ban_ip_list()
-            self._apply_decision(ban_ip_list)
+            LOG.info("new crowdsec decision num=%d: %s", num_new, CappedList(new_decision_ip_s))
+            self._push_decision(owned_target_s, now)
+            return
+        # 宽限期结束的IP仍在目标的规则中时才需要修改该目标
+        if self.config.decision_grace_window > 0 and release_ip_s:
+            release_target_s = [
+                x for x in owned_target_s if self._has_applied_ip(get_target_key(*x), release_ip_s)
+            ]
+            if release_target_s:
+                LOG.info(
+                    "grace window ended num=%d: %s", len(release_ip_s), CappedList(release_ip_s)
+                )
+                self._push_decision(release_target_s, now)
+                return
+        # 接管其他副本的目标，或者重新加载配置后新增、变化的目标，decision状态是完整的，直接下发
+        # 下发失败的目标保留在待下发列表中，下一轮重试
+        push_target_s = [
+            x
+            for x in owned_target_s
+            if x in unsynced_target_s or get_target_key(*x) in self._pending_target_key_s
+        ]
+        if push_target_s:
+            self._push_decision(push_target_s, now)
+
+    def _has_applied_ip(self, key: TargetKey, ip_s: list[str]):
+        applied = self._applied_ip_d.get(key)
+        return applied is not None and any(x in applied for x in ip_s)
+
+    def _split_applied_ip_s(self, ip_s: list[str], target_s: list[tuple[str, TargetBackend]]):
+        """
+        返回 (所有目标都已下发的IP, 至少一个目标没有下发的IP)
+        """
+        applied_s = [self._applied_ip_d.get(get_target_key(*x)) for x in target_s]
+        applied_ip_s: list[str] = []
+        missing_ip_s: list[str] = []
+        for ip in ip_s:
+            if all(x is not None and ip in x for x in applied_s):
+                applied_ip_s.append(ip)
+            else:
+                missing_ip_s.append(ip)
+        return applied_ip_s, missing_ip_s
+
+    def _push_decision(self, target_s: list[tuple[str, TargetBackend]], now: float):
+        with self._lock:
+            ban_ip_list = self._get_active_ip_list()
+            grace_ip_list = self._grace.ip_list()
+        applied_target_s = self._apply_decision(ban_ip_list, target_s, grace_ip_list)
+        for target in applied_target_s:
+            key = get_target_key(*target)
+            self._pending_target_key_s.discard(key)
+            if self.coordinator is not None:
+                self.coordinator.mark_synced(_get_lease_key(key))
+        return applied_target_s
 
     def main(self, dryrun: bool = False):
         flag = "[DRYRUN] " if dryrun else ""
         LOG.info(f"{flag}starting crowdsec cdn bouncer")
-        self._check_crowdsec_client()
         self._check_target_api()
-        self.crowdsec_client.run()
+        # 部分LAPI不可用时继续运行，所有LAPI都不可用时退出
+        if self._start_crowdsec_client_s() <= 0:
+            raise RuntimeError("no crowdsec lapi available")
         # Wait for initial polling by bouncer, so we start with a hydrated state
         time.sleep(3)
         LOG.info(f"{flag}crowdsec cdn bouncer running")
         if dryrun:
             return
-        while True and self.crowdsec_client.is_running():
+        signal.signal(signal.SIGHUP, self.request_reload)
+        self._envfile_path = get_envfile_path(env_prefix=ENV_PREFIX)
+        self._envfile_mtime = self._get_envfile_mtime()
+        while True:
             time.sleep(10)
+            if self._start_crowdsec_client_s() <= 0:
+                LOG.error("all crowdsec streams stopped")
+                break
+            self._check_reload()
             try:
                 self._handle_crowdsec_decision()
             except Exception as ex:
@@ -0,0 +1,84 @@
+import gzip
+import json
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import TextIO
+
+
+@dataclass
+class DecisionBatch:
+    ts: float
+    new_s: list[dict]
+    deleted_s: list[dict]
+    # 多个LAPI时的来源，同一个周期的批次ts相同
+    source: str = ""
+    # handler处理周期的标识，stream线程直接写入时同一个周期的批次ts可能不同
+    cycle: float | None = None
+
+
+def _open_log(path: str, mode: str) -> TextIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")  # type: ignore
+    return open(path, mode, encoding="utf-8")
+
+
+class DecisionRecorder:
+    """
+    记录crowdsec decision stream原始批次，用于离线回放。
+
+    每个批次一行json: {"ts": 1700000000.0, "source": "...", "cycle": ..., "new": [...], "deleted": [...]}
+    只有一个LAPI时不记录source，cycle 为同一个处理周期的标识，没有时按ts分组。
+    文件名以.gz结尾时使用gzip压缩，每个批次写入后flush，进程退出不会丢失记录。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: TextIO | None = None
+
+    def _get_file(self):
+        if self._file is None:
+            self._file = _open_log(self.path, "a")
+        return self._file
+
+    def record(
+        self,
+        new_s: list[dict],
+        deleted_s: list[dict],
+        ts: float | None = None,
+        source: str = "",
+        cycle: float | None = None,
+    ):
+        if not new_s and not deleted_s:
+            return
+        item: dict = {"ts": time.time() if ts is None else ts}
+        if source:
+            item["source"] = source
+        if cycle is not None:
+            item["cycle"] = cycle
+        item["new"] = new_s
+        item["deleted"] = deleted_s
+        file = self._get_file()
+        file.write(json.dumps(item, separators=(",", ":")) + "\n")
+        file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_decision_log(path: str) -> Iterator[DecisionBatch]:
+    with _open_log(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            yield DecisionBatch(
+                ts=item["ts"],
+                new_s=item.get("new") or [],
+                deleted_s=item.get("deleted") or [],
+                source=item.get("source") or "",
+                cycle=item.get("cycle"),
+            )
@@ -0,0 +1,234 @@
+import statistics
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from app.config import AppSettings
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_recorder import DecisionBatch
+from app.target_backend import IpListResult, PreparedDecision, TargetBackend
+
+if TYPE_CHECKING:
+    from app.fake_tencent import FakeCallStat, FakeTencentBackend
+
+
+class ReplayDecisionClient:
+    """
+    替代StreamDecisionClient，按批次输出录制的decision。
+    """
+
+    def __init__(self):
+        self._new_s: deque[dict] = deque()
+        self._deleted_s: deque[dict] = deque()
+
+    def load(self, batch: DecisionBatch):
+        self._new_s.extend(batch.new_s)
+        self._deleted_s.extend(batch.deleted_s)
+
+    def get_new_decision(self):
+        while self._new_s:
+            yield self._new_s.popleft()
+
+    def get_deleted_decision(self):
+        while self._deleted_s:
+            yield self._deleted_s.popleft()
+
+    def run(self):
+        pass
+
+    def is_running(self):
+        return True
+
+
+class StubTargetAPI(TargetBackend):
+    """
+    替代真实CDN API的内存后端，和真实后端一样聚合IP列表，只记录最后一次下发的结果。
+    """
+
+    kind = "stub"
+
+    def __init__(self, max_ip: int = 100000):
+        self._max_ip = max_ip
+        self.num_apply = 0
+        self.ban_ip_list_d: dict[str, list[str]] = {}
+
+    @classmethod
+    def from_config(cls, config: AppSettings):
+        return cls()
+
+    @property
+    def max_ip(self):
+        return self._max_ip
+
+    def check_target(self, domain: str):
+        pass
+
+    def prepare_decision(self, domain: str):
+        return self.load_state(domain, self.ban_ip_list_d.get(domain, []))
+
+    def dump_state(self, prepared: PreparedDecision):
+        return prepared.current_ip_s
+
+    def load_state(self, domain: str, data: list[str]):
+        return PreparedDecision(
+            domain=domain,
+            spec=self.get_ip_list_spec(),
+            current_ip_s=list(data),
+        )
+
+    def commit_decision(self, prepared: PreparedDecision, result: IpListResult):
+        self.num_apply += 1
+        self.ban_ip_list_d[prepared.domain] = list(result.ip_s)
+        return True
+
+
+def create_fake_target_s(config: AppSettings):
+    """
+    使用进程内的腾讯云模拟后端替代配置的腾讯云目标，执行完整的读取、聚合、分组和对比，
+    只是不访问网络。没有配置腾讯云目标时使用一个CDN域名和一个EdgeOne站点。
+    返回 (fake_backend, target_s)
+    """
+    from app.fake_tencent import FakeTencentBackend
+
+    fake_backend = FakeTencentBackend()
+    domain_s = [x.strip() for x in (config.tencent_cdn_domain or "").split(",") if x.strip()]
+    zone_id_s = [x.strip() for x in (config.tencent_teo_zone_id or "").split(",") if x.strip()]
+    if not domain_s and not zone_id_s:
+        domain_s = ["fake-cdn-domain"]
+        zone_id_s = ["fake-teo-zone"]
+    target_s: list[tuple[str, TargetBackend]] = []
+    if domain_s:
+        cdn_api = fake_backend.create_cdn_api()
+        for domain in domain_s:
+            fake_backend.add_domain(domain)
+            target_s.append((domain, cdn_api))
+    if zone_id_s:
+        teo_api = fake_backend.create_teo_api(max_rule=config.tencent_teo_max_rule)
+        for zone_id in zone_id_s:
+            fake_backend.add_zone(zone_id)
+            target_s.append((zone_id, teo_api))
+    return fake_backend, target_s
+
+
+@dataclass
+class ReplayReport:
+    num_cycle: int = 0
+    num_new: int = 0
+    num_deleted: int = 0
+    wall_time: float = 0
+    cycle_latency_s: list[float] = field(default_factory=list)
+    final_ban_count: int = 0
+    final_rule_d: dict[str, int] = field(default_factory=dict)
+    api_stat_d: dict[str, "FakeCallStat"] = field(default_factory=dict)
+
+    @property
+    def handle_time(self):
+        return sum(self.cycle_latency_s)
+
+    @property
+    def throughput(self):
+        """每秒处理的decision数量，不计回放等待时间"""
+        if self.handle_time <= 0:
+            return 0.0
+        return (self.num_new + self.num_deleted) / self.handle_time
+
+    def _latency_percentile(self, percent: int):
+        if not self.cycle_latency_s:
+            return 0.0
+        if len(self.cycle_latency_s) == 1:
+            return self.cycle_latency_s[0]
+        quantile_s = statistics.quantiles(self.cycle_latency_s, n=100)
+        return quantile_s[percent - 1]
+
+    def format(self):
+        latency_s = self.cycle_latency_s or [0.0]
+        line_s = [
+            f"cycles={self.num_cycle} new={self.num_new} deleted={self.num_deleted}",
+            f"wall_time={self.wall_time:.3f}s handle_time={self.handle_time:.3f}s"
+            f" throughput={self.throughput:.1f} decision/s",
+            f"cycle latency p50={self._latency_percentile(50) * 1000:.2f}ms"
+            f" p95={self._latency_percentile(95) * 1000:.2f}ms"
+            f" max={max(latency_s) * 1000:.2f}ms",
+            f"final ban ip count={self.final_ban_count}",
+        ]
+        for target, num_ip in self.final_rule_d.items():
+            line_s.append(f"final rule {target} num_ip={num_ip}")
+        for action, stat in self.api_stat_d.items():
+            line_s.append(
+                f"api {action} calls={stat.num_call} errors={stat.num_error}"
+                f" request_bytes={stat.request_bytes} response_bytes={stat.response_bytes}"
+            )
+        return "\n".join(line_s)
+
+
+def _get_cycle_key(batch: DecisionBatch):
+    return batch.ts if batch.cycle is None else batch.cycle
+
+
+def _iter_cycle_s(batch_s: Iterable[DecisionBatch]) -> Iterator[list[DecisionBatch]]:
+    """
+    同一个周期的批次合并为一个周期：记录了cycle时按cycle分组，
+    否则同一个周期内不同LAPI的批次ts相同
+    """
+    cycle: list[DecisionBatch] = []
+    for batch in batch_s:
+        if cycle and _get_cycle_key(batch) != _get_cycle_key(cycle[0]):
+            yield cycle
+            cycle = []
+        cycle.append(batch)
+    if cycle:
+        yield cycle
+
+
+def replay_decision_log(
+    handler: CrowdsecDecisionHandler,
+    batch_s: Iterable[DecisionBatch],
+    speed: float = 0,
+    fake_backend: "FakeTencentBackend | None" = None,
+) -> ReplayReport:
+    """
+    将录制的decision批次依次送入handler._handle_crowdsec_decision。
+
+    speed=0 时尽可能快地回放，speed=1 时按原始时间间隔回放，speed=2 时两倍速。
+    fake_backend: handler的目标指向模拟实现时，报告其最终规则状态和接口调用统计。
+    """
+    # 每个LAPI来源对应一个回放client，回放时不再录制和记录下发日志，也不参与多副本协调
+    client_d: dict[str, ReplayDecisionClient] = {}
+    handler.crowdsec_client_s = []
+    handler.recorder = None
+    handler.coordinator = None
+    handler.journal = None
+    report = ReplayReport()
+    begin_time = time.monotonic()
+    first_ts: float | None = None
+    for cycle in _iter_cycle_s(batch_s):
+        ts = max(x.ts for x in cycle)
+        if first_ts is None:
+            first_ts = ts
+        if speed > 0:
+            wait_time = (ts - first_ts) / speed - (time.monotonic() - begin_time)
+            if wait_time > 0:
+                time.sleep(wait_time)
+        for batch in cycle:
+            client = client_d.get(batch.source)
+            if client is None:
+                client = client_d[batch.source] = ReplayDecisionClient()
+                handler.crowdsec_client_s.append((batch.source, client))  # type: ignore
+            client.load(batch)
+            report.num_new += len(batch.new_s)
+            report.num_deleted += len(batch.deleted_s)
+        t0 = time.perf_counter()
+        handler._handle_crowdsec_decision(now=ts)
+        report.cycle_latency_s.append(time.perf_counter() - t0)
+        report.num_cycle += 1
+    report.wall_time = time.monotonic() - begin_time
+    report.final_ban_count = len(handler._get_ban_ip_list())
+    for domain, api in handler.target_s:
+        if isinstance(api, StubTargetAPI):
+            report.final_rule_d[domain] = len(api.ban_ip_list_d.get(domain, []))
+    if fake_backend is not None:
+        report.final_rule_d.update(fake_backend.get_rule_state())
+        report.api_stat_d.update(fake_backend.stat_d)
+    return report
@@ -0,0 +1,163 @@
+import heapq
+import math
+import re
+from collections import OrderedDict
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(h|ms|us|µs|ns|m|s)")
+_DURATION_UNIT_D = {
+    "h": 3600,
+    "m": 60,
+    "s": 1,
+    "ms": 1e-3,
+    "us": 1e-6,
+    "µs": 1e-6,
+    "ns": 1e-9,
+}
+
+
+def parse_duration(duration: str | None) -> float:
+    """
+    解析crowdsec decision的duration，例如 "1m43s", "3h59m58.123s"，返回秒数。
+    无法解析时返回无穷大，表示不会自动过期。
+    """
+    if not duration:
+        return math.inf
+    duration = duration.strip()
+    sign = 1
+    if duration.startswith("-"):
+        sign = -1
+        duration = duration[1:]
+    total = 0.0
+    pos = 0
+    for match in _DURATION_RE.finditer(duration):
+        if match.start() != pos:
+            return math.inf
+        total += float(match.group(1)) * _DURATION_UNIT_D[match.group(2)]
+        pos = match.end()
+    if pos != len(duration) or pos == 0:
+        return math.inf
+    return sign * total
+
+
+class DecisionStore:
+    """
+    按IP去重的decision存储，支持多个crowdsec LAPI来源。
+
+    同一个IP被多个来源封禁时只保留一条记录，过期时间取最晚的一个，
+    所有来源都删除(或过期)后才解封。记录按首次封禁的先后顺序排列。
+    """
+
+    def __init__(self):
+        # ip -> {source: expire_at}
+        self._item_d: OrderedDict[str, dict[str, float]] = OrderedDict()
+        # 过期时间堆: (expire_at, ip, source)，过时的条目在出堆时跳过
+        self._expire_heap: list[tuple[float, str, str]] = []
+
+    def __len__(self):
+        return len(self._item_d)
+
+    def __contains__(self, ip: str):
+        return ip in self._item_d
+
+    def add(self, decision: dict, source: str = "", now: float = 0) -> bool:
+        """添加decision，IP之前没有被封禁时返回True"""
+        ip = decision["value"]
+        expire_at = now + parse_duration(decision.get("duration"))
+        if expire_at != math.inf:
+            heapq.heappush(self._expire_heap, (expire_at, ip, source))
+        source_d = self._item_d.get(ip)
+        if source_d is None:
+            self._item_d[ip] = {source: expire_at}
+            return True
+        source_d[source] = max(source_d.get(source, -math.inf), expire_at)
+        return False
+
+    def remove(self, decision: dict, source: str = "") -> bool:
+        """删除来源的decision，IP因此解封时返回True"""
+        ip = decision["value"]
+        source_d = self._item_d.get(ip)
+        if source_d is None:
+            return False
+        source_d.pop(source, None)
+        if source_d:
+            return False
+        self._item_d.pop(ip)
+        return True
+
+    def expire(self, now: float) -> list[str]:
+        """清理已过期的decision，返回解封的IP列表"""
+        ret: list[str] = []
+        heap = self._expire_heap
+        while heap and heap[0][0] <= now:
+            expire_at, ip, source = heapq.heappop(heap)
+            source_d = self._item_d.get(ip)
+            # 已删除或者被续期的条目
+            if source_d is None or source_d.get(source) != expire_at:
+                continue
+            source_d.pop(source)
+            if not source_d:
+                self._item_d.pop(ip)
+                ret.append(ip)
+        return ret
+
+    def get_expire_at(self, ip: str) -> float | None:
+        source_d = self._item_d.get(ip)
+        if not source_d:
+            return None
+        return max(source_d.values())
+
+    def ip_list(self) -> list[str]:
+        return list(self._item_d.keys())
+
+
+class GraceLRU:
+    """
+    最近解封的IP，宽限期(ttl秒)内仍然保留在下发列表的末尾，
+    短时间内再次被封禁时不需要重新下发。
+
+    按解封顺序排列，超过max_size时淘汰最早解封的IP。
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        # ip -> 宽限期结束时间
+        self._item_d: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self):
+        return len(self._item_d)
+
+    def __contains__(self, ip: str):
+        return ip in self._item_d
+
+    def add(self, ip: str, now: float) -> list[str]:
+        """添加解封的IP，返回因容量限制淘汰的IP列表"""
+        if self.ttl <= 0 or self.max_size <= 0:
+            return [ip]
+        self._item_d[ip] = now + self.ttl
+        self._item_d.move_to_end(ip)
+        ret: list[str] = []
+        while len(self._item_d) > self.max_size:
+            ret.append(self._item_d.popitem(last=False)[0])
+        return ret
+
+    def pop(self, ip: str) -> bool:
+        """IP再次被封禁，在宽限期内时返回True"""
+        return self._item_d.pop(ip, None) is not None
+
+    def expire(self, now: float) -> list[str]:
+        """返回宽限期已结束的IP列表"""
+        # ttl修改后结束时间不一定有序，条目不多，直接遍历
+        ret = [ip for ip, end_at in self._item_d.items() if end_at <= now]
+        for ip in ret:
+            self._item_d.pop(ip)
+        return ret
+
+    def clear(self) -> list[str]:
+        ret = list(self._item_d.keys())
+        self._item_d.clear()
+        return ret
+
+    def ip_list(self) -> list[str]:
+        """最近解封的在前"""
+        return list(reversed(self._item_d.keys()))
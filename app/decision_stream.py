@@ -0,0 +1,195 @@
+"""
+流式解析crowdsec decision stream的响应，启动时的全量响应可能有几十万条decision，
+逐条解析并转换为精简记录，不需要把整个响应体和完整的decision列表同时保存在内存中。
+"""
+
+import codecs
+import json
+import logging
+import re
+import time
+from collections.abc import Callable, Iterable, Iterator
+
+from pycrowdsec.client import StreamDecisionClient
+
+LOG = logging.getLogger(__name__)
+
+# decision只保留处理需要的字段
+COMPACT_FIELD_S = ("value", "duration", "type", "scope")
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# 每次交给sink处理的decision数量
+SINK_CHUNK_SIZE = 10000
+
+# sink(new_decision_s, deleted_decision_s, ts)，同一次请求的所有块ts相同
+DecisionSink = Callable[[list[dict], list[dict], float], None]
+
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+
+
+def compact_decision(decision: dict) -> dict:
+    return {k: decision[k] for k in COMPACT_FIELD_S if k in decision}
+
+
+class _StreamBuffer:
+    def __init__(self, chunk_s: Iterable[bytes]):
+        self._chunk_iter = iter(chunk_s)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._eof = False
+        self.text = ""
+        self.pos = 0
+
+    def read_more(self) -> bool:
+        if self._eof:
+            return False
+        # 丢弃已经解析的部分，缓冲区只保留未解析的数据
+        if self.pos > 0:
+            self.text = self.text[self.pos :]
+            self.pos = 0
+        for chunk in self._chunk_iter:
+            data = self._decoder.decode(chunk)
+            if data:
+                self.text += data
+                return True
+        self._eof = True
+        self.text += self._decoder.decode(b"", final=True)
+        return False
+
+    def peek(self) -> str:
+        """跳过空白字符，返回下一个字符，数据结束时返回空字符串"""
+        while True:
+            self.pos = _WHITESPACE_RE.match(self.text, self.pos).end()  # type: ignore
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_more():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"invalid decision stream, expect {char!r} at {self.pos}")
+        self.pos += 1
+
+    def decode_value(self, decoder: json.JSONDecoder):
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.read_more():
+                    continue
+                raise
+            # 数字可能被截断在块的边界上
+            if end == len(self.text) and isinstance(value, (int, float)) and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_stream_decision(chunk_s: Iterable[bytes]) -> Iterator[tuple[str, dict]]:
+    """
+    增量解析 {"new": [...], "deleted": [...]} 响应，逐条返回 (key, decision)
+    """
+    buf = _StreamBuffer(chunk_s)
+    decoder = json.JSONDecoder()
+    buf.expect("{")
+    while True:
+        char = buf.peek()
+        if char == "}":
+            return
+        if char == ",":
+            buf.pos += 1
+            continue
+        key = buf.decode_value(decoder)
+        buf.expect(":")
+        if buf.peek() != "[":
+            # null 或者其他不需要的字段
+            buf.decode_value(decoder)
+            continue
+        buf.pos += 1
+        while True:
+            char = buf.peek()
+            if char == "]":
+                buf.pos += 1
+                break
+            if char == ",":
+                buf.pos += 1
+                continue
+            if not char:
+                raise ValueError("invalid decision stream, unexpected end")
+            yield key, buf.decode_value(decoder)
+
+
+class StreamingDecisionClient(StreamDecisionClient):
+    """
+    流式读取decision stream响应，解析后的decision立即转换为精简记录。
+
+    设置了sink时按块直接交给sink处理(例如写入DecisionStore)，不经过队列；没有sink时放入队列。
+    """
+
+    def __post_init__(self, sink: DecisionSink | None = None, **kwargs):
+        super().__post_init__(**kwargs)
+        self.sink = sink
+
+    def _get_stream_param_s(self, first_time: str):
+        params = {
+            "startup": first_time,
+            "scopes": ",".join(self.scopes),
+            "scenarios_containing": ",".join(self.include_scenarios_containing),
+            "scenarios_not_containing": ",".join(self.exclude_scenarios_containing),
+            "origins": ",".join(self.only_include_decisions_from),
+        }
+        return {k: v for k, v in params.items() if v}
+
+    def process_stream(self, chunk_s: Iterable[bytes], ts: float | None = None):
+        if self.sink is None:
+            return self._process_stream_queue(chunk_s)
+        if ts is None:
+            ts = time.time()
+        num_new = num_deleted = 0
+        new_s: list[dict] = []
+        deleted_s: list[dict] = []
+        for key, decision in iter_stream_decision(chunk_s):
+            if key == "new":
+                new_s.append(compact_decision(decision))
+                num_new += 1
+            elif key == "deleted":
+                deleted_s.append(compact_decision(decision))
+                num_deleted += 1
+            if len(new_s) + len(deleted_s) >= SINK_CHUNK_SIZE:
+                self.sink(new_s, deleted_s, ts)
+                new_s, deleted_s = [], []
+        if new_s or deleted_s:
+            self.sink(new_s, deleted_s, ts)
+        return num_new, num_deleted
+
+    def _process_stream_queue(self, chunk_s: Iterable[bytes]):
+        num_new = num_deleted = 0
+        for key, decision in iter_stream_decision(chunk_s):
+            if key == "new":
+                self.new_decisions.put(compact_decision(decision))
+                num_new += 1
+            elif key == "deleted":
+                self.deleted_decisions.put(compact_decision(decision))
+                num_deleted += 1
+        return num_new, num_deleted
+
+    def cycle(self, first_time):
+        try:
+            # 一次请求只取一次时间，分块处理时所有块使用相同的时间
+            ts = time.time()
+            url = f"{self.lapi_url}v1/decisions/stream"
+            params = self._get_stream_param_s(first_time)
+            with self.session.get(url=url, params=params, stream=True) as resp:
+                resp.raise_for_status()
+                num_new, num_deleted = self.process_stream(
+                    resp.iter_content(chunk_size=STREAM_CHUNK_SIZE), ts=ts
+                )
+            if first_time == "true":
+                LOG.info(f"crowdsec startup decision num={num_new} from {self.lapi_url}")
+            else:
+                LOG.debug(f"crowdsec decision new={num_new} deleted={num_deleted}")
+        except Exception as e:
+            LOG.error(f"crowdsec stream got error {e}")
+            if first_time == "true":
+                self.death_reason = e
+                raise e
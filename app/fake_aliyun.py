@@ -0,0 +1,181 @@
+import json
+import threading
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from app.aliyun_cdn_api import BLACKLIST_FUNCTION, sign_rpc_request
+from app.fake_tencent import FakeApiError, FakeCallStat
+
+
+class FakeAliyunCdnBackend:
+    """
+    阿里云CDN IP黑名单接口的本地模拟实现，校验签名和黑名单数量限制。
+
+    - DescribeCdnDomainConfigs
+    - BatchSetCdnDomainConfig
+    """
+
+    def __init__(self, *, access_key_secret: str = "fake", max_ip: int = 500):
+        self.access_key_secret = access_key_secret
+        self.max_ip = max_ip
+        self._lock = threading.Lock()
+        # domain -> (config_id, ip_list)，未配置黑名单时为None
+        self.domain_d: dict[str, tuple[int, list[str]] | None] = {}
+        self.stat_d: dict[str, FakeCallStat] = defaultdict(FakeCallStat)
+        self._next_config_id = 1000
+
+    def add_domain(self, domain: str, ip_list: list[str] | None = None):
+        self.domain_d[domain] = None
+        if ip_list is not None:
+            self._set_blacklist(domain, ip_list, config_id=None)
+
+    def get_domain_blacklist(self, domain: str) -> list[str]:
+        item = self.domain_d[domain]
+        return list(item[1]) if item else []
+
+    def _set_blacklist(self, domain: str, ip_list: list[str], config_id: int | None):
+        item = self.domain_d[domain]
+        if config_id is None:
+            if item is not None:
+                raise FakeApiError("Config.Exist", "ip_black_list_set already exists")
+            self._next_config_id += 1
+            config_id = self._next_config_id
+        elif item is None or item[0] != config_id:
+            raise FakeApiError("InvalidConfigId.NotFound", f"config {config_id} not found")
+        self.domain_d[domain] = (config_id, ip_list)
+
+    def handle(self, params: dict[str, str], request_bytes: int) -> dict:
+        action = params.get("Action") or ""
+        with self._lock:
+            stat = self.stat_d[action]
+            stat.num_call += 1
+            stat.request_bytes += request_bytes
+            try:
+                signature = params.pop("Signature", "")
+                if signature != sign_rpc_request(params, self.access_key_secret):
+                    raise FakeApiError("SignatureDoesNotMatch", "signature not match")
+                method = getattr(self, f"_handle_{action}", None)
+                if method is None:
+                    raise FakeApiError("InvalidAction.NotFound", f"unknown action {action}")
+                result = method(params)
+            except FakeApiError:
+                stat.num_error += 1
+                raise
+            result["RequestId"] = str(uuid.uuid4())
+            stat.response_bytes += len(json.dumps(result).encode())
+            return result
+
+    def _get_domain(self, domain: str | None):
+        if not domain or domain not in self.domain_d:
+            raise FakeApiError("InvalidDomain.NotFound", f"domain {domain} not found")
+        return domain
+
+    def _handle_DescribeCdnDomainConfigs(self, params: dict[str, str]):
+        domain = self._get_domain(params.get("DomainName"))
+        item = self.domain_d[domain]
+        config_s = []
+        if item is not None and BLACKLIST_FUNCTION in params.get("FunctionNames", ""):
+            config_id, ip_list = item
+            arg = {"ArgName": "ip_list", "ArgValue": ",".join(ip_list)}
+            config_s.append(
+                {
+                    "ConfigId": config_id,
+                    "FunctionName": BLACKLIST_FUNCTION,
+                    "Status": "success",
+                    "FunctionArgs": {"FunctionArg": [arg]},
+                }
+            )
+        return {"DomainConfigs": {"DomainConfig": config_s}}
+
+    def _handle_BatchSetCdnDomainConfig(self, params: dict[str, str]):
+        function_s = json.loads(params.get("Functions") or "[]")
+        for domain in (params.get("DomainNames") or "").split(","):
+            domain = self._get_domain(domain)
+            for function in function_s:
+                if function.get("functionName") != BLACKLIST_FUNCTION:
+                    raise FakeApiError("InvalidFunctionName", "unsupported function")
+                ip_list: list[str] = []
+                for arg in function.get("functionArgs") or []:
+                    if arg.get("argName") == "ip_list":
+                        ip_list = [x for x in arg.get("argValue", "").split(",") if x]
+                if len(ip_list) > self.max_ip:
+                    raise FakeApiError(
+                        "InvalidFunctionArgs.Malformed",
+                        f"ip_list size {len(ip_list)} > {self.max_ip}",
+                    )
+                self._set_blacklist(domain, ip_list, config_id=function.get("configId"))
+        return {}
+
+    def serve(self):
+        return FakeAliyunServer(self)
+
+
+class _FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分开写入，长连接时避免Nagle和延迟确认叠加造成40ms等待
+    disable_nagle_algorithm = True
+    server: "_FakeHTTPServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        params = dict(parse_qsl(body.decode(), keep_blank_values=True))
+        status = 200
+        try:
+            result = self.server.backend.handle(params, request_bytes=len(body))
+        except FakeApiError as ex:
+            status = 400
+            result = {"Code": ex.code, "Message": ex.message, "RequestId": str(uuid.uuid4())}
+        content = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, backend: FakeAliyunCdnBackend):
+        super().__init__(("127.0.0.1", 0), _FakeRequestHandler)
+        self.backend = backend
+
+
+class FakeAliyunServer:
+    """
+    with backend.serve() as server:
+        api = AliyunCdnAPI(..., endpoint=server.endpoint)
+    """
+
+    def __init__(self, backend: FakeAliyunCdnBackend):
+        self._server = _FakeHTTPServer(backend)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
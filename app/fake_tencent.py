@@ -0,0 +1,386 @@
+import copy
+import gzip
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from tencentcloud.cdn.v20180606 import models as cdn_models
+from tencentcloud.common.exception.tencent_cloud_sdk_exception import (
+    TencentCloudSDKException,
+)
+from tencentcloud.teo.v20220901 import models as teo_models
+
+# https://cloud.tencent.com/document/product/228/41431
+CDN_MAX_FILTER_RULE = 20
+CDN_MAX_BLACKLIST = 200
+CDN_MAX_WHITELIST = 500
+# https://cloud.tencent.com/document/api/1552/80721#SecurityConfig
+TEO_MAX_IP_PER_RULE = 2000
+
+
+class FakeApiError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+
+
+@dataclass
+class FakeCallStat:
+    num_call: int = 0
+    num_error: int = 0
+    request_bytes: int = 0
+    response_bytes: int = 0
+
+
+def _get_teo_rule_ip_list(condition: str) -> list[str]:
+    cond_prefix = "${http.request.ip} in"
+    if not condition.startswith(cond_prefix):
+        return []
+    ip_list_str = condition[len(cond_prefix) :].strip().strip("[]")
+    return [x.strip().strip("'") for x in ip_list_str.split(",") if x.strip()]
+
+
+class FakeTencentBackend:
+    """
+    腾讯云CDN/EdgeOne接口的本地模拟实现，用于端到端测试和压测。
+
+    - 模拟 DescribeDomainsConfig/ModifyDomainConfig/DescribeSecurityPolicy/ModifySecurityPolicy
+    - 校验真实接口的限制：CDN黑名单最多200个，EdgeOne每个规则最多2000个IP
+    - 支持配置延迟、限流(每个接口每秒请求数)和错误注入
+    - 统计每个接口的调用次数和请求/响应字节数
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0,
+        throttle_qps: int = 0,
+        error_rate: float = 0,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.throttle_qps = throttle_qps
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.domain_d: dict[str, dict] = {}
+        self.zone_d: dict[str, dict] = {}
+        self.stat_d: dict[str, FakeCallStat] = defaultdict(FakeCallStat)
+        self._inject_error_d: dict[str, deque[str]] = defaultdict(deque)
+        self._call_time_d: dict[str, deque[float]] = defaultdict(deque)
+        self._next_rule_id = 1000
+
+    def add_domain(self, domain: str, ip_filter: dict | None = None):
+        self.domain_d[domain] = {"Domain": domain, "IpFilter": ip_filter}
+
+    def add_zone(self, zone_id: str, rule_s: list[dict] | None = None):
+        self.zone_d[zone_id] = {"CustomRules": {"Rules": list(rule_s or [])}}
+
+    def inject_error(self, action: str, code: str, count: int = 1):
+        """接下来count次调用action时返回错误码code"""
+        self._inject_error_d[action].extend([code] * count)
+
+    def reset_stat(self):
+        self.stat_d.clear()
+
+    def get_domain_blacklist(self, domain: str) -> list[str]:
+        ip_filter = self.domain_d[domain].get("IpFilter") or {}
+        ret: list[str] = []
+        for rule in ip_filter.get("FilterRules") or []:
+            if rule.get("FilterType") == "blacklist":
+                ret.extend(rule.get("Filters") or [])
+        return ret
+
+    def get_zone_rule_ip_list(self, zone_id: str) -> dict[str, list[str]]:
+        ret: dict[str, list[str]] = {}
+        for rule in self.zone_d[zone_id]["CustomRules"]["Rules"]:
+            ret[rule.get("Name") or ""] = _get_teo_rule_ip_list(rule.get("Condition") or "")
+        return ret
+
+    def _check_throttle(self, action: str):
+        if self.throttle_qps <= 0:
+            return
+        now = time.monotonic()
+        call_time_s = self._call_time_d[action]
+        while call_time_s and call_time_s[0] <= now - 1:
+            call_time_s.popleft()
+        if len(call_time_s) >= self.throttle_qps:
+            raise FakeApiError("RequestLimitExceeded", f"{action} request limit exceeded")
+        call_time_s.append(now)
+
+    def _check_inject_error(self, action: str):
+        error_s = self._inject_error_d[action]
+        if error_s:
+            code = error_s.popleft()
+            raise FakeApiError(code, f"injected error for {action}")
+        if self.error_rate > 0 and self._random.random() < self.error_rate:
+            raise FakeApiError("InternalError", f"random error for {action}")
+
+    def handle(self, action: str, params: dict, request_bytes: int | None = None) -> dict:
+        """处理一次接口调用，返回Response内容，出错时抛出FakeApiError"""
+        if request_bytes is None:
+            request_bytes = len(json.dumps(params, ensure_ascii=False).encode())
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            stat = self.stat_d[action]
+            stat.num_call += 1
+            stat.request_bytes += request_bytes
+            try:
+                self._check_throttle(action)
+                self._check_inject_error(action)
+                method = getattr(self, f"_handle_{action}", None)
+                if method is None:
+                    raise FakeApiError("UnsupportedOperation", f"unknown action {action}")
+                result = method(params)
+            except FakeApiError:
+                stat.num_error += 1
+                raise
+            result["RequestId"] = str(uuid.uuid4())
+            stat.response_bytes += len(json.dumps(result, ensure_ascii=False).encode())
+            return result
+
+    def _get_domain(self, domain: str | None):
+        if not domain or domain not in self.domain_d:
+            raise FakeApiError("ResourceNotFound.CdnHostNotExists", f"domain {domain} not found")
+        return self.domain_d[domain]
+
+    def _get_zone(self, zone_id: str | None):
+        if not zone_id or zone_id not in self.zone_d:
+            raise FakeApiError("ResourceNotFound", f"zone {zone_id} not found")
+        return self.zone_d[zone_id]
+
+    def _handle_DescribeDomains(self, params: dict):
+        domain_s = [{"Domain": x, "Status": "online"} for x in self.domain_d]
+        return {"Domains": domain_s, "TotalNumber": len(domain_s)}
+
+    def _handle_DescribeDomainsConfig(self, params: dict):
+        domain_s = list(self.domain_d.values())
+        for item in params.get("Filters") or []:
+            if item.get("Name") == "domain":
+                value_s = set(item.get("Value") or [])
+                domain_s = [x for x in domain_s if x["Domain"] in value_s]
+        return {"Domains": copy.deepcopy(domain_s), "TotalNumber": len(domain_s)}
+
+    def _handle_ModifyDomainConfig(self, params: dict):
+        domain_config = self._get_domain(params.get("Domain"))
+        if params.get("Route") != "IpFilter":
+            raise FakeApiError("InvalidParameter", f"unsupported route {params.get('Route')}")
+        ip_filter: dict = json.loads(params.get("Value") or "{}").get("update") or {}
+        rule_s: list[dict] = ip_filter.get("FilterRules") or []
+        if len(rule_s) > CDN_MAX_FILTER_RULE:
+            raise FakeApiError(
+                "LimitExceeded", f"ip filter rules {len(rule_s)} > {CDN_MAX_FILTER_RULE}"
+            )
+        num_blacklist = 0
+        num_whitelist = 0
+        for rule in rule_s:
+            num_ip = len(rule.get("Filters") or [])
+            if rule.get("FilterType") == "blacklist":
+                num_blacklist += num_ip
+            else:
+                num_whitelist += num_ip
+        if num_blacklist > CDN_MAX_BLACKLIST:
+            raise FakeApiError(
+                "LimitExceeded", f"ip blacklist {num_blacklist} > {CDN_MAX_BLACKLIST}"
+            )
+        if num_whitelist > CDN_MAX_WHITELIST:
+            raise FakeApiError(
+                "LimitExceeded", f"ip whitelist {num_whitelist} > {CDN_MAX_WHITELIST}"
+            )
+        domain_config["IpFilter"] = {
+            "Switch": ip_filter.get("Switch"),
+            "FilterType": ip_filter.get("FilterType"),
+            "Filters": ip_filter.get("Filters"),
+            "FilterRules": [
+                {k: v for k, v in x.items() if v is not None} for x in rule_s
+            ],
+        }
+        return {}
+
+    def _handle_DescribeZones(self, params: dict):
+        zone_s = [{"ZoneId": x, "ZoneName": x} for x in self.zone_d]
+        return {"Zones": zone_s, "TotalCount": len(zone_s)}
+
+    def _handle_DescribeSecurityPolicy(self, params: dict):
+        zone = self._get_zone(params.get("ZoneId"))
+        return {"SecurityPolicy": copy.deepcopy(zone)}
+
+    def _handle_ModifySecurityPolicy(self, params: dict):
+        zone = self._get_zone(params.get("ZoneId"))
+        policy: dict = params.get("SecurityPolicy") or {}
+        rule_s: list[dict] = (policy.get("CustomRules") or {}).get("Rules") or []
+        result_rule_s = []
+        for rule in rule_s:
+            rule = {k: v for k, v in rule.items() if v is not None}
+            ip_list = _get_teo_rule_ip_list(rule.get("Condition") or "")
+            if len(ip_list) > TEO_MAX_IP_PER_RULE:
+                raise FakeApiError(
+                    "LimitExceeded",
+                    f"rule {rule.get('Name')} ip count {len(ip_list)} > {TEO_MAX_IP_PER_RULE}",
+                )
+            if not rule.get("Id"):
+                self._next_rule_id += 1
+                rule["Id"] = str(self._next_rule_id)
+            result_rule_s.append(rule)
+        zone["CustomRules"] = {"Rules": result_rule_s}
+        return {}
+
+    def create_cdn_client(self):
+        return FakeSdkClient(self, cdn_models)
+
+    def create_teo_client(self):
+        return FakeSdkClient(self, teo_models)
+
+    def create_cdn_api(self):
+        """创建进程内直接访问本模拟实现的TencentCdnAPI"""
+        from app.tencent_cdn_api import TencentCdnAPI
+
+        api = TencentCdnAPI(secret_id="fake", secret_key="fake")
+        api._client = self.create_cdn_client()  # type: ignore
+        return api
+
+    def create_teo_api(self, max_rule: int = 10):
+        """创建进程内直接访问本模拟实现的TencentEdgeoneAPI"""
+        from app.tencent_edgeone_api import TencentEdgeoneAPI
+
+        api = TencentEdgeoneAPI(secret_id="fake", secret_key="fake", max_rule=max_rule)
+        api._client = self.create_teo_client()  # type: ignore
+        return api
+
+    def get_rule_state(self) -> dict[str, int]:
+        """每个域名/站点当前封禁的IP数量"""
+        ret: dict[str, int] = {}
+        for domain in self.domain_d:
+            ret[domain] = len(self.get_domain_blacklist(domain))
+        for zone_id in self.zone_d:
+            ip_list_d = self.get_zone_rule_ip_list(zone_id)
+            ret[zone_id] = sum(len(x) for x in ip_list_d.values())
+        return ret
+
+    def serve(self):
+        return FakeTencentServer(self)
+
+
+class FakeSdkClient:
+    """
+    进程内替代 CdnClient/TeoClient，接口签名和SDK保持一致
+    """
+
+    def __init__(self, backend: FakeTencentBackend, model_module: Any):
+        self._backend = backend
+        self._models = model_module
+
+    def __getattr__(self, action: str):
+        response_type = getattr(self._models, f"{action}Response", None)
+        if response_type is None:
+            raise AttributeError(action)
+
+        def _call(request):
+            params = request._serialize()
+            try:
+                result = self._backend.handle(action, params)
+            except FakeApiError as ex:
+                raise TencentCloudSDKException(ex.code, ex.message) from None
+            response = response_type()
+            response._deserialize(result)
+            return response
+
+        return _call
+
+
+class _FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分开写入，长连接时避免Nagle和延迟确认叠加造成40ms等待
+    disable_nagle_algorithm = True
+    server: "_FakeHTTPServer"
+
+    def setup(self):
+        super().setup()
+        with self.server.stat_lock:
+            self.server.num_connection += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        action = self.headers.get("X-TC-Action") or ""
+        request_id = str(uuid.uuid4())
+        try:
+            data = body
+            if self.headers.get("Content-Encoding") == "gzip":
+                data = gzip.decompress(body)
+            params = json.loads(data or b"{}")
+            result = self.server.backend.handle(action, params, request_bytes=len(body))
+        except FakeApiError as ex:
+            result = {
+                "Error": {"Code": ex.code, "Message": ex.message},
+                "RequestId": request_id,
+            }
+        content = json.dumps({"Response": result}, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, backend: FakeTencentBackend):
+        super().__init__(("127.0.0.1", 0), _FakeRequestHandler)
+        self.backend = backend
+        self.stat_lock = threading.Lock()
+        self.num_connection = 0
+
+
+class FakeTencentServer:
+    """
+    在本地HTTP端口上提供FakeTencentBackend，SDK通过endpoint访问，
+    可以覆盖签名、序列化和网络传输的开销。
+
+    with backend.serve() as server:
+        api = TencentCdnAPI(..., endpoint=server.endpoint)
+    """
+
+    def __init__(self, backend: FakeTencentBackend):
+        self._server = _FakeHTTPServer(backend)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def num_connection(self):
+        """已建立的TCP连接数"""
+        return self._server.num_connection
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,7 +1,16 @@
 from collections import defaultdict
+from typing import TYPE_CHECKING
 
 from netaddr import IPAddress, IPNetwork, IPSet
 
+if TYPE_CHECKING:
+    from app.prefix_db import PrefixDB
+
+# 合并公告前缀的最少IP数量，和/24合并规则一致
+PREFIX_MERGE_MIN_HIT = 10
+# 不合并比/16更大的前缀，避免封禁整个运营商
+PREFIX_MERGE_MIN_PREFIXLEN = 16
+
 
 class IpListBuilder:
     """
@@ -12,9 +21,17 @@ class IpListBuilder:
     - 严格限制集合大小，超限时自动丢弃新IP
     - 支持输出优化后的IP列表和被丢弃的IP列表
     - 自动过滤无效或非IPv4地址
+    - 可选：按前缀数据库合并为BGP公告前缀(命中的/24网段比例超过prefix_merge_density时)
     """
 
-    def __init__(self, *, max_size: int, ignore_ip_s: list[str] | None = None):
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        ignore_ip_s: list[str] | None = None,
+        prefix_db: "PrefixDB | None" = None,
+        prefix_merge_density: float = 0.0,
+    ):
         self.max_size = max_size
         self._ip_set = IPSet()
         self._ignore_ip_set = set(ignore_ip_s or [])
@@ -27,6 +44,13 @@ class IpListBuilder:
         self._processed_net24 = defaultdict(lambda: 0)
         # 缓存IP对象，用于一次性添加到IPSet中，性能更好
         self._buffer_ip_s: list[IPAddress | IPNetwork] = []
+        self._prefix_db = prefix_db if prefix_merge_density > 0 else None
+        self._prefix_merge_density = prefix_merge_density
+        # 公告前缀 (net, prefixlen) -> 命中IP数量 / 命中的/24网段
+        self._prefix_hit_d: dict[tuple[int, int], int] = defaultdict(lambda: 0)
+        self._prefix_net24_d: dict[tuple[int, int], set[int]] = defaultdict(set)
+        self._merged_prefix_s: set[tuple[int, int]] = set()
+        self._ignore_ip_range_set: IPSet | None = None
 
     def _discard_ip(self, ip: str, reason: str):
         self._discard_ip_s.append((ip, reason))
@@ -93,6 +117,40 @@ class IpListBuilder:
             net24_count = self._processed_net24[net24_key]
             if net24_count >= 10:
                 self._add_to_ip_set(ip_net, ip, can_merge=True)
+            if self._prefix_db is not None:
+                self._check_merge_prefix(ip_obj, ip)
+
+    def _check_merge_prefix(self, ip_obj: IPAddress, source_ip: str):
+        info = self._prefix_db.lookup_int(int(ip_obj))  # type: ignore[union-attr]
+        if info is None or not PREFIX_MERGE_MIN_PREFIXLEN <= info.prefixlen < 24:
+            return
+        key = (info.net, info.prefixlen)
+        if key in self._merged_prefix_s:
+            return
+        self._prefix_hit_d[key] += 1
+        self._prefix_net24_d[key].add(int(ip_obj) >> 8)
+        if self._prefix_hit_d[key] < PREFIX_MERGE_MIN_HIT:
+            return
+        num_net24 = 1 << (24 - info.prefixlen)
+        if len(self._prefix_net24_d[key]) / num_net24 < self._prefix_merge_density:
+            return
+        ip_net = IPNetwork(info.cidr)
+        self._merged_prefix_s.add(key)
+        # 前缀内有需要忽略的IP(例如白名单)时不合并
+        if self._get_ignore_ip_range_set().intersection(IPSet([ip_net])):
+            return
+        self._add_to_ip_set(ip_net, source_ip, can_merge=True)
+
+    def _get_ignore_ip_range_set(self):
+        if self._ignore_ip_range_set is None:
+            ip_range_s = []
+            for ip in self._ignore_ip_set:
+                try:
+                    ip_range_s.append(IPNetwork(ip))
+                except Exception:
+                    continue
+            self._ignore_ip_range_set = IPSet(ip_range_s)
+        return self._ignore_ip_range_set
 
     def to_list(self):
         self._ip_set.compact()
@@ -106,3 +164,29 @@ class IpListBuilder:
 
     def get_discard_list(self):
         return self._discard_ip_s
+
+
+class AppliedIpList:
+    """
+    已经下发到某个目标的IP/IP段列表，用于判断单个IP是否仍在远端规则中
+    """
+
+    def __init__(self, ip_s: list[str]):
+        self._ip_set = frozenset(ip_s)
+        self._cidr_s = [x for x in ip_s if "/" in x]
+        self._cidr_set: IPSet | None = None
+
+    def __len__(self):
+        return len(self._ip_set)
+
+    def __contains__(self, ip: str):
+        if ip in self._ip_set:
+            return True
+        if not self._cidr_s:
+            return False
+        if self._cidr_set is None:
+            self._cidr_set = IPSet(self._cidr_s)
+        try:
+            return IPAddress(ip) in self._cidr_set
+        except Exception:
+            return False
@@ -0,0 +1,78 @@
+from collections.abc import Callable, Sequence
+from typing import Any
+
+# 和之前 textwrap.shorten(..., 800) 的长度一致
+DEFAULT_MAX_CHARS = 800
+
+
+class CappedList:
+    """
+    日志参数中延迟渲染的列表，只在日志真正输出时格式化，
+    并且只遍历到长度上限为止，不会先拼接完整列表再截断。
+
+        LOG.info("new decision num=%d: %s", len(ip_s), CappedList(ip_s))
+    """
+
+    def __init__(
+        self,
+        item_s: Sequence[Any],
+        *,
+        max_chars: int = DEFAULT_MAX_CHARS,
+        formatter: Callable[[Any], str] = str,
+        sep: str = " ",
+    ):
+        self.item_s = item_s
+        self.max_chars = max_chars
+        self.formatter = formatter
+        self.sep = sep
+
+    def __str__(self):
+        part_s: list[str] = []
+        size = 0
+        for item in self.item_s:
+            text = self.formatter(item)
+            size += len(text) + len(self.sep)
+            if size > self.max_chars:
+                break
+            part_s.append(text)
+        ret = self.sep.join(part_s)
+        num_rest = len(self.item_s) - len(part_s)
+        if num_rest > 0:
+            ret += f"{self.sep}[...{num_rest} more]"
+        return ret
+
+    def __bool__(self):
+        return bool(self.item_s)
+
+
+def format_discard(item: tuple[str, str]):
+    ip, reason = item
+    return f"{ip}({reason})"
+
+
+class ApplyDecisionMessage:
+    """
+    目标下发日志，延迟渲染黑名单和丢弃列表
+    """
+
+    def __init__(
+        self,
+        title: str,
+        ip_s: Sequence[str],
+        discard_ip_s: Sequence[tuple[str, str]],
+        detail_s: Sequence[str] = (),
+    ):
+        self.title = title
+        self.ip_s = ip_s
+        self.discard_ip_s = discard_ip_s
+        self.detail_s = detail_s
+
+    def __str__(self):
+        msg = self.title
+        for detail in self.detail_s:
+            msg += f"\n{detail}"
+        if self.ip_s:
+            msg += f"\n===blacklist===\n{CappedList(self.ip_s)}"
+        if self.discard_ip_s:
+            msg += f"\n===discard===\n{CappedList(self.discard_ip_s, formatter=format_discard)}"
+        return msg
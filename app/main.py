@@ -1,17 +1,226 @@
+import argparse
+import datetime
+import json
 import logging
 import sys
-
-from .decision_handler import CrowdsecDecisionHandler
+import time
 
 LOG = logging.getLogger(__name__)
 
+USAGE = """Usage:
+    python -m app.main [--dryrun]
+    python -m app.main replay <decision-log> [--speed SPEED] [--target fake|stub|real]
+    python -m app.main journal [<journal-path>] [--target T] [--ip IP] [--since TS] [--json]
+    python -m app.main plan <decision-log> --state <state-path> [--refresh] [--json]"""
+
+
+def main_replay(argv: list[str]):
+    from .config import get_config, setup_logging
+    from .decision_handler import CrowdsecDecisionHandler
+    from .decision_recorder import read_decision_log
+    from .decision_replay import (
+        ReplayDecisionClient,
+        StubTargetAPI,
+        create_fake_target_s,
+        replay_decision_log,
+    )
+
+    parser = argparse.ArgumentParser(prog="python -m app.main replay")
+    parser.add_argument("decision_log", help="decision log recorded by crowdsec_record_path")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="0: as fast as possible, 1: original speed, 2: double speed",
+    )
+    parser.add_argument(
+        "--target",
+        choices=["fake", "stub", "real"],
+        default="fake",
+        help="fake: configured tencent targets on a local fake backend, full pipeline without"
+        " network, stub: in-memory aggregation only, real: configured targets",
+    )
+    args = parser.parse_args(argv)
+    config = get_config()
+    setup_logging(config.log_level)
+    handler = CrowdsecDecisionHandler(crowdsec_client=ReplayDecisionClient())  # type: ignore
+    fake_backend = None
+    if args.target == "stub":
+        stub_api = StubTargetAPI()
+        domain_s = [domain for domain, _ in handler.target_s] or ["stub"]
+        handler.target_s = [(domain, stub_api) for domain in domain_s]  # type: ignore
+    elif args.target == "fake":
+        fake_backend, handler.target_s = create_fake_target_s(config)
+    batch_s = read_decision_log(args.decision_log)
+    report = replay_decision_log(
+        handler, batch_s, speed=args.speed, fake_backend=fake_backend
+    )
+    print(report.format())
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def main_journal(argv: list[str]):
+    from .apply_journal import query_journal
+
+    parser = argparse.ArgumentParser(prog="python -m app.main journal")
+    parser.add_argument(
+        "journal_path", nargs="?", help="apply journal path, default is apply_journal_path"
+    )
+    parser.add_argument("--target", help="domain or zone id")
+    parser.add_argument(
+        "--ip", help="entries added, removed, discarded or undiscarded this ip"
+    )
+    parser.add_argument("--since", type=_parse_time, help="unix timestamp or iso datetime")
+    parser.add_argument("--until", type=_parse_time, help="unix timestamp or iso datetime")
+    parser.add_argument("--json", action="store_true", help="print raw json lines")
+    args = parser.parse_args(argv)
+    journal_path = args.journal_path
+    if not journal_path:
+        from .config import get_config
+
+        journal_path = get_config().apply_journal_path
+    if not journal_path:
+        parser.error("journal_path or apply_journal_path is required")
+    entry_s = query_journal(
+        journal_path, target=args.target, ip=args.ip, since=args.since, until=args.until
+    )
+    for entry in entry_s:
+        if args.json:
+            print(json.dumps(entry.to_dict(), ensure_ascii=False))
+            continue
+        time_str = datetime.datetime.fromtimestamp(entry.ts).strftime("%Y-%m-%d %H:%M:%S")
+        print(
+            f"{time_str} {entry.kind} {entry.target} added={len(entry.added)}"
+            f" removed={len(entry.removed)} discarded=+{len(entry.discarded)}"
+            f"/-{len(entry.undiscarded)} total_discard={entry.num_discard}"
+        )
+
+
+def main_plan(argv: list[str]) -> int:
+    from .config import get_config, setup_logging
+    from .plan import (
+        PlanReport,
+        get_ban_ip_list,
+        load_decision_store,
+        load_target_state,
+        plan_decision,
+        save_target_state,
+    )
+    from .target_registry import create_target_s
+
+    parser = argparse.ArgumentParser(prog="python -m app.main plan")
+    parser.add_argument(
+        "decision_path", help="decision log recorded by crowdsec_record_path, or lapi snapshot"
+    )
+    parser.add_argument(
+        "--lapi-snapshot",
+        action="store_true",
+        help="decision_path is a saved response of /v1/decisions/stream?startup=true",
+    )
+    parser.add_argument("--state", required=True, help="cached remote state of targets")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="read remote state of configured targets (read-only api) and save to --state",
+    )
+    parser.add_argument(
+        "--now", type=_parse_time, help="expire decisions at this time, default is last batch"
+    )
+    parser.add_argument("--json", action="store_true", help="print report as json")
+    parser.add_argument(
+        "--detailed-exitcode",
+        action="store_true",
+        help="exit with 2 when any target would change",
+    )
+    args = parser.parse_args(argv)
+    config = get_config()
+    setup_logging(config.log_level)
+    report = PlanReport()
+    t0 = time.perf_counter()
+    store = load_decision_store(args.decision_path, lapi_snapshot=args.lapi_snapshot, now=args.now)
+    ban_ip_list = get_ban_ip_list(store)
+    t1 = time.perf_counter()
+    target_s = create_target_s(config)
+    prepared_s = []
+    if args.refresh:
+        for domain, api in target_s:
+            prepared = api.prepare_decision(domain)
+            if prepared is None:
+                report.missing_target_s.append(domain)
+                continue
+            prepared_s.append((api, prepared))
+        save_target_state(args.state, prepared_s)
+        report.state_ts = time.time()
+    else:
+        report.state_ts, state_d = load_target_state(args.state)
+        for domain, api in target_s:
+            data = state_d.get((api.kind, domain))
+            if data is None:
+                report.missing_target_s.append(domain)
+                continue
+            prepared_s.append((api, api.load_state(domain, data)))
+    t2 = time.perf_counter()
+    report.timing_d["load"] = t1 - t0
+    report.timing_d["state"] = t2 - t1
+    prefix_db = None
+    if config.prefix_db_path:
+        from .prefix_db import PrefixDB
+
+        prefix_db = PrefixDB(config.prefix_db_path)
+    pool = None
+    if config.aggregation_workers > 0:
+        from .aggregation_pool import AggregationPool
+
+        pool = AggregationPool(config.aggregation_workers)
+    try:
+        plan_decision(
+            ban_ip_list,
+            prepared_s,
+            prefix_db=prefix_db,
+            prefix_merge_density=config.prefix_merge_density,
+            pool=pool,
+            report=report,
+        )
+    finally:
+        if pool:
+            pool.close()
+        if prefix_db:
+            prefix_db.close()
+    report.timing_d["total"] = time.perf_counter() - t0
+    if args.json:
+        print(json.dumps(report.to_dict(), ensure_ascii=False))
+    else:
+        print(report.format())
+    if args.detailed_exitcode and report.num_change > 0:
+        return 2
+    return 0
+
 
 def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "replay":
+        main_replay(sys.argv[2:])
+        return
+    if len(sys.argv) >= 2 and sys.argv[1] == "journal":
+        main_journal(sys.argv[2:])
+        return
+    if len(sys.argv) >= 2 and sys.argv[1] == "plan":
+        sys.exit(main_plan(sys.argv[2:]))
     dryrun = len(sys.argv) >= 2 and sys.argv[1] == "--dryrun"
     is_help = len(sys.argv) >= 2 and sys.argv[1] == "--help"
     if is_help:
-        print("Usage: python -m app.main [--dryrun]")
+        print(USAGE)
         return
+    # 延迟导入，--help 不需要加载配置和SDK
+    from .config import get_config, setup_logging
+    from .decision_handler import CrowdsecDecisionHandler
+
+    setup_logging(get_config().log_level)
     handler = CrowdsecDecisionHandler()
     handler.main(dryrun=dryrun)
 
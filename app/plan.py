@@ -0,0 +1,209 @@
+"""
+离线计算每个目标的下发结果：读取decision快照和缓存的远端状态，
+执行和下发时相同的聚合和规则分组，输出规则变化、容量、丢弃和耗时，不调用任何修改接口。
+"""
+
+import datetime
+import json
+import logging
+import os
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+from app.decision_recorder import read_decision_log
+from app.decision_store import DecisionStore
+from app.decision_stream import STREAM_CHUNK_SIZE, compact_decision, iter_stream_decision
+from app.log_render import CappedList, format_discard
+from app.target_backend import AggregationCache, PreparedDecision, TargetBackend, TargetPlan
+
+if TYPE_CHECKING:
+    from app.aggregation_pool import AggregationPool
+    from app.prefix_db import PrefixDB
+
+LOG = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+
+def _iter_file_chunk(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+def load_decision_store(
+    path: str,
+    *,
+    lapi_snapshot: bool = False,
+    now: float | None = None,
+) -> DecisionStore:
+    """
+    读取decision快照，返回当前生效的封禁状态。
+
+    lapi_snapshot=False: crowdsec_record_path 录制的日志，按批次回放，在最后一个批次的时间(或now)清理过期decision
+    lapi_snapshot=True: LAPI decision stream 启动时的全量响应 (startup=true)
+    """
+    store = DecisionStore()
+    if lapi_snapshot:
+        for key, decision in iter_stream_decision(_iter_file_chunk(path)):
+            if key == "new":
+                store.add(compact_decision(decision))
+        return store
+    last_ts = 0.0
+    for batch in read_decision_log(path):
+        for decision in batch.deleted_s:
+            store.remove(decision, source=batch.source)
+        for decision in batch.new_s:
+            store.add(decision, source=batch.source, now=batch.ts)
+        last_ts = batch.ts
+    store.expire(last_ts if now is None else now)
+    return store
+
+
+def get_ban_ip_list(store: DecisionStore) -> list[str]:
+    # 和下发时的顺序一致，越新的decision越靠前
+    ret = store.ip_list()
+    ret.reverse()
+    return ret
+
+
+def save_target_state(
+    path: str,
+    prepared_s: list[tuple[TargetBackend, PreparedDecision]],
+    ts: float | None = None,
+):
+    """
+    缓存目标的远端状态，先写入临时文件再替换，避免读到不完整的文件
+    """
+    data = {
+        "version": STATE_VERSION,
+        "ts": time.time() if ts is None else ts,
+        "targets": [
+            {"kind": api.kind, "domain": prepared.domain, "state": api.dump_state(prepared)}
+            for api, prepared in prepared_s
+        ],
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_target_state(path: str) -> tuple[float, dict[tuple[str, str], Any]]:
+    """
+    返回 (缓存时间, {(kind, domain): state})
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != STATE_VERSION:
+        raise ValueError(f"unsupported target state version {data.get('version')} in {path}")
+    state_d = {(x["kind"], x["domain"]): x["state"] for x in data.get("targets") or []}
+    return data["ts"], state_d
+
+
+@dataclass
+class PlanReport:
+    num_ban: int = 0
+    plan_s: list[TargetPlan] = field(default_factory=list)
+    # 没有缓存远端状态的目标
+    missing_target_s: list[str] = field(default_factory=list)
+    state_ts: float | None = None
+    # 各阶段耗时(秒): load/state/aggregate/plan
+    timing_d: dict[str, float] = field(default_factory=dict)
+    num_aggregation: int = 0
+
+    @property
+    def num_change(self):
+        return sum(x.changed for x in self.plan_s)
+
+    def format(self):
+        line_s = [f"ban ip count={self.num_ban}"]
+        if self.state_ts is not None:
+            time_str = datetime.datetime.fromtimestamp(self.state_ts).strftime("%Y-%m-%d %H:%M:%S")
+            line_s.append(f"remote state cached at {time_str}")
+        for plan in self.plan_s:
+            usage = len(plan.ip_s) / plan.budget * 100 if plan.budget > 0 else 0
+            flag = "change" if plan.changed else "no-change"
+            line_s.append(
+                f"[{plan.kind}] {plan.domain} {flag} blacklist={len(plan.ip_s)}/{plan.budget}"
+                f" ({usage:.1f}%) added={len(plan.added)} removed={len(plan.removed)}"
+                f" discard={len(plan.discard_ip_s)}"
+            )
+            for detail in plan.detail_s:
+                line_s.append(f"  {detail}")
+            if plan.added:
+                line_s.append(f"  added: {CappedList(plan.added)}")
+            if plan.removed:
+                line_s.append(f"  removed: {CappedList(plan.removed)}")
+            if plan.discard_ip_s:
+                line_s.append(
+                    f"  discard: {CappedList(plan.discard_ip_s, formatter=format_discard)}"
+                )
+        for domain in self.missing_target_s:
+            line_s.append(f"[missing] {domain} no cached remote state, run plan with --refresh")
+        line_s.append(
+            f"targets={len(self.plan_s)} change={self.num_change}"
+            f" aggregation={self.num_aggregation}"
+        )
+        line_s.append(
+            "timing " + " ".join(f"{k}={v * 1000:.1f}ms" for k, v in self.timing_d.items())
+        )
+        return "\n".join(line_s)
+
+    def to_dict(self):
+        return {
+            "num_ban": self.num_ban,
+            "state_ts": self.state_ts,
+            "targets": [
+                {
+                    "kind": plan.kind,
+                    "domain": plan.domain,
+                    "changed": plan.changed,
+                    "budget": plan.budget,
+                    "num_ip": len(plan.ip_s),
+                    "added": plan.added,
+                    "removed": plan.removed,
+                    "discarded": [list(x) for x in plan.discard_ip_s],
+                    "detail": plan.detail_s,
+                }
+                for plan in self.plan_s
+            ],
+            "missing_targets": self.missing_target_s,
+            "timing": self.timing_d,
+        }
+
+
+def plan_decision(
+    ban_ip_list: list[str],
+    prepared_s: list[tuple[TargetBackend, PreparedDecision]],
+    *,
+    prefix_db: "PrefixDB | None" = None,
+    prefix_merge_density: float = 0.0,
+    pool: "AggregationPool | None" = None,
+    report: PlanReport | None = None,
+) -> PlanReport:
+    """
+    使用和下发相同的聚合缓存计算每个目标的结果
+    """
+    if report is None:
+        report = PlanReport()
+    report.num_ban = len(ban_ip_list)
+    t0 = time.perf_counter()
+    cache = AggregationCache(
+        ban_ip_list,
+        prefix_db=prefix_db,
+        prefix_merge_density=prefix_merge_density,
+        pool=pool,
+    )
+    cache.prefetch([prepared.spec for _, prepared in prepared_s])
+    result_s = [cache.get(prepared.spec) for _, prepared in prepared_s]
+    t1 = time.perf_counter()
+    for (api, prepared), result in zip(prepared_s, result_s):
+        report.plan_s.append(api.plan_decision(prepared, result))
+    t2 = time.perf_counter()
+    report.num_aggregation = cache.num_compute
+    report.timing_d["aggregate"] = t1 - t0
+    report.timing_d["plan"] = t2 - t1
+    return report
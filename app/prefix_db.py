@@ -0,0 +1,192 @@
+"""
+前缀/ASN数据库：BGP公告前缀到ASN的映射，使用有序二进制文件+mmap，
+多个进程共享同一份页缓存，查询为二分查找 O(log n)。
+
+文件格式(小端):
+    header: magic(8) + 记录数量(u32) + 保留(u32)
+    record: start(u32) end(u32) net(u32) prefixlen(u8) pad(3) asn(u32)
+
+记录是展开后互不重叠、按start排序的IP区间，每个区间对应覆盖它的最具体的前缀。
+
+构建:
+    python -m app.prefix_db build pfx2as.txt prefix.db
+输入每行一个前缀: "1.0.0.0/24 13335" 或 CAIDA pfx2as格式 "1.0.0.0\t24\t13335"
+"""
+
+import argparse
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+MAGIC = b"CSPFXDB1"
+HEADER = struct.Struct("<8sII")
+RECORD = struct.Struct("<IIIB3xI")
+
+
+@dataclass(frozen=True)
+class PrefixInfo:
+    net: int
+    prefixlen: int
+    asn: int
+
+    @property
+    def cidr(self):
+        return f"{ipaddress.IPv4Address(self.net)}/{self.prefixlen}"
+
+    @property
+    def num_address(self):
+        return 1 << (32 - self.prefixlen)
+
+
+def parse_prefix_line(line: str) -> tuple[int, int, int] | None:
+    """
+    解析一行前缀，返回 (net, prefixlen, asn)，空行、注释和IPv6返回None
+    """
+    part_s = line.split("#", 1)[0].split()
+    if not part_s:
+        return None
+    if "/" in part_s[0]:
+        prefix, asn = part_s[0], part_s[1]
+    else:
+        prefix, asn = f"{part_s[0]}/{part_s[1]}", part_s[2]
+    network = ipaddress.ip_network(prefix, strict=False)
+    if network.version != 4:
+        return None
+    # 多个源AS(MOAS)时取第一个: 13335_209242 或 13335,209242
+    asn = asn.replace("_", ",").split(",")[0]
+    return int(network.network_address), network.prefixlen, int(asn.removeprefix("AS"))
+
+
+def flatten_prefix_s(prefix_s: Iterable[tuple[int, int, int]]):
+    """
+    把可能嵌套的前缀展开为互不重叠的区间: [(start, end, net, prefixlen, asn)]
+    """
+    prefix_d: dict[tuple[int, int], int] = {}
+    for net, prefixlen, asn in prefix_s:
+        prefix_d[(net, prefixlen)] = asn
+    ret: list[tuple[int, int, int, int, int]] = []
+    # 栈中是包含当前位置的前缀，栈顶最具体
+    stack: list[tuple[int, int, int, int]] = []
+    cursor = 0
+
+    def emit_until(end: int, item: tuple[int, int, int, int]):
+        nonlocal cursor
+        if cursor <= end:
+            ret.append((cursor, end, item[1], item[2], item[3]))
+            cursor = end + 1
+
+    for (net, prefixlen), asn in sorted(prefix_d.items()):
+        end = net + (1 << (32 - prefixlen)) - 1
+        while stack and stack[-1][0] < net:
+            emit_until(stack[-1][0], stack.pop())
+        if stack:
+            emit_until(net - 1, stack[-1])
+        cursor = net
+        stack.append((end, net, prefixlen, asn))
+    while stack:
+        emit_until(stack[-1][0], stack.pop())
+    return ret
+
+
+def build_prefix_db(prefix_s: Iterable[tuple[int, int, int]], path: str):
+    record_s = flatten_prefix_s(prefix_s)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(record_s), 0))
+        for record in record_s:
+            f.write(RECORD.pack(*record))
+    os.replace(tmp_path, path)
+    return len(record_s)
+
+
+class PrefixDB:
+    """
+    只读的前缀数据库，文件通过mmap映射，不会复制到进程内存中。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"invalid prefix db file {path}")
+        expect_size = HEADER.size + self._count * RECORD.size
+        if len(self._mmap) != expect_size:
+            raise ValueError(f"prefix db file {path} size {len(self._mmap)} != {expect_size}")
+
+    def __len__(self):
+        return self._count
+
+    def _get_record(self, index: int):
+        return RECORD.unpack_from(self._mmap, HEADER.size + index * RECORD.size)
+
+    def lookup_int(self, ip: int) -> PrefixInfo | None:
+        # 查找最后一个 start <= ip 的区间
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._get_record(mid)[0] <= ip:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        _, end, net, prefixlen, asn = self._get_record(lo - 1)
+        if ip > end:
+            return None
+        return PrefixInfo(net=net, prefixlen=prefixlen, asn=asn)
+
+    def lookup(self, ip: str) -> PrefixInfo | None:
+        address = ipaddress.ip_address(ip)
+        if address.version != 4:
+            return None
+        return self.lookup_int(int(address))
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _read_prefix_file(path: str):
+    with open(path) as f:
+        for line in f:
+            prefix = parse_prefix_line(line)
+            if prefix is not None:
+                yield prefix
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.prefix_db")
+    sub_parser_s = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub_parser_s.add_parser("build", help="build prefix db from text file")
+    build_parser.add_argument("input", help="prefix to asn text file")
+    build_parser.add_argument("output", help="prefix db file")
+    lookup_parser = sub_parser_s.add_parser("lookup", help="lookup ip in prefix db")
+    lookup_parser.add_argument("db", help="prefix db file")
+    lookup_parser.add_argument("ip", nargs="+")
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        count = build_prefix_db(_read_prefix_file(args.input), args.output)
+        print(f"* {count} records written to {args.output}")
+        return
+    with PrefixDB(args.db) as db:
+        for ip in args.ip:
+            info = db.lookup(ip)
+            if info is None:
+                print(f"{ip} not found")
+            else:
+                print(f"{ip} {info.cidr} AS{info.asn}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
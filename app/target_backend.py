@@ -0,0 +1,262 @@
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, ClassVar
+
+from app.config import AppSettings
+from app.ip_list import IpListBuilder
+
+if TYPE_CHECKING:
+    from app.aggregation_pool import AggregationPool
+    from app.apply_journal import ApplyJournal
+    from app.prefix_db import PrefixDB
+
+LOG = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class IpListSpec:
+    """
+    IP列表聚合参数，参数相同的目标共用同一份聚合结果
+    """
+
+    max_size: int
+    ignore_ip_s: frozenset[str] = frozenset()
+    # 是否输出IPv6，来自后端的 supports_ipv6
+    ipv6: bool = False
+
+
+@dataclass
+class IpListResult:
+    ip_s: list[str]
+    discard_ip_s: list[tuple[str, str]]
+
+
+class AggregationCache:
+    """
+    同一个封禁列表按IpListSpec缓存聚合结果，多个目标限制相同时只计算一次。
+
+    grace_ip_list: 宽限期内已解封的IP，放在封禁列表之后聚合，只占用每个目标聚合后剩余的容量，
+    放不下时不记录为丢弃。
+    """
+
+    def __init__(
+        self,
+        ban_ip_list: list[str],
+        *,
+        grace_ip_list: list[str] | None = None,
+        prefix_db: "PrefixDB | None" = None,
+        prefix_merge_density: float = 0.0,
+        pool: "AggregationPool | None" = None,
+    ):
+        self.ban_ip_list = ban_ip_list
+        self.grace_ip_list = grace_ip_list or []
+        self.prefix_db = prefix_db
+        self.prefix_merge_density = prefix_merge_density
+        # 配置了进程池时在子进程中聚合
+        self.pool = pool
+        self._result_d: dict[IpListSpec, IpListResult] = {}
+
+    @property
+    def num_compute(self):
+        return len(self._result_d)
+
+    def prefetch(self, spec_s: list[IpListSpec]):
+        """
+        在进程池中并行计算多个聚合参数的结果
+        """
+        missing_spec_s = [x for x in dict.fromkeys(spec_s) if x not in self._result_d]
+        if self.pool is None or not missing_spec_s:
+            return
+        result_d = self.pool.compute(
+            self._get_aggregate_ip_list(),
+            missing_spec_s,
+            prefix_db_path=self.prefix_db.path if self.prefix_db else None,
+            prefix_merge_density=self.prefix_merge_density,
+        )
+        for spec, result in result_d.items():
+            self._result_d[spec] = self._drop_grace_discard(result)
+
+    def _get_aggregate_ip_list(self):
+        if not self.grace_ip_list:
+            return self.ban_ip_list
+        return self.ban_ip_list + self.grace_ip_list
+
+    def _drop_grace_discard(self, result: IpListResult):
+        if not self.grace_ip_list or not result.discard_ip_s:
+            return result
+        grace_ip_set = set(self.grace_ip_list)
+        result.discard_ip_s = [x for x in result.discard_ip_s if x[0] not in grace_ip_set]
+        return result
+
+    def get(self, spec: IpListSpec) -> IpListResult:
+        if spec.ipv6:
+            raise NotImplementedError("IpListBuilder only outputs ipv4")
+        result = self._result_d.get(spec)
+        if result is None and self.pool is not None:
+            self.prefetch([spec])
+            result = self._result_d[spec]
+        if result is None:
+            builder = IpListBuilder(
+                max_size=spec.max_size,
+                ignore_ip_s=list(spec.ignore_ip_s),
+                prefix_db=self.prefix_db,
+                prefix_merge_density=self.prefix_merge_density,
+            )
+            builder.update(self._get_aggregate_ip_list())
+            result = self._drop_grace_discard(
+                IpListResult(ip_s=builder.to_list(), discard_ip_s=builder.get_discard_list())
+            )
+            self._result_d[spec] = result
+        return result
+
+
+@dataclass
+class PreparedDecision:
+    """
+    prepare_decision 读取的远端状态，以及该目标需要的聚合参数
+    """
+
+    domain: str
+    spec: IpListSpec
+    # 后端自己的远端状态，commit_decision 时使用
+    state: Any = None
+    # 远端当前由bouncer管理的IP列表，用于记录下发日志
+    current_ip_s: list[str] = field(default_factory=list)
+
+
+@dataclass
+class TargetPlan:
+    """
+    plan_decision 计算的下发结果，不修改远端
+    """
+
+    domain: str
+    kind: str
+    # 聚合后允许的IP/IP段数量
+    budget: int
+    current_ip_s: list[str]
+    ip_s: list[str]
+    discard_ip_s: list[tuple[str, str]]
+    # 是否需要调用修改接口
+    changed: bool
+    # 后端相关的说明，例如EdgeOne每个规则的变化
+    detail_s: list[str] = field(default_factory=list)
+
+    @property
+    def added(self):
+        current_ip_set = set(self.current_ip_s)
+        return [x for x in self.ip_s if x not in current_ip_set]
+
+    @property
+    def removed(self):
+        ip_set = set(self.ip_s)
+        return [x for x in self.current_ip_s if x not in ip_set]
+
+
+# 目标标识: (后端类型, 域名或站点ID)，同一个名称可能配置在不同类型的后端中
+TargetKey = tuple[str, str]
+
+
+class TargetBackend(ABC):
+    """
+    CDN目标后端接口。
+
+    下发分为两步：prepare_decision 读取远端状态并给出聚合参数，
+    commit_decision 使用(可能和其他目标共用的)聚合结果写入远端。
+    """
+
+    # 注册名称
+    kind: ClassVar[str]
+    # 单个规则最多IP/IP段数量，不分规则时为None
+    max_ip_per_rule: ClassVar[int | None] = None
+    # IpListBuilder 只输出IPv4
+    supports_ipv6: ClassVar[bool] = False
+
+    @classmethod
+    @abstractmethod
+    def from_config(cls, config: AppSettings) -> "TargetBackend": ...
+
+    @property
+    @abstractmethod
+    def max_ip(self) -> int:
+        """所有规则一共最多IP/IP段数量"""
+
+    @abstractmethod
+    def check_target(self, domain: str) -> None: ...
+
+    def get_ip_list_spec(
+        self,
+        max_size: int | None = None,
+        ignore_ip_s: frozenset[str] = frozenset(),
+    ) -> IpListSpec:
+        """
+        按后端声明的容量和形状限制生成聚合参数，max_size 不能超过 max_ip
+        """
+        return IpListSpec(
+            max_size=self.max_ip if max_size is None else min(max_size, self.max_ip),
+            ignore_ip_s=ignore_ip_s,
+            ipv6=self.supports_ipv6,
+        )
+
+    @abstractmethod
+    def prepare_decision(self, domain: str) -> PreparedDecision | None:
+        """目标不存在时返回None"""
+
+    @abstractmethod
+    def commit_decision(self, prepared: PreparedDecision, result: IpListResult) -> bool: ...
+
+    def plan_decision(self, prepared: PreparedDecision, result: IpListResult) -> TargetPlan:
+        """计算下发结果，不调用修改接口"""
+        return TargetPlan(
+            domain=prepared.domain,
+            kind=self.kind,
+            budget=prepared.spec.max_size,
+            current_ip_s=prepared.current_ip_s,
+            ip_s=result.ip_s,
+            discard_ip_s=result.discard_ip_s,
+            changed=prepared.current_ip_s != result.ip_s,
+        )
+
+    @abstractmethod
+    def dump_state(self, prepared: PreparedDecision) -> Any:
+        """远端状态转换为JSON对象，用于离线plan"""
+
+    @abstractmethod
+    def load_state(self, domain: str, data: Any) -> PreparedDecision:
+        """从dump_state的结果恢复远端状态，不调用接口"""
+
+    def apply_decision(
+        self,
+        domain: str,
+        ban_ip_list: list[str],
+        cache: AggregationCache | None = None,
+        journal: "ApplyJournal | None" = None,
+    ) -> bool:
+        prepared = self.prepare_decision(domain)
+        if prepared is None:
+            return False
+        if cache is None:
+            cache = AggregationCache(ban_ip_list)
+        return self.apply_prepared(prepared, cache.get(prepared.spec), journal=journal)
+
+    def apply_prepared(
+        self,
+        prepared: PreparedDecision,
+        result: IpListResult,
+        journal: "ApplyJournal | None" = None,
+    ) -> bool:
+        ok = self.commit_decision(prepared, result)
+        if ok and journal is not None:
+            journal.record(
+                target=prepared.domain,
+                kind=self.kind,
+                current_ip_s=prepared.current_ip_s,
+                ip_s=result.ip_s,
+                discard_ip_s=result.discard_ip_s,
+            )
+        return ok
+
+
+def get_target_key(domain: str, api: TargetBackend) -> TargetKey:
+    return (api.kind, domain)
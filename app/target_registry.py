@@ -0,0 +1,136 @@
+import importlib
+from dataclasses import dataclass
+
+from app.config import AppSettings, diff_config
+from app.target_backend import TargetBackend, TargetKey
+
+
+@dataclass(frozen=True)
+class TargetBackendSpec:
+    """
+    目标后端注册信息，只有配置了target_field时才会导入对应模块(和SDK)。
+    """
+
+    kind: str
+    module_name: str
+    class_name: str
+    # 配置项名称，配置项的值是域名或站点ID，多个使用逗号分隔
+    target_field: str
+    # 创建后端使用的配置项，变化时需要重新创建后端
+    config_field_s: tuple[str, ...] = ()
+
+    def get_target_id_s(self, config: AppSettings) -> list[str]:
+        value: str = getattr(config, self.target_field, None) or ""
+        return [x.strip() for x in value.split(",") if x.strip()]
+
+    def load(self) -> type[TargetBackend]:
+        module = importlib.import_module(self.module_name)
+        return getattr(module, self.class_name)
+
+    def create(self, config: AppSettings) -> TargetBackend:
+        return self.load().from_config(config)
+
+
+# 腾讯云SDK共用的HTTP连接配置
+_TENCENT_HTTP_FIELD_S = (
+    "tencent_http_pool_size",
+    "tencent_http_connect_timeout",
+    "tencent_http_read_timeout",
+    "tencent_http_action_timeout",
+    "tencent_http_compress_min_bytes",
+)
+
+TARGET_BACKEND_S: list[TargetBackendSpec] = [
+    TargetBackendSpec(
+        kind="tencent_cdn",
+        module_name="app.tencent_cdn_api",
+        class_name="TencentCdnAPI",
+        target_field="tencent_cdn_domain",
+        config_field_s=(
+            "tencent_secret_id",
+            "tencent_secret_key",
+            "tencent_endpoint",
+            *_TENCENT_HTTP_FIELD_S,
+        ),
+    ),
+    TargetBackendSpec(
+        kind="tencent_teo",
+        module_name="app.tencent_edgeone_api",
+        class_name="TencentEdgeoneAPI",
+        target_field="tencent_teo_zone_id",
+        config_field_s=(
+            "tencent_secret_id",
+            "tencent_secret_key",
+            "tencent_endpoint",
+            "tencent_teo_max_rule",
+            *_TENCENT_HTTP_FIELD_S,
+        ),
+    ),
+    TargetBackendSpec(
+        kind="aliyun_cdn",
+        module_name="app.aliyun_cdn_api",
+        class_name="AliyunCdnAPI",
+        target_field="aliyun_cdn_domain",
+        config_field_s=(
+            "aliyun_access_key_id",
+            "aliyun_access_key_secret",
+            "aliyun_endpoint",
+            "aliyun_cdn_max_ip",
+        ),
+    ),
+]
+
+
+def get_backend_spec(kind: str) -> TargetBackendSpec:
+    for spec in TARGET_BACKEND_S:
+        if spec.kind == kind:
+            return spec
+    raise KeyError(f"unknown target backend {kind}")
+
+
+def create_target_s(config: AppSettings) -> list[tuple[str, TargetBackend]]:
+    """
+    根据配置创建目标列表: [(域名或站点ID, api)]，同一种后端的多个目标共用一个api
+    """
+    ret: list[tuple[str, TargetBackend]] = []
+    for spec in TARGET_BACKEND_S:
+        target_id_s = spec.get_target_id_s(config)
+        if not target_id_s:
+            continue
+        api = spec.create(config)
+        for target_id in target_id_s:
+            ret.append((target_id, api))
+    return ret
+
+
+def update_target_s(
+    target_s: list[tuple[str, TargetBackend]],
+    old_config: AppSettings,
+    new_config: AppSettings,
+):
+    """
+    配置变化后更新目标列表，只重新创建配置变化的后端，其他后端继续使用。
+    返回 (新的目标列表, 需要重新下发的目标)
+    """
+    changed_field_s = diff_config(old_config, new_config)
+    api_d: dict[str, TargetBackend] = {}
+    old_key_s: set[tuple[str, str]] = set()
+    for target_id, api in target_s:
+        kind = getattr(api, "kind", "")
+        api_d[kind] = api
+        old_key_s.add((kind, target_id))
+    ret: list[tuple[str, TargetBackend]] = []
+    changed_key_s: list[TargetKey] = []
+    for spec in TARGET_BACKEND_S:
+        target_id_s = spec.get_target_id_s(new_config)
+        if not target_id_s:
+            continue
+        api = api_d.get(spec.kind)
+        is_recreate = api is None or bool(changed_field_s & set(spec.config_field_s))
+        if is_recreate:
+            api = spec.create(new_config)
+        for target_id in target_id_s:
+            ret.append((target_id, api))  # type: ignore
+            if is_recreate or (spec.kind, target_id) not in old_key_s:
+                changed_key_s.append((spec.kind, target_id))
+    return ret, changed_key_s
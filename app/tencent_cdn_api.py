@@ -1,25 +1,65 @@
 import datetime
+import json
 import logging
-import textwrap
+from dataclasses import dataclass
 
 from tencentcloud.cdn.v20180606 import cdn_client, models
 from tencentcloud.common import credential
 
-from app.ip_list import IpListBuilder
+from app.config import AppSettings
+from app.log_render import ApplyDecisionMessage
+from app.target_backend import IpListResult, PreparedDecision, TargetBackend
+from app.tencent_client import (
+    TencentSession,
+    TransportOptions,
+    attach_session,
+    create_client_profile,
+    get_shared_session,
+)
 
 LOG = logging.getLogger(__name__)
 
 
-class TencentCdnAPI:
-    def __init__(self, *, secret_id: str, secret_key: str):
+@dataclass
+class CdnDecisionState:
+    domain_config: models.DetailDomain
+    target_ip_filter: models.IpFilterPathRule
+    other_ip_filter_s: list[models.IpFilterPathRule]
+
+
+class TencentCdnAPI(TargetBackend):
+    kind = "tencent_cdn"
+
+    def __init__(
+        self,
+        *,
+        secret_id: str,
+        secret_key: str,
+        endpoint: str | None = None,
+        session: TencentSession | None = None,
+    ):
         self._secret_id = secret_id
         self._secret_key = secret_key
+        self._endpoint = endpoint
+        # 默认使用进程内共享的连接池
+        self._session = session or get_shared_session()
         self._client: cdn_client.CdnClient | None = None
 
+    @classmethod
+    def from_config(cls, config: AppSettings):
+        return cls(
+            secret_id=config.tencent_secret_id,
+            secret_key=config.tencent_secret_key,
+            endpoint=config.tencent_endpoint,
+            session=get_shared_session(TransportOptions.from_config(config)),
+        )
+
     def _create_client(self):
         cred = credential.Credential(self._secret_id, self._secret_key)
-        client = cdn_client.CdnClient(cred, "")
-        return client
+        client = cdn_client.CdnClient(
+            cred, "", profile=create_client_profile(self._endpoint)
+        )
+        return attach_session(client, self._session)
 
     def _get_client(self):
         if not self._client:
@@ -50,6 +90,14 @@ class TencentCdnAPI:
             return None
         return resp.Domains[0]
 
+    @property
+    def max_ip(self):
+        return 200
+
+    def check_target(self, domain: str):
+        if self.get_domain_config(domain) is None:
+            raise RuntimeError(f"tencent cdn domain {domain} not found")
+
     def modify_domain_config(self, request: models.ModifyDomainConfigRequest):
         resp = self._get_client().ModifyDomainConfig(request)
         return resp
@@ -71,7 +119,7 @@ class TencentCdnAPI:
             target_ip_filter = models.IpFilterPathRule()
         return target_ip_filter, other_ip_filter_s
 
-    def apply_decision(self, domain: str, ban_ip_list: list[str]):
+    def prepare_decision(self, domain: str):
         """
         https://cloud.tencent.com/document/product/228/41431
 
@@ -92,7 +140,19 @@ class TencentCdnAPI:
         domain_config = self.get_domain_config(domain)
         if domain_config is None:
             LOG.warning(f"domain not found: {domain}")
-            return False
+            return None
+        return self._prepare_decision(domain, domain_config)
+
+    def dump_state(self, prepared: PreparedDecision):
+        state: CdnDecisionState = prepared.state
+        return json.loads(state.domain_config.to_json_string())
+
+    def load_state(self, domain: str, data: dict):
+        domain_config = models.DetailDomain()
+        domain_config.from_json_string(json.dumps(data))
+        return self._prepare_decision(domain, domain_config)
+
+    def _prepare_decision(self, domain: str, domain_config: models.DetailDomain):
         target_ip_filter, other_ip_filter_s = self._split_ip_filter_s(domain_config)
         whitelist_ip_s = []
         blacklist_ip_s = []
@@ -102,13 +162,28 @@ class TencentCdnAPI:
                 blacklist_ip_s.extend(ip_s)
             else:
                 whitelist_ip_s.extend(ip_s)
-        ip_list_builder = IpListBuilder(
-            max_size=200 - len(blacklist_ip_s),
-            ignore_ip_s=whitelist_ip_s + blacklist_ip_s,
+        spec = self.get_ip_list_spec(
+            max_size=self.max_ip - len(blacklist_ip_s),
+            ignore_ip_s=frozenset(whitelist_ip_s + blacklist_ip_s),
         )
-        ip_list_builder.update(ban_ip_list)
-        target_ip_s = ip_list_builder.to_list()
-        discard_ip_s = ip_list_builder.get_discard_list()
+        state = CdnDecisionState(
+            domain_config=domain_config,
+            target_ip_filter=target_ip_filter,
+            other_ip_filter_s=other_ip_filter_s,
+        )
+        return PreparedDecision(
+            domain=domain,
+            spec=spec,
+            state=state,
+            current_ip_s=list(target_ip_filter.Filters or []),
+        )
+
+    def commit_decision(self, prepared: PreparedDecision, result: IpListResult):
+        domain = prepared.domain
+        state: CdnDecisionState = prepared.state
+        target_ip_filter = state.target_ip_filter
+        target_ip_s = list(result.ip_s)
+        discard_ip_s = result.discard_ip_s
         existed_ip_s = target_ip_filter.Filters or []
         if existed_ip_s == target_ip_s:
             LOG.info(f"IP list no change, no need to apply to {domain}")
@@ -120,7 +195,7 @@ class TencentCdnAPI:
         target_ip_filter.FilterType = "blacklist"
         target_ip_filter.RuleType = "all"
         target_ip_filter.RulePaths = ["*"]
-        filter_rule_s = list(other_ip_filter_s)
+        filter_rule_s = list(state.other_ip_filter_s)
         filter_rule_s.append(target_ip_filter)
         self._log_apply_decision(
             domain=domain,
@@ -128,7 +203,7 @@ class TencentCdnAPI:
             ip_s=target_ip_s,
             discard_ip_s=discard_ip_s,
         )
-        req_ip_filter = domain_config.IpFilter or models.IpFilter()
+        req_ip_filter = state.domain_config.IpFilter or models.IpFilter()
         req_ip_filter.Switch = "on"
         req_ip_filter.FilterType = "blacklist"
         req_ip_filter.FilterRules = filter_rule_s
@@ -149,14 +224,4 @@ class TencentCdnAPI:
         discard_ip_s: list[tuple[str, str]],
     ):
         title = f"apply decision to {domain} blacklist={len(ip_s)} discard={len(discard_ip_s)}"
-        LOG.info(title)
-        blacklist_str = "\n".join(ip_s)
-        blacklist_str = textwrap.shorten(blacklist_str, 800)
-        discard_str = "\n".join([f"{ip} {reason}" for ip, reason in discard_ip_s])
-        discard_str = textwrap.shorten(discard_str, 800)
-        msg = f"{remark}"
-        if blacklist_str:
-            msg += f"\n===blacklist===\n{blacklist_str}"
-        if discard_str:
-            msg += f"\n===discard===\n{discard_str}"
-        LOG.info(msg)
+        LOG.info("%s", ApplyDecisionMessage(title, ip_s, discard_ip_s, detail_s=[remark]))
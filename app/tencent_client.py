@@ -0,0 +1,185 @@
+import gzip
+import logging
+import threading
+from collections.abc import Iterable
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from tencentcloud.common.abstract_client import AbstractClient
+from tencentcloud.common.profile.client_profile import ClientProfile
+from tencentcloud.common.profile.http_profile import HttpProfile
+
+from app.config import AppSettings
+
+LOG = logging.getLogger(__name__)
+
+
+def create_client_profile(endpoint: str | None = None) -> ClientProfile:
+    """
+    endpoint: 自定义接口地址，例如 http://127.0.0.1:8000，默认使用腾讯云官方地址
+    """
+    http_profile = HttpProfile()
+    http_profile.keepAlive = True
+    if endpoint:
+        url = urlparse(endpoint)
+        http_profile.protocol = http_profile.scheme = url.scheme or "https"
+        http_profile.endpoint = url.netloc or url.path
+    return ClientProfile(httpProfile=http_profile)
+
+
+def parse_action_timeout(value: str | None) -> tuple[tuple[str, float], ...]:
+    """
+    解析 "ModifySecurityPolicy=120,DescribeZones=10" 格式的接口超时时间
+    """
+    ret: list[tuple[str, float]] = []
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        action, sep, timeout = item.partition("=")
+        if not sep:
+            raise ValueError(f"invalid action timeout {item!r}, expect Action=seconds")
+        ret.append((action.strip(), float(timeout)))
+    return tuple(ret)
+
+
+@dataclass(frozen=True)
+class TransportOptions:
+    # 每个接口地址保持的最大连接数
+    pool_size: int = 10
+    connect_timeout: float = 5
+    read_timeout: float = 60
+    # 请求体超过该大小时使用gzip压缩，0表示不压缩
+    compress_min_bytes: int = 0
+    # 按接口设置的读取超时: ((action, seconds), ...)
+    action_timeout_s: tuple[tuple[str, float], ...] = ()
+
+    @classmethod
+    def from_config(cls, config: AppSettings):
+        return cls(
+            pool_size=config.tencent_http_pool_size,
+            connect_timeout=config.tencent_http_connect_timeout,
+            read_timeout=config.tencent_http_read_timeout,
+            compress_min_bytes=config.tencent_http_compress_min_bytes,
+            action_timeout_s=parse_action_timeout(config.tencent_http_action_timeout),
+        )
+
+
+class TencentSession(requests.Session):
+    """
+    腾讯云SDK使用的HTTP会话：连接池保持长连接，按接口设置超时，可选压缩请求体。
+    """
+
+    def __init__(self, options: TransportOptions):
+        super().__init__()
+        self.options = options
+        self._action_timeout_d = dict(options.action_timeout_s)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=options.pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def get_timeout(self, action: str | None):
+        read_timeout = self._action_timeout_d.get(action or "", self.options.read_timeout)
+        return (self.options.connect_timeout, read_timeout)
+
+    def request(self, method, url, *args, data=None, headers=None, timeout=None, **kwargs):
+        headers = dict(headers or {})
+        # SDK会设置 Connection: Keep-Alive，超时使用配置的值
+        timeout = self.get_timeout(headers.get("X-TC-Action"))
+        min_bytes = self.options.compress_min_bytes
+        if data and min_bytes > 0 and len(data) >= min_bytes:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            data = gzip.compress(data, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return super().request(
+            method, url, *args, data=data, headers=headers, timeout=timeout, **kwargs
+        )
+
+
+_SESSION_LOCK = threading.Lock()
+_SESSION_D: dict[TransportOptions, TencentSession] = {}
+
+
+def get_shared_session(options: TransportOptions | None = None) -> TencentSession:
+    """
+    进程内所有腾讯云客户端共用的会话，配置相同时共用同一个连接池
+    """
+    options = options or TransportOptions()
+    with _SESSION_LOCK:
+        session = _SESSION_D.get(options)
+        if session is None:
+            session = _SESSION_D[options] = TencentSession(options)
+        return session
+
+
+def close_shared_session_s(keep_option_s: Iterable[TransportOptions] = ()):
+    """
+    关闭不再使用的共享会话，例如重新加载配置后连接参数变化
+    """
+    keep_option_set = set(keep_option_s)
+    with _SESSION_LOCK:
+        option_s = [x for x in _SESSION_D if x not in keep_option_set]
+        session_s = [_SESSION_D.pop(x) for x in option_s]
+    for session in session_s:
+        session.close()
+    return len(session_s)
+
+
+class SharedConnection:
+    """
+    替代SDK的 ProxyConnection(ApiRequest.conn)，使用共享的会话发送请求，
+    保留SDK连接的代理和证书配置。
+    """
+
+    def __init__(self, session: requests.Session, conn):
+        self.session = session
+        self.request_host = conn.request_host
+        self.proxy = conn.proxy
+        self.certification = conn.certification
+        self.timeout = conn.timeout
+        self.request_length = 0
+
+    def request(self, method, url, body=None, headers=None):
+        headers = headers if headers is not None else {}
+        headers.setdefault("Host", self.request_host)
+        # SDK使用 request_length 统计请求大小
+        self.request_length = len(body) if body else 0
+        return self.session.request(
+            method=method,
+            url=url,
+            data=body,
+            headers=headers,
+            proxies=self.proxy,
+            verify=self.certification,
+            timeout=self.timeout,
+            stream=True,
+        )
+
+
+_SDK_CONN_ATTR_S = ("request_host", "proxy", "certification", "timeout")
+
+
+def attach_session(client: AbstractClient, session: requests.Session):
+    """
+    SDK每个客户端会创建自己的requests.Session，替换为使用共享会话的连接。
+    SDK的连接结构变化时保留SDK默认的连接。
+    """
+    api_request = getattr(client, "request", None)
+    conn = getattr(api_request, "conn", None)
+    if conn is None or not all(hasattr(conn, x) for x in _SDK_CONN_ATTR_S):
+        LOG.warning(
+            f"unsupported tencentcloud sdk connection {type(conn).__name__}, shared session disabled"
+        )
+        return client
+    if isinstance(session, TencentSession):
+        timeout = session.get_timeout(None)
+        if conn.timeout != timeout[1]:
+            LOG.info(
+                f"{type(client).__name__} request timeout {conn.timeout}s overridden by"
+                f" connect={timeout[0]}s read={timeout[1]}s"
+            )
+    api_request.conn = SharedConnection(session, conn)
+    api_request.set_keep_alive()
+    return client
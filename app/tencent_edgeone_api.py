@@ -1,15 +1,28 @@
 import datetime
 import difflib
+import json
 import logging
-import textwrap
 from dataclasses import dataclass
 
 from tencentcloud.common import credential
 from tencentcloud.teo.v20220901 import models, teo_client
 
-from app.config import CONFIG
+from app.config import AppSettings
 from app.ip_group import IPGroupManager
-from app.ip_list import IpListBuilder
+from app.log_render import ApplyDecisionMessage
+from app.target_backend import (
+    IpListResult,
+    PreparedDecision,
+    TargetBackend,
+    TargetPlan,
+)
+from app.tencent_client import (
+    TencentSession,
+    TransportOptions,
+    attach_session,
+    create_client_profile,
+    get_shared_session,
+)
 
 LOG = logging.getLogger(__name__)
 
@@ -21,18 +34,50 @@ class ResultRuleItem:
     is_modified: bool
 
 
-class TencentEdgeoneAPI:
-    def __init__(self, *, secret_id: str, secret_key: str):
+@dataclass
+class TeoDecisionState:
+    zone_config: models.SecurityPolicy
+    existed_rule_s: list[models.CustomRule]
+    other_rule_s: list[models.CustomRule]
+
+
+class TencentEdgeoneAPI(TargetBackend):
+    kind = "tencent_teo"
+    max_ip_per_rule = 2000
+
+    def __init__(
+        self,
+        *,
+        secret_id: str,
+        secret_key: str,
+        endpoint: str | None = None,
+        session: TencentSession | None = None,
+        max_rule: int = 10,
+    ):
         self._secret_id = secret_id
         self._secret_key = secret_key
-        self._max_ip_per_rule = 2000
-        self._ip_limit = self._max_ip_per_rule * CONFIG.tencent_teo_max_rule
+        self._endpoint = endpoint
+        # 默认使用进程内共享的连接池
+        self._session = session or get_shared_session()
+        self._ip_limit = self.max_ip_per_rule * max_rule
         self._client: teo_client.TeoClient | None = None
 
+    @classmethod
+    def from_config(cls, config: AppSettings):
+        return cls(
+            secret_id=config.tencent_secret_id,
+            secret_key=config.tencent_secret_key,
+            endpoint=config.tencent_endpoint,
+            session=get_shared_session(TransportOptions.from_config(config)),
+            max_rule=config.tencent_teo_max_rule,
+        )
+
     def _create_client(self):
         cred = credential.Credential(self._secret_id, self._secret_key)
-        client = teo_client.TeoClient(cred, "")
-        return client
+        client = teo_client.TeoClient(
+            cred, "", profile=create_client_profile(self._endpoint)
+        )
+        return attach_session(client, self._session)
 
     def _get_client(self):
         if not self._client:
@@ -53,6 +98,14 @@ class TencentEdgeoneAPI:
         resp = self._get_client().DescribeSecurityPolicy(req)
         return resp.SecurityPolicy
 
+    @property
+    def max_ip(self):
+        return self._ip_limit
+
+    def check_target(self, zone_id: str):
+        if self.get_zone_config(zone_id) is None:
+            raise RuntimeError(f"tencent teo zone {zone_id} not found")
+
     def modify_zone_config(self, request: models.ModifySecurityPolicyRequest):
         resp = self._get_client().ModifySecurityPolicy(request)
         return resp
@@ -140,7 +193,7 @@ class TencentEdgeoneAPI:
             existed_rule_d[rule_key] = rule
 
         # 将IP分组，并更新到已有规则中
-        ip_group = IPGroupManager(max_per_group=self._max_ip_per_rule)
+        ip_group = IPGroupManager(max_per_group=self.max_ip_per_rule)
         ip_group.load(existed_group_s)
         ip_group.update(target_ip_s)
         target_group_s = ip_group.get_groups()
@@ -186,7 +239,7 @@ class TencentEdgeoneAPI:
 
         return result_rule_s
 
-    def apply_decision(self, domain: str, ban_ip_list: list[str]):
+    def prepare_decision(self, domain: str):
         """
         对接EdgeOne实现封禁IP
         https://cloud.tencent.com/document/api/1552/80721#SecurityConfig
@@ -195,19 +248,56 @@ class TencentEdgeoneAPI:
         zone_config = self.get_zone_config(domain)
         if zone_config is None:
             LOG.warning(f"zone_id not found: {domain}")
-            return False
+            return None
+        return self._prepare_decision(domain, zone_config)
+
+    def dump_state(self, prepared: PreparedDecision):
+        state: TeoDecisionState = prepared.state
+        return json.loads(state.zone_config.to_json_string())
+
+    def load_state(self, domain: str, data: dict):
+        zone_config = models.SecurityPolicy()
+        zone_config.from_json_string(json.dumps(data))
+        return self._prepare_decision(domain, zone_config)
+
+    def _prepare_decision(self, domain: str, zone_config: models.SecurityPolicy):
         existed_rule_s, other_rule_s = self._split_rule_s(zone_config)
+        state = TeoDecisionState(
+            zone_config=zone_config, existed_rule_s=existed_rule_s, other_rule_s=other_rule_s
+        )
         # 构建完整IP黑名单列表
-        ip_list_builder = IpListBuilder(
-            max_size=self._ip_limit,
-            ignore_ip_s=[],
+        spec = self.get_ip_list_spec()
+        current_ip_s: list[str] = []
+        for rule in existed_rule_s:
+            current_ip_s.extend(self._get_rule_ip_list(rule))
+        return PreparedDecision(domain=domain, spec=spec, state=state, current_ip_s=current_ip_s)
+
+    def plan_decision(self, prepared: PreparedDecision, result: IpListResult):
+        state: TeoDecisionState = prepared.state
+        result_rule_s = self._build_ip_rule_list(
+            existed_rule_s=state.existed_rule_s,
+            target_ip_s=result.ip_s,
         )
-        ip_list_builder.update(ban_ip_list)
-        target_ip_s = ip_list_builder.to_list()
-        discard_ip_s = ip_list_builder.get_discard_list()
+        detail_s = self._format_rule_detail_s(result_rule_s, len(state.existed_rule_s))
+        return TargetPlan(
+            domain=prepared.domain,
+            kind=self.kind,
+            budget=prepared.spec.max_size,
+            current_ip_s=prepared.current_ip_s,
+            ip_s=result.ip_s,
+            discard_ip_s=result.discard_ip_s,
+            changed=any(x.is_modified for x in result_rule_s),
+            detail_s=detail_s,
+        )
+
+    def commit_decision(self, prepared: PreparedDecision, result: IpListResult):
+        domain = prepared.domain
+        state: TeoDecisionState = prepared.state
+        target_ip_s = result.ip_s
+        discard_ip_s = result.discard_ip_s
 
         result_rule_s = self._build_ip_rule_list(
-            existed_rule_s=existed_rule_s,
+            existed_rule_s=state.existed_rule_s,
             target_ip_s=target_ip_s,
         )
         num_modified = sum(x.is_modified for x in result_rule_s)
@@ -215,10 +305,10 @@ class TencentEdgeoneAPI:
             LOG.info(f"IP rules no change, no need to apply to {domain}")
             return True
 
-        apply_rule_s = other_rule_s + [x.rule for x in result_rule_s]
+        apply_rule_s = state.other_rule_s + [x.rule for x in result_rule_s]
         self._log_apply_decision(
             domain=domain,
-            result_rule_s=result_rule_s,
+            detail_s=self._format_rule_detail_s(result_rule_s, len(state.existed_rule_s)),
             target_ip_s=target_ip_s,
             discard_ip_s=discard_ip_s,
         )
@@ -233,23 +323,27 @@ class TencentEdgeoneAPI:
         LOG.info(f"modify domain {domain} success, requestId={resp.RequestId}")
         return True
 
+    def _format_rule_detail_s(self, result_rule_s: list[ResultRuleItem], num_existed_rule: int):
+        """
+        每个规则的变化，用于下发日志和plan输出
+        """
+        detail_s = []
+        for item in result_rule_s:
+            flag = "modified" if item.is_modified else "no-change"
+            detail_s.append(
+                f"rule: {item.rule.Name} id={item.rule.Id} num_ip={len(item.ip_list)} {flag}"
+            )
+        num_removed_rule = num_existed_rule - len(result_rule_s)
+        if num_removed_rule > 0:
+            detail_s.append(f"rule: {num_removed_rule} removed")
+        return detail_s
+
     def _log_apply_decision(
         self,
         domain: str,
-        result_rule_s: list[ResultRuleItem],
+        detail_s: list[str],
         target_ip_s: list[str],
         discard_ip_s: list[tuple[str, str]],
     ):
-        msg = f"apply decision to {domain} blacklist={len(target_ip_s)} discard={len(discard_ip_s)}"
-        blacklist_str = "\n".join(target_ip_s)
-        blacklist_str = textwrap.shorten(blacklist_str, 800)
-        discard_str = "\n".join([f"{ip} {reason}" for ip, reason in discard_ip_s])
-        discard_str = textwrap.shorten(discard_str, 800)
-        for item in result_rule_s:
-            flag = "modified" if item.is_modified else "no-change"
-            msg += f"\nrule: {item.rule.Name} id={item.rule.Id} num_ip={len(item.ip_list)} {flag}"
-        if blacklist_str:
-            msg += f"\n===blacklist===\n{blacklist_str}"
-        if discard_str:
-            msg += f"\n===discard===\n{discard_str}"
-        LOG.info(msg)
+        title = f"apply decision to {domain} blacklist={len(target_ip_s)} discard={len(discard_ip_s)}"
+        LOG.info("%s", ApplyDecisionMessage(title, target_ip_s, discard_ip_s, detail_s=detail_s))
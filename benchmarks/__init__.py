@@ -0,0 +1,6 @@
+import os
+
+# 压测不依赖真实配置，真实配置可以通过环境变量覆盖
+os.environ.setdefault("CSCDN_CROWDSEC_LAPI_KEY", "bench-lapi-key")
+os.environ.setdefault("CSCDN_TENCENT_SECRET_ID", "bench-secret-id")
+os.environ.setdefault("CSCDN_TENCENT_SECRET_KEY", "bench-secret-key")
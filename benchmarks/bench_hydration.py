@@ -0,0 +1,125 @@
+"""
+启动时全量decision的内存峰值：从模拟LAPI读取全量decision，经过 stream client 的 run()
+和 handler 的处理后写入DecisionStore。
+
+- full: pycrowdsec StreamDecisionClient，resp.json() 后完整的decision放入队列
+- queue: 流式解析，精简记录放入队列，run() 结束后由handler取出
+- sink: 流式解析，stream client 按块直接写入DecisionStore(crowdsec_stream_direct)
+
+python -m benchmarks.bench_hydration --initial 200000
+"""
+
+import argparse
+import gc
+import json
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pycrowdsec.client import StreamDecisionClient
+
+from app.config import AppSettings
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_stream import StreamingDecisionClient
+
+from .synthetic import generate_decision_batch_s
+
+# 测量期间不进行第二次拉取
+STREAM_INTERVAL = 3600
+
+
+class _LapiRequestHandler(BaseHTTPRequestHandler):
+    body = b""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # /v1/decisions?ip= 用于启动前检查LAPI是否可用
+        body = self.body if self.path.startswith("/v1/decisions/stream") else b"null"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _create_handler(mode: str, lapi_url: str):
+    config = AppSettings(
+        crowdsec_lapi_key="key",
+        crowdsec_lapi_url=lapi_url,
+        crowdsec_stream_interval=STREAM_INTERVAL,
+        crowdsec_stream_direct=mode == "sink",
+    )
+    client = None
+    if mode == "full":
+        client = StreamDecisionClient(api_key="key", lapi_url=lapi_url, interval=STREAM_INTERVAL)
+    elif mode == "queue":
+        client = StreamingDecisionClient(api_key="key", lapi_url=lapi_url, interval=STREAM_INTERVAL)
+    handler = CrowdsecDecisionHandler(crowdsec_client=client, config=config)
+    # 只测量读取和处理decision，不下发
+    handler.target_s = []
+    return handler
+
+
+def _hydrate(mode: str, lapi_url: str):
+    handler = _create_handler(mode, lapi_url)
+    if handler._start_crowdsec_client_s() <= 0:
+        raise RuntimeError("lapi not available")
+    handler._handle_crowdsec_decision()
+    return handler
+
+
+def _measure(mode: str, lapi_url: str):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    handler = _hydrate(mode, lapi_url)
+    cost = time.perf_counter() - t0
+    gc.collect()
+    steady, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(handler._decision_store), cost, steady, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_hydration")
+    parser.add_argument("--initial", type=int, default=100000)
+    args = parser.parse_args()
+    batch = generate_decision_batch_s(
+        num_cycle=1,
+        num_initial=args.initial,
+        num_new_per_cycle=0,
+        num_deleted_per_cycle=0,
+    )[0]
+    _LapiRequestHandler.body = json.dumps({"new": batch.new_s, "deleted": None}).encode()
+    del batch
+    print(
+        f"decisions={args.initial}"
+        f" body={len(_LapiRequestHandler.body) / 1024 / 1024:.1f}MB"
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _LapiRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    lapi_url = f"http://{host}:{port}/"
+    print("mode count time_s steady_mb peak_mb peak/steady")
+    try:
+        for mode in ["full", "queue", "sink"]:
+            count, cost, steady, peak = _measure(mode, lapi_url)
+            print(
+                mode,
+                count,
+                f"{cost:.2f}",
+                f"{steady / 1024 / 1024:.1f}",
+                f"{peak / 1024 / 1024:.1f}",
+                f"{peak / max(steady, 1):.2f}",
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+测量启动时的导入耗时，并检查只导入已配置目标的SDK，超出预算时返回非0。
+
+python -m benchmarks.bench_import
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass, field
+
+_CHILD_CODE = """
+import json, sys, time
+t0 = time.perf_counter()
+{stmt}
+cost = time.perf_counter() - t0
+prefix_s = ("pydantic", "pycrowdsec", "tencentcloud.cdn", "tencentcloud.teo")
+module_s = sorted({{p for m in sys.modules for p in prefix_s if m == p or m.startswith(p + ".")}})
+sys.__stdout__.write(json.dumps({{"time": cost, "modules": module_s}}))
+"""
+
+_HELP_STMT = """
+import contextlib, io, runpy
+sys.argv = ["app.main", "--help"]
+with contextlib.redirect_stdout(io.StringIO()):
+    runpy.run_module("app.main", run_name="__main__")
+"""
+
+_HANDLER_STMT = """
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_replay import ReplayDecisionClient
+CrowdsecDecisionHandler(crowdsec_client=ReplayDecisionClient())
+"""
+
+
+@dataclass
+class Scenario:
+    name: str
+    stmt: str
+    # 耗时预算，单位秒
+    budget: float
+    env: dict[str, str] = field(default_factory=dict)
+    forbidden_module_s: list[str] = field(default_factory=list)
+
+
+SCENARIO_S = [
+    Scenario(
+        name="help",
+        stmt=_HELP_STMT,
+        budget=0.05,
+        forbidden_module_s=["pydantic", "pycrowdsec", "tencentcloud.cdn", "tencentcloud.teo"],
+    ),
+    Scenario(
+        name="cdn_only",
+        stmt=_HANDLER_STMT,
+        budget=0.6,
+        env={"CSCDN_TENCENT_CDN_DOMAIN": "bench.example.com"},
+        forbidden_module_s=["pycrowdsec", "tencentcloud.teo"],
+    ),
+    Scenario(
+        name="teo_only",
+        stmt=_HANDLER_STMT,
+        budget=0.6,
+        env={"CSCDN_TENCENT_TEO_ZONE_ID": "bench-zone"},
+        forbidden_module_s=["pycrowdsec", "tencentcloud.cdn"],
+    ),
+]
+
+
+def run_scenario(scenario: Scenario, repeat: int = 5):
+    env = dict(os.environ)
+    env.pop("CSCDN_TENCENT_CDN_DOMAIN", None)
+    env.pop("CSCDN_TENCENT_TEO_ZONE_ID", None)
+    env.update(scenario.env)
+    time_s = []
+    module_s = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", _CHILD_CODE.format(stmt=scenario.stmt)],
+            env=env,
+        )
+        result = json.loads(output)
+        time_s.append(result["time"])
+        module_s = result["modules"]
+    return statistics.median(time_s), module_s
+
+
+def main():
+    import benchmarks  # noqa: F401 设置测试配置
+
+    num_fail = 0
+    for scenario in SCENARIO_S:
+        cost, module_s = run_scenario(scenario)
+        loaded_s = [x for x in scenario.forbidden_module_s if x in module_s]
+        ok = cost <= scenario.budget and not loaded_s
+        num_fail += not ok
+        print(
+            f"{scenario.name:<10} {cost * 1000:8.1f}ms budget={scenario.budget * 1000:.0f}ms"
+            f" modules={','.join(module_s) or '-'} {'OK' if ok else 'FAIL'}"
+        )
+        if loaded_s:
+            print(f"  unexpected modules loaded: {','.join(loaded_s)}")
+    sys.exit(1 if num_fail else 0)
+
+
+if __name__ == "__main__":
+    main()
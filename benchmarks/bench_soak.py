@@ -0,0 +1,89 @@
+"""
+使用本地模拟的腾讯云CDN/EdgeOne后端进行压测，统计每个周期的接口调用次数和字节数。
+
+python -m benchmarks.bench_soak --cycles 50 --initial 20000 --http --workers 2
+"""
+
+import argparse
+import logging
+import time
+
+from app.aggregation_pool import AggregationPool
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_replay import ReplayDecisionClient
+from app.fake_tencent import FakeTencentBackend
+from app.tencent_cdn_api import TencentCdnAPI
+from app.tencent_edgeone_api import TencentEdgeoneAPI
+
+from .synthetic import generate_decision_batch_s
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_soak")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--initial", type=int, default=10000)
+    parser.add_argument("--new", type=int, default=100)
+    parser.add_argument("--deleted", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--http", action="store_true", help="access fake backend by http")
+    parser.add_argument("--workers", type=int, default=0, help="aggregation worker processes")
+    args = parser.parse_args()
+    logging.getLogger("app").setLevel(logging.WARNING)
+
+    batch_s = generate_decision_batch_s(
+        num_cycle=args.cycles,
+        num_initial=args.initial,
+        num_new_per_cycle=args.new,
+        num_deleted_per_cycle=args.deleted,
+    )
+    backend = FakeTencentBackend(latency=args.latency, error_rate=args.error_rate, seed=0)
+    backend.add_domain("fake-cdn-domain")
+    backend.add_zone("fake-teo-zone")
+    server = backend.serve().start() if args.http else None
+    if server:
+        cdn_api = TencentCdnAPI(secret_id="a", secret_key="b", endpoint=server.endpoint)
+        teo_api = TencentEdgeoneAPI(secret_id="a", secret_key="b", endpoint=server.endpoint)
+    else:
+        cdn_api = backend.create_cdn_api()
+        teo_api = backend.create_teo_api()
+    client = ReplayDecisionClient()
+    handler = CrowdsecDecisionHandler(crowdsec_client=client)  # type: ignore
+    handler.target_s = [("fake-cdn-domain", cdn_api), ("fake-teo-zone", teo_api)]
+    if args.workers > 0:
+        handler.aggregation_pool = AggregationPool(args.workers)
+
+    total_time = 0.0
+    num_error = 0
+    print("cycle new deleted time_ms calls request_bytes response_bytes")
+    for idx, batch in enumerate(batch_s):
+        backend.reset_stat()
+        client.load(batch)
+        t0 = time.perf_counter()
+        try:
+            handler._handle_crowdsec_decision()
+        except Exception:
+            num_error += 1
+        cost = time.perf_counter() - t0
+        total_time += cost
+        stat_s = list(backend.stat_d.values())
+        print(
+            idx,
+            len(batch.new_s),
+            len(batch.deleted_s),
+            f"{cost * 1000:.1f}",
+            sum(x.num_call for x in stat_s),
+            sum(x.request_bytes for x in stat_s),
+            sum(x.response_bytes for x in stat_s),
+        )
+    if server:
+        print(f"connections={server.num_connection}")
+        server.stop()
+    if handler.aggregation_pool:
+        handler.aggregation_pool.close()
+    print(f"total_time={total_time:.3f}s errors={num_error}")
+    print(f"final rule state: {backend.get_rule_state()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+对比腾讯云接口的HTTP传输方式：每次新建连接、每个客户端一个连接池、进程内共享连接池(可选gzip)。
+
+python -m benchmarks.bench_transport --targets 4 --cycles 20 --ips 2000 --latency 0.002
+"""
+
+import argparse
+import logging
+import time
+
+from app.fake_tencent import FakeTencentBackend
+from app.target_backend import AggregationCache
+from app.tencent_cdn_api import TencentCdnAPI
+from app.tencent_client import TencentSession, TransportOptions
+from app.tencent_edgeone_api import TencentEdgeoneAPI
+
+
+class _CloseSession(TencentSession):
+    """不保持长连接，每个请求都重新建立连接"""
+
+    def request(self, method, url, *args, headers=None, **kwargs):
+        headers = dict(headers or {})
+        headers["Connection"] = "close"
+        return super().request(method, url, *args, headers=headers, **kwargs)
+
+
+def _ip_list(num: int):
+    return [f"10.{i // 250 % 250}.{i % 250}.{i // 62500 + 1}" for i in range(num)]
+
+
+def _run(mode: str, args):
+    backend = FakeTencentBackend(latency=args.latency)
+    target_s = []
+    for i in range(args.targets):
+        backend.add_domain(f"cdn-{i}.example.com")
+        backend.add_zone(f"zone-{i}")
+    compress_min_bytes = 4096 if mode == "shared-gzip" else 0
+    shared = TencentSession(TransportOptions(compress_min_bytes=compress_min_bytes))
+    with backend.serve() as server:
+
+        def _session():
+            if mode == "close":
+                return _CloseSession(TransportOptions())
+            if mode == "per-client":
+                return TencentSession(TransportOptions())
+            return shared
+
+        for i in range(args.targets):
+            kw = dict(secret_id="a", secret_key="b", endpoint=server.endpoint)
+            target_s.append((f"cdn-{i}.example.com", TencentCdnAPI(**kw, session=_session())))
+            target_s.append((f"zone-{i}", TencentEdgeoneAPI(**kw, session=_session())))
+        t0 = time.perf_counter()
+        for cycle in range(args.cycles):
+            # 每个周期变化一部分IP，保证每次都需要修改规则
+            ip_list = _ip_list(args.ips + cycle * 10)[cycle * 10 :]
+            cache = AggregationCache(ip_list)
+            for domain, api in target_s:
+                api.apply_decision(domain, ip_list, cache=cache)
+        cost = time.perf_counter() - t0
+        num_connection = server.num_connection
+    stat_s = list(backend.stat_d.values())
+    num_call = sum(x.num_call for x in stat_s)
+    request_bytes = sum(x.request_bytes for x in stat_s)
+    return num_call, num_connection, cost, request_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_transport")
+    parser.add_argument("--targets", type=int, default=4, help="cdn domains and teo zones")
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--ips", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.002)
+    args = parser.parse_args()
+    logging.getLogger("app").setLevel(logging.WARNING)
+    print("mode calls connections time_s ms/call request_mb")
+    for mode in ["close", "per-client", "shared", "shared-gzip"]:
+        num_call, num_connection, cost, request_bytes = _run(mode, args)
+        print(
+            mode,
+            num_call,
+            num_connection,
+            f"{cost:.2f}",
+            f"{cost * 1000 / max(num_call, 1):.2f}",
+            f"{request_bytes / 1024 / 1024:.1f}",
+        )
+
+
+if __name__ == "__main__":
+    main()
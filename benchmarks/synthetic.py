@@ -0,0 +1,58 @@
+import random
+
+from app.decision_recorder import DecisionBatch
+
+
+def _decision(ip: str):
+    return {
+        "duration": "4h",
+        "origin": "crowdsec",
+        "scenario": "crowdsecurity/http-probing",
+        "scope": "Ip",
+        "type": "ban",
+        "value": ip,
+    }
+
+
+def generate_decision_batch_s(
+    *,
+    num_cycle: int,
+    num_initial: int,
+    num_new_per_cycle: int,
+    num_deleted_per_cycle: int,
+    interval: float = 10,
+    seed: int = 0,
+) -> list[DecisionBatch]:
+    """
+    生成模拟的decision stream: 第一个批次是启动时的全量decision，之后每个批次有新增和删除。
+    """
+    rand = random.Random(seed)
+    active_ip_s: list[str] = []
+    active_ip_set: set[str] = set()
+
+    def _new_ip():
+        while True:
+            ip = ".".join(str(rand.randint(1, 223)) for _ in range(4))
+            if ip not in active_ip_set:
+                active_ip_set.add(ip)
+                active_ip_s.append(ip)
+                return ip
+
+    ts = 1_700_000_000.0
+    batch_s = [
+        DecisionBatch(
+            ts=ts,
+            new_s=[_decision(_new_ip()) for _ in range(num_initial)],
+            deleted_s=[],
+        )
+    ]
+    for _ in range(num_cycle - 1):
+        ts += interval
+        deleted_s = []
+        for _ in range(min(num_deleted_per_cycle, len(active_ip_s))):
+            ip = active_ip_s.pop(rand.randrange(len(active_ip_s)))
+            active_ip_set.discard(ip)
+            deleted_s.append(_decision(ip))
+        new_s = [_decision(_new_ip()) for _ in range(num_new_per_cycle)]
+        batch_s.append(DecisionBatch(ts=ts, new_s=new_s, deleted_s=deleted_s))
+    return batch_s
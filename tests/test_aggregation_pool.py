@@ -0,0 +1,109 @@
+import os
+import signal
+
+import pytest
+
+from app.aggregation_pool import AggregationPool, pack_ip_list
+from app.config import AppSettings
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_recorder import DecisionBatch
+from app.decision_replay import ReplayDecisionClient, StubTargetAPI
+from app.fake_tencent import FakeTencentBackend
+from app.prefix_db import PrefixDB, build_prefix_db, parse_prefix_line
+from app.target_backend import AggregationCache, IpListSpec
+
+
+def _decision(ip: str):
+    return {"duration": "1h", "value": ip, "type": "ban", "scope": "Ip"}
+
+
+def test_pack_ip_list():
+    ip_list = ["1.1.1.1", "10.0.0.0/24", "2001:db8::1", "10.0.0.1/32", "2.2.2.2"]
+    packed, index_s, other_ip_s = pack_ip_list(ip_list)
+    assert list(packed) == [0x01010101, 255, 0x0A000000, 24, 0x0A000001, 32, 0x02020202, 255]
+    assert list(index_s) == [0, 1, 3, 4]
+    assert other_ip_s == ["2001:db8::1"]
+    with pytest.raises(Exception):
+        pack_ip_list(["not an ip"])
+
+
+def test_aggregation_pool(tmp_path):
+    path = str(tmp_path / "prefix.db")
+    build_prefix_db([parse_prefix_line("10.1.0.0/20 100")], path)  # type: ignore
+    ban_ip_list = [f"10.0.{i}.{j}" for i in range(30) for j in range(1, 12 if i < 3 else 2)]
+    ban_ip_list += [f"10.1.{i}.1" for i in range(16)]
+    ban_ip_list += ["2001:db8::1", "192.168.0.0/16", "172.16.0.1"]
+    spec_s = [
+        IpListSpec(max_size=200),
+        IpListSpec(max_size=20, ignore_ip_s=frozenset(["172.16.0.1"])),
+        IpListSpec(max_size=5),
+    ]
+    pool = AggregationPool(max_workers=2)
+    try:
+        with PrefixDB(path) as db:
+            local_cache = AggregationCache(ban_ip_list, prefix_db=db, prefix_merge_density=0.5)
+            pool_cache = AggregationCache(
+                ban_ip_list, prefix_db=db, prefix_merge_density=0.5, pool=pool
+            )
+            pool_cache.prefetch(spec_s + spec_s[:1])
+            assert pool_cache.num_compute == 3
+            for spec in spec_s:
+                expect = local_cache.get(spec)
+                result = pool_cache.get(spec)
+                assert result.ip_s == expect.ip_s
+                assert sorted(result.discard_ip_s) == sorted(expect.discard_ip_s)
+            assert "10.1.0.0/20" in pool_cache.get(spec_s[0]).ip_s
+            # 没有预先计算的参数也在进程池中计算
+            spec = IpListSpec(max_size=10)
+            assert pool_cache.get(spec).ip_s == local_cache.get(spec).ip_s
+    finally:
+        pool.close()
+
+
+def test_handler_aggregation_pool():
+    config = AppSettings(crowdsec_lapi_key="key", aggregation_workers=1)
+    client = ReplayDecisionClient()
+    handler = CrowdsecDecisionHandler(crowdsec_client=client, config=config)  # type: ignore
+    backend = FakeTencentBackend()
+    backend.add_domain("a.example.com")
+    backend.add_zone("zone-1")
+    handler.target_s = [
+        ("a.example.com", backend.create_cdn_api()),
+        ("zone-1", backend.create_teo_api()),
+    ]
+    try:
+        new_s = [
+            {"duration": "1h", "value": f"10.{i // 200}.{i % 200}.1", "type": "ban", "scope": "Ip"}
+            for i in range(300)
+        ]
+        client.load(DecisionBatch(ts=100, new_s=new_s, deleted_s=[]))
+        handler._handle_crowdsec_decision(now=100)
+    finally:
+        handler.aggregation_pool.close()  # type: ignore
+    assert len(backend.get_domain_blacklist("a.example.com")) == 200
+    assert sum(len(x) for x in backend.get_zone_rule_ip_list("zone-1").values()) == 300
+
+
+def test_aggregation_pool_worker_died():
+    config = AppSettings(crowdsec_lapi_key="key", aggregation_workers=1)
+    client = ReplayDecisionClient()
+    handler = CrowdsecDecisionHandler(crowdsec_client=client, config=config)  # type: ignore
+    stub_api = StubTargetAPI()
+    handler.target_s = [("stub", stub_api)]  # type: ignore
+    pool = handler.aggregation_pool
+    try:
+        client.load(DecisionBatch(ts=100, new_s=[_decision("10.0.0.1")], deleted_s=[]))
+        handler._handle_crowdsec_decision(now=100)
+        assert stub_api.ban_ip_list_d["stub"] == ["10.0.0.1"]
+        # worker被kill后，本轮在主进程中聚合，并重新创建进程池
+        for pid in list(pool._executor._processes):  # type: ignore
+            os.kill(pid, signal.SIGKILL)
+        client.load(DecisionBatch(ts=110, new_s=[_decision("10.0.1.1")], deleted_s=[]))
+        handler._handle_crowdsec_decision(now=110)
+        assert stub_api.ban_ip_list_d["stub"] == ["10.0.0.1", "10.0.1.1"]
+        client.load(DecisionBatch(ts=120, new_s=[_decision("10.0.2.1")], deleted_s=[]))
+        handler._handle_crowdsec_decision(now=120)
+        assert stub_api.ban_ip_list_d["stub"] == ["10.0.0.1", "10.0.1.1", "10.0.2.1"]
+        assert pool._executor._processes  # type: ignore
+    finally:
+        pool.close()  # type: ignore
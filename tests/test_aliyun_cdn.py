@@ -0,0 +1,88 @@
+import pytest
+import requests
+
+from app.aliyun_cdn_api import AliyunApiError, AliyunCdnAPI, sign_rpc_request
+from app.fake_aliyun import FakeAliyunCdnBackend
+from app.fake_tencent import FakeTencentBackend
+from app.target_backend import AggregationCache
+
+
+def _ip_list(num: int):
+    return [f"10.{i // 250}.{i % 250}.1" for i in range(num)]
+
+
+def test_sign_rpc_request():
+    # 阿里云文档中的签名示例
+    params = {
+        "AccessKeyId": "testid",
+        "Action": "DescribeRegions",
+        "Format": "XML",
+        "SignatureMethod": "HMAC-SHA1",
+        "SignatureNonce": "3ee8c1b8-83d3-44af-a94f-4e0ad82fd6cf",
+        "SignatureVersion": "1.0",
+        "Timestamp": "2016-02-23T12:46:24Z",
+        "Version": "2014-05-26",
+    }
+    assert sign_rpc_request(params, "testsecret", method="GET") == "OLeaidS1JvxuMvnyHOwuJ+uX5qY="
+
+
+def test_aliyun_apply_decision():
+    backend = FakeAliyunCdnBackend(access_key_secret="secret", max_ip=100)
+    backend.add_domain("a.example.com")
+    with backend.serve() as server:
+        api = AliyunCdnAPI(
+            access_key_id="id",
+            access_key_secret="secret",
+            endpoint=server.endpoint,
+            max_ip=100,
+        )
+        api.check_target("a.example.com")
+        with pytest.raises(RuntimeError):
+            api.check_target("b.example.com")
+
+        assert api.apply_decision("a.example.com", _ip_list(150))
+        assert set(backend.get_domain_blacklist("a.example.com")) == set(_ip_list(100))
+        # 已有配置时使用ConfigId修改
+        assert api.apply_decision("a.example.com", _ip_list(50))
+        assert set(backend.get_domain_blacklist("a.example.com")) == set(_ip_list(50))
+        # IP列表不变时不会修改配置
+        assert api.apply_decision("a.example.com", _ip_list(50))
+        assert backend.stat_d["BatchSetCdnDomainConfig"].num_call == 2
+
+        bad_api = AliyunCdnAPI(
+            access_key_id="id", access_key_secret="wrong", endpoint=server.endpoint
+        )
+        with pytest.raises(AliyunApiError) as ex_info:
+            bad_api.get_domain_config("a.example.com")
+        assert ex_info.value.code == "SignatureDoesNotMatch"
+
+
+def test_aliyun_non_json_error(monkeypatch):
+    api = AliyunCdnAPI(access_key_id="id", access_key_secret="secret")
+    resp = requests.Response()
+    resp.status_code = 502
+    resp._content = b"<html>502 Bad Gateway</html>"
+    monkeypatch.setattr(api._get_session(), "post", lambda *args, **kwargs: resp)
+    with pytest.raises(AliyunApiError) as ex_info:
+        api.get_domain_config("a.example.com")
+    assert ex_info.value.code == "HTTP502"
+
+
+def test_aggregation_cache_shared():
+    tencent = FakeTencentBackend()
+    tencent.add_domain("a.example.com")
+    tencent.add_domain("b.example.com")
+    cdn_api = tencent.create_cdn_api()
+    teo_api = tencent.create_teo_api()
+    tencent.add_zone("zone-1")
+
+    cache = AggregationCache(_ip_list(300))
+    assert cdn_api.apply_decision("a.example.com", cache.ban_ip_list, cache=cache)
+    assert cdn_api.apply_decision("b.example.com", cache.ban_ip_list, cache=cache)
+    # 两个CDN域名的限制相同，只聚合一次
+    assert cache.num_compute == 1
+    assert teo_api.apply_decision("zone-1", cache.ban_ip_list, cache=cache)
+    assert cache.num_compute == 2
+    blacklist = tencent.get_domain_blacklist("a.example.com")
+    assert len(blacklist) == 200
+    assert tencent.get_domain_blacklist("b.example.com") == blacklist
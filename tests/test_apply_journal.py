@@ -0,0 +1,96 @@
+from app.apply_journal import ApplyJournal, JournalEntry, get_journal_path_s, query_journal
+from app.fake_tencent import FakeTencentBackend
+from app.log_render import ApplyDecisionMessage, CappedList
+
+
+def test_capped_list():
+    class CountingList(list):
+        num_get = 0
+
+        def __iter__(self):
+            for item in super().__iter__():
+                CountingList.num_get += 1
+                yield item
+
+    ip_s = CountingList(f"10.0.{i // 250}.{i % 250}" for i in range(100000))
+    text = str(CappedList(ip_s, max_chars=100))
+    assert len(text) < 130
+    assert text.endswith("more]")
+    # 只遍历到长度上限
+    assert CountingList.num_get < 20
+    assert str(CappedList(["1.1.1.1", "2.2.2.2"])) == "1.1.1.1 2.2.2.2"
+
+    msg = str(ApplyDecisionMessage("title", ["1.1.1.1"], [("2.2.2.2", "full")]))
+    assert msg == "title\n===blacklist===\n1.1.1.1\n===discard===\n2.2.2.2(full)"
+
+
+def test_apply_journal_rotate(tmp_path):
+    path = str(tmp_path / "apply.jsonl")
+    journal = ApplyJournal(path, max_bytes=300, backup_count=2)
+    for i in range(10):
+        journal.write(JournalEntry(ts=i, target="a.example.com", kind="tencent_cdn", added=[f"10.0.0.{i}"]))
+    journal.close()
+    path_s = get_journal_path_s(path)
+    assert path_s == [path + ".2", path + ".1", path]
+    ts_s = [x.ts for x in query_journal(path)]
+    # 最旧的日志被轮转删除，剩余的按时间顺序
+    assert ts_s == sorted(ts_s)
+    assert ts_s[-1] == 9
+    assert [x.ts for x in query_journal(path, ip="10.0.0.9")] == [9]
+    assert [x.ts for x in query_journal(path, since=8)] == [8, 9]
+    assert list(query_journal(path, target="b.example.com")) == []
+
+
+def test_apply_journal_record(tmp_path):
+    path = str(tmp_path / "apply.jsonl")
+    journal = ApplyJournal(path)
+    backend = FakeTencentBackend()
+    backend.add_domain("a.example.com")
+    api = backend.create_cdn_api()
+    api.apply_decision("a.example.com", ["1.1.1.1", "2.2.2.2"], journal=journal)
+    api.apply_decision("a.example.com", ["2.2.2.2", "3.3.3.3"], journal=journal)
+    # 没有变化时不记录
+    api.apply_decision("a.example.com", ["2.2.2.2", "3.3.3.3"], journal=journal)
+    journal.close()
+    entry_s = list(query_journal(path))
+    assert len(entry_s) == 2
+    assert entry_s[0].added == ["1.1.1.1", "2.2.2.2"]
+    assert entry_s[1].kind == "tencent_cdn"
+    assert entry_s[1].added == ["3.3.3.3"]
+    assert entry_s[1].removed == ["1.1.1.1"]
+
+
+def test_apply_journal_discard_delta(tmp_path):
+    path = str(tmp_path / "apply.jsonl")
+    journal = ApplyJournal(path)
+    discard_s = [(f"10.0.1.{i}", "full") for i in range(100)]
+    journal.record(
+        target="a", kind="stub", current_ip_s=[], ip_s=["1.1.1.1"], discard_ip_s=discard_s, ts=1
+    )
+    # 只记录丢弃列表的变化
+    journal.record(
+        target="a",
+        kind="stub",
+        current_ip_s=["1.1.1.1"],
+        ip_s=["1.1.1.1", "10.0.1.0"],
+        discard_ip_s=discard_s[1:] + [("10.0.2.1", "full")],
+        ts=2,
+    )
+    # 只有丢弃列表变化时也记录
+    journal.record(
+        target="a",
+        kind="stub",
+        current_ip_s=["1.1.1.1", "10.0.1.0"],
+        ip_s=["1.1.1.1", "10.0.1.0"],
+        discard_ip_s=discard_s[1:],
+        ts=3,
+    )
+    journal.close()
+    entry_s = list(query_journal(path))
+    assert len(entry_s[0].discarded) == 100
+    assert entry_s[1].discarded == [("10.0.2.1", "full")]
+    assert entry_s[1].undiscarded == ["10.0.1.0"]
+    assert entry_s[1].num_discard == 100
+    assert entry_s[2].undiscarded == ["10.0.2.1"]
+    assert [x.ts for x in query_journal(path, ip="10.0.2.1")] == [2, 3]
+    assert [x.ts for x in query_journal(path, ip="10.0.1.5")] == [1]
@@ -0,0 +1,190 @@
+import logging
+import os
+
+import pytest
+
+from app import config as config_module
+from app.config import AppSettings, diff_config
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_recorder import DecisionBatch
+from app.decision_replay import ReplayDecisionClient
+from app.fake_tencent import FakeTencentBackend
+
+
+def _decision(ip: str):
+    return {"duration": "1h", "origin": "crowdsec", "scope": "Ip", "type": "ban", "value": ip}
+
+
+def test_config_credential():
+    with pytest.raises(ValueError, match="tencent_secret_id"):
+        AppSettings(crowdsec_lapi_key="key", tencent_teo_zone_id="zone-1")
+    with pytest.raises(ValueError, match="aliyun_access_key_id"):
+        AppSettings(crowdsec_lapi_key="key", aliyun_cdn_domain="a.example.com")
+    # 没有配置目标时不需要密钥
+    assert AppSettings(crowdsec_lapi_key="key").tencent_secret_id == ""
+
+
+def test_diff_config():
+    config = AppSettings(crowdsec_lapi_key="key")
+    assert diff_config(config, config.model_copy()) == set()
+    new_config = config.model_copy(update={"log_level": "DEBUG", "tencent_teo_max_rule": 5})
+    assert diff_config(config, new_config) == {"log_level", "tencent_teo_max_rule"}
+
+
+def test_reload_config():
+    backend = FakeTencentBackend()
+    backend.add_domain("a.example.com")
+    backend.add_domain("b.example.com")
+    backend.add_zone("zone-1")
+    root_level = logging.getLogger().level
+    with backend.serve() as server:
+        config = AppSettings(
+            crowdsec_lapi_key="key",
+            tencent_secret_id="id",
+            tencent_secret_key="key",
+            tencent_endpoint=server.endpoint,
+            tencent_cdn_domain="a.example.com",
+        )
+        client = ReplayDecisionClient()
+        handler = CrowdsecDecisionHandler(crowdsec_client=client, config=config)  # type: ignore
+        client.load(DecisionBatch(ts=100, new_s=[_decision("1.1.1.1")], deleted_s=[]))
+        handler._handle_crowdsec_decision(now=100)
+        assert backend.get_domain_blacklist("a.example.com") == ["1.1.1.1"]
+        cdn_api = handler.target_s[0][1]
+
+        new_config = config.model_copy(
+            update={
+                "log_level": "DEBUG",
+                "tencent_cdn_domain": "a.example.com,b.example.com",
+                "tencent_teo_zone_id": "zone-1",
+                "crowdsec_lapi_url": "http://other:8080/",
+            }
+        )
+        try:
+            changed_field_s = handler.reload_config(new_config)
+            assert logging.getLogger().level == logging.DEBUG
+        finally:
+            logging.getLogger().setLevel(root_level)
+        assert "tencent_cdn_domain" in changed_field_s
+        # 需要重启的配置保持不变
+        assert handler.config.crowdsec_lapi_url == config.crowdsec_lapi_url
+        # 配置没有变化的后端继续使用
+        assert handler.target_s[0][1] is cdn_api
+        assert handler.target_s[1][1] is cdn_api
+
+        # 没有新的decision时，只下发新增的目标
+        backend.reset_stat()
+        handler._handle_crowdsec_decision(now=110)
+        assert backend.get_domain_blacklist("b.example.com") == ["1.1.1.1"]
+        assert list(backend.get_zone_rule_ip_list("zone-1").values()) == [["1.1.1.1"]]
+        assert backend.stat_d["DescribeDomainsConfig"].num_call == 1
+        backend.reset_stat()
+        handler._handle_crowdsec_decision(now=120)
+        assert backend.stat_d["DescribeDomainsConfig"].num_call == 0
+
+        # 后端配置变化时重新创建该后端，并重新下发它的目标
+        handler.reload_config(handler.config.model_copy(update={"tencent_teo_max_rule": 5}))
+        assert handler.target_s[0][1] is cdn_api
+        assert handler.target_s[2][1] is not cdn_api
+        handler._handle_crowdsec_decision(now=130)
+        assert backend.stat_d["DescribeDomainsConfig"].num_call == 0
+        assert backend.stat_d["DescribeSecurityPolicy"].num_call == 1
+        assert len(handler._decision_store) == 1
+
+
+def test_reload_config_from_envfile(tmp_path, monkeypatch):
+    envfile = tmp_path / "cscdn.env"
+    envfile.write_text(
+        "CSCDN_TENCENT_CDN_DOMAIN=a.example.com,b.example.com\n"
+        "CSCDN_TENCENT_TEO_MAX_RULE=5\n"
+        "CSCDN_LOG_LEVEL=DEBUG\n"
+    )
+    monkeypatch.setenv("CSCDN_CONFIG", str(envfile))
+    monkeypatch.delenv("CSCDN_TENCENT_CDN_DOMAIN", raising=False)
+    monkeypatch.delenv("CSCDN_TENCENT_TEO_MAX_RULE", raising=False)
+    # 启动时的环境变量优先于envfile
+    monkeypatch.setattr(
+        config_module,
+        "_STARTUP_ENV",
+        {**os.environ, "CSCDN_LOG_LEVEL": "WARNING"},
+    )
+    config = config_module.reload_config()
+    assert config.tencent_cdn_domain == "a.example.com,b.example.com"
+    assert config.tencent_teo_max_rule == 5
+    assert config.log_level == "WARNING"
+    assert config.crowdsec_lapi_key == os.environ["CSCDN_CROWDSEC_LAPI_KEY"]
+
+    handler = CrowdsecDecisionHandler(
+        crowdsec_client=ReplayDecisionClient(), config=config  # type: ignore
+    )
+    assert [x[0] for x in handler.target_s] == ["a.example.com", "b.example.com"]
+    # envfile中删除的配置项恢复默认值，且不写入os.environ
+    envfile.write_text("CSCDN_TENCENT_CDN_DOMAIN=a.example.com\n")
+    new_config = config_module.reload_config()
+    assert new_config.tencent_cdn_domain == "a.example.com"
+    assert new_config.tencent_teo_max_rule == AppSettings.model_fields["tencent_teo_max_rule"].default
+    assert "CSCDN_TENCENT_CDN_DOMAIN" not in os.environ
+    handler.reload_config(new_config)
+    assert [x[0] for x in handler.target_s] == ["a.example.com"]
+
+
+def test_reload_config_pending_retry():
+    backend = FakeTencentBackend()
+    backend.add_domain("a.example.com")
+    backend.add_zone("zone-1")
+    with backend.serve() as server:
+        config = AppSettings(
+            crowdsec_lapi_key="key",
+            tencent_secret_id="id",
+            tencent_secret_key="key",
+            tencent_endpoint=server.endpoint,
+            tencent_cdn_domain="a.example.com",
+        )
+        client = ReplayDecisionClient()
+        handler = CrowdsecDecisionHandler(crowdsec_client=client, config=config)  # type: ignore
+        client.load(DecisionBatch(ts=100, new_s=[_decision("1.1.1.1")], deleted_s=[]))
+        handler._handle_crowdsec_decision(now=100)
+        handler.reload_config(config.model_copy(update={"tencent_teo_zone_id": "zone-1"}))
+        backend.inject_error("ModifySecurityPolicy", "InternalError")
+        handler._handle_crowdsec_decision(now=110)
+        assert backend.get_zone_rule_ip_list("zone-1") == {}
+        # 下发失败的目标在下一轮重试，成功后不再下发
+        handler._handle_crowdsec_decision(now=120)
+        assert list(backend.get_zone_rule_ip_list("zone-1").values()) == [["1.1.1.1"]]
+        backend.reset_stat()
+        handler._handle_crowdsec_decision(now=130)
+        assert "DescribeSecurityPolicy" not in backend.stat_d
+
+
+def test_reload_config_failed(tmp_path):
+    config = AppSettings(
+        crowdsec_lapi_key="key",
+        tencent_secret_id="id",
+        tencent_secret_key="key",
+        tencent_cdn_domain="a.example.com",
+    )
+    handler = CrowdsecDecisionHandler(
+        crowdsec_client=ReplayDecisionClient(), config=config  # type: ignore
+    )
+    target_s = handler.target_s
+    root_level = logging.getLogger().level
+    journal_path = str(tmp_path / "apply.jsonl")
+    new_config = config.model_copy(
+        update={
+            "log_level": "DEBUG",
+            "tencent_cdn_domain": "a.example.com,b.example.com",
+            "apply_journal_path": journal_path,
+            "prefix_db_path": str(tmp_path / "missing.db"),
+        }
+    )
+    try:
+        with pytest.raises(OSError):
+            handler.reload_config(new_config)
+        # 创建失败时不应用任何变化
+        assert logging.getLogger().level == root_level
+    finally:
+        logging.getLogger().setLevel(root_level)
+    assert handler.target_s is target_s
+    assert handler.journal is None
+    assert handler.config is config
+    assert not handler._pending_target_key_s
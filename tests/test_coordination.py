@@ -0,0 +1,194 @@
+import pytest
+
+from app.config import AppSettings
+from app.coordination import TargetCoordinator, create_lease_store
+from app import decision_handler
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_recorder import DecisionBatch
+from app.decision_replay import ReplayDecisionClient, StubTargetAPI
+
+
+@pytest.fixture(params=["sqlite", "file"])
+def store_url(request, tmp_path):
+    if request.param == "sqlite":
+        return f"sqlite://{tmp_path}/lease.db"
+    return f"file://{tmp_path}/lease"
+
+
+def test_lease_store(store_url):
+    store = create_lease_store(store_url)
+    assert store.try_acquire("t1", "a", ttl=60, now=0)
+    assert not store.try_acquire("t1", "b", ttl=60, now=10)
+    # 续期
+    assert store.try_acquire("t1", "a", ttl=60, now=30)
+    assert store.get_holder("t1", now=80) == "a"
+    # 过期后可以被其他副本获取
+    assert store.try_acquire("t1", "b", ttl=60, now=91)
+    store.release("t1", "a")
+    assert store.get_holder("t1", now=92) == "b"
+    store.release("t1", "b")
+    assert store.get_holder("t1", now=92) is None
+
+    store.heartbeat("a", ttl=60, now=0)
+    store.heartbeat("b", ttl=60, now=30)
+    assert store.get_live_member_s(now=40) == ["a", "b"]
+    assert store.get_live_member_s(now=70) == ["b"]
+
+
+def test_coordinator_sharding_and_failover(store_url):
+    key_s = [f"target-{i}" for i in range(8)]
+    coord_a = TargetCoordinator(create_lease_store(store_url), "a", ttl=60)
+    coord_b = TargetCoordinator(create_lease_store(store_url), "b", ttl=60)
+    _, unsynced_a = coord_a.update(key_s, now=0)
+    assert unsynced_a == set(key_s)
+    for key in unsynced_a:
+        coord_a.mark_synced(key)
+    coord_b.update(key_s, now=1)
+    # a 先启动持有所有目标，b 加入后 a 释放不属于自己的目标
+    owned_a, unsynced_a = coord_a.update(key_s, now=10)
+    owned_b, unsynced_b = coord_b.update(key_s, now=11)
+    assert owned_a | owned_b == set(key_s)
+    assert not owned_a & owned_b
+    assert owned_a and owned_b
+    assert not unsynced_a
+    assert unsynced_b == owned_b
+
+    # b 停止心跳后，a 在租约过期后接管
+    owned_a, unsynced_a = coord_a.update(key_s, now=80)
+    assert owned_a == set(key_s)
+    assert unsynced_a == owned_b
+    # 下发成功前一直需要下发完整状态
+    _, unsynced_a = coord_a.update(key_s, now=85)
+    assert unsynced_a == owned_b
+
+
+def test_coordinator_release_and_renew(store_url):
+    store = create_lease_store(store_url)
+    coord = TargetCoordinator(store, "a", ttl=60)
+    coord.update(["t1", "t2"], now=0)
+    assert store.get_holder("t2", now=1) == "a"
+    # 从配置中移除的目标释放租约
+    owned, _ = coord.update(["t1"], now=10)
+    assert owned == {"t1"}
+    assert store.get_holder("t2", now=11) is None
+
+    assert coord.renew("t1", now=20)
+    assert store.get_holder("t1", now=75) == "a"
+    # 租约过期后被其他副本获取，不能再修改
+    assert store.try_acquire("t1", "b", ttl=60, now=90)
+    assert not coord.renew("t1", now=91)
+    assert not coord.renew("t2", now=91)
+
+
+def _decision(ip: str):
+    return {"duration": "1h", "scope": "Ip", "type": "ban", "value": ip}
+
+
+def test_handler_standby_takeover(tmp_path):
+    config = AppSettings(
+        crowdsec_lapi_key="key",
+        tencent_secret_id="id",
+        tencent_secret_key="key",
+        coordination_url=f"sqlite://{tmp_path}/lease.db",
+    )
+    handler_s = []
+    for replica_id in ["a", "b"]:
+        config = config.model_copy(update={"replica_id": replica_id})
+        handler = CrowdsecDecisionHandler(
+            crowdsec_client=ReplayDecisionClient(), config=config  # type: ignore
+        )
+        handler.target_s = [("stub", StubTargetAPI())]  # type: ignore
+        handler_s.append(handler)
+    for handler in handler_s:
+        client: ReplayDecisionClient = handler.crowdsec_client_s[0][1]  # type: ignore
+        client.load(DecisionBatch(ts=0, new_s=[_decision("1.1.1.1")], deleted_s=[]))
+        handler._handle_crowdsec_decision(now=0)
+    api_s: list[StubTargetAPI] = [x.target_s[0][1] for x in handler_s]  # type: ignore
+    # 只有一个副本下发
+    assert sorted(x.num_apply for x in api_s) == [0, 1]
+    owner_idx = 0 if api_s[0].num_apply else 1
+    standby = handler_s[1 - owner_idx]
+    assert standby._get_ban_ip_list() == ["1.1.1.1"]
+
+    # 主副本停止后，备用副本接管并直接下发已有状态
+    standby._handle_crowdsec_decision(now=100)
+    assert api_s[1 - owner_idx].num_apply == 1
+    assert api_s[1 - owner_idx].ban_ip_list_d["stub"] == ["1.1.1.1"]
+    standby._handle_crowdsec_decision(now=110)
+    assert api_s[1 - owner_idx].num_apply == 1
+
+
+class _FailingStubAPI(StubTargetAPI):
+    def __init__(self, num_fail: int):
+        super().__init__()
+        self.num_fail = num_fail
+
+    def commit_decision(self, prepared, result):
+        if self.num_fail > 0:
+            self.num_fail -= 1
+            raise RuntimeError("api error")
+        return super().commit_decision(prepared, result)
+
+
+def test_handler_takeover_retry(tmp_path):
+    config = AppSettings(
+        crowdsec_lapi_key="key",
+        coordination_url=f"sqlite://{tmp_path}/lease.db",
+        replica_id="a",
+    )
+    client = ReplayDecisionClient()
+    handler = CrowdsecDecisionHandler(crowdsec_client=client, config=config)  # type: ignore
+    stub_api = _FailingStubAPI(num_fail=2)
+    handler.target_s = [("stub", stub_api)]  # type: ignore
+    client.load(DecisionBatch(ts=0, new_s=[_decision("1.1.1.1")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=0)
+    assert stub_api.num_apply == 0
+    # 接管后的首次下发失败时，后续周期继续重试直到成功
+    handler._handle_crowdsec_decision(now=10)
+    handler._handle_crowdsec_decision(now=20)
+    assert stub_api.num_apply == 1
+    handler._handle_crowdsec_decision(now=30)
+    assert stub_api.num_apply == 1
+
+
+class _SlowStubAPI(StubTargetAPI):
+    def __init__(self, clock: dict, cost: float):
+        super().__init__()
+        self.clock = clock
+        self.cost = cost
+
+    def prepare_decision(self, domain):
+        self.clock["monotonic"] += self.cost
+        return super().prepare_decision(domain)
+
+
+def test_handler_renew_at_write_time(tmp_path, monkeypatch):
+    clock = {"monotonic": 0.0}
+
+    class _FakeTime:
+        @staticmethod
+        def time():
+            return 0.0
+
+        @staticmethod
+        def monotonic():
+            return clock["monotonic"]
+
+    monkeypatch.setattr(decision_handler, "time", _FakeTime)
+    store_url = f"sqlite://{tmp_path}/lease.db"
+    config = AppSettings(
+        crowdsec_lapi_key="key",
+        coordination_url=store_url,
+        coordination_lease_ttl=90,
+        replica_id="a",
+    )
+    client = ReplayDecisionClient()
+    handler = CrowdsecDecisionHandler(crowdsec_client=client, config=config)  # type: ignore
+    stub_api = _SlowStubAPI(clock, cost=100)
+    handler.target_s = [("stub", stub_api)]  # type: ignore
+    client.load(DecisionBatch(ts=0, new_s=[_decision("1.1.1.1")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=0)
+    assert stub_api.num_apply == 1
+    # 读取远端状态耗时超过租约时间，按下发时的时间续期
+    store = create_lease_store(store_url)
+    assert store.get_holder("stub:stub", now=150) == "a"
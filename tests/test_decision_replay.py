@@ -0,0 +1,86 @@
+from app.config import AppSettings
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_recorder import DecisionRecorder, read_decision_log
+from app.decision_replay import (
+    ReplayDecisionClient,
+    StubTargetAPI,
+    create_fake_target_s,
+    replay_decision_log,
+)
+
+
+def _decision(ip: str):
+    return {"duration": "1h", "origin": "crowdsec", "scope": "Ip", "type": "ban", "value": ip}
+
+
+def test_record_and_read_decision_log(tmp_path):
+    for name in ["decision.jsonl", "decision.jsonl.gz"]:
+        path = str(tmp_path / name)
+        recorder = DecisionRecorder(path)
+        recorder.record([_decision("1.1.1.1")], [], ts=100)
+        recorder.record([], [], ts=101)  # 空批次不记录
+        recorder.record([_decision("2.2.2.2")], [_decision("1.1.1.1")], ts=102)
+        recorder.close()
+        batch_s = list(read_decision_log(path))
+        assert [x.ts for x in batch_s] == [100, 102]
+        assert batch_s[0].new_s == [_decision("1.1.1.1")]
+        assert batch_s[1].deleted_s == [_decision("1.1.1.1")]
+
+
+def test_replay_decision_log(tmp_path):
+    path = str(tmp_path / "decision.jsonl")
+    recorder = DecisionRecorder(path)
+    recorder.record([_decision(f"10.0.0.{i}") for i in range(1, 6)], [], ts=100)
+    recorder.record([_decision("10.0.1.1")], [_decision("10.0.0.1")], ts=110)
+    recorder.record([], [_decision("10.0.0.2")], ts=120)
+    recorder.close()
+
+    handler = CrowdsecDecisionHandler(crowdsec_client=ReplayDecisionClient())  # type: ignore
+    stub_api = StubTargetAPI()
+    handler.target_s = [("stub", stub_api)]  # type: ignore
+    report = replay_decision_log(handler, read_decision_log(path))
+    assert report.num_cycle == 3
+    assert report.num_new == 6
+    assert report.num_deleted == 2
+    assert len(report.cycle_latency_s) == 3
+    assert report.final_ban_count == 4
+    # 只有新增decision时才下发
+    assert stub_api.num_apply == 2
+    # 和真实后端一样聚合后下发
+    assert sorted(stub_api.ban_ip_list_d["stub"]) == ["10.0.0.2/31", "10.0.0.4/31", "10.0.1.1"]
+    assert "cycles=3" in report.format()
+
+
+def test_replay_multi_source(tmp_path):
+    path = str(tmp_path / "decision.jsonl")
+    recorder = DecisionRecorder(path)
+    recorder.record([_decision("10.0.0.1")], [], ts=100, source="http://a/")
+    recorder.record([_decision("10.0.0.1"), _decision("10.0.0.2")], [], ts=100, source="http://b/")
+    recorder.record([], [_decision("10.0.0.1")], ts=110, source="http://a/")
+    recorder.close()
+
+    handler = CrowdsecDecisionHandler(crowdsec_client=ReplayDecisionClient())  # type: ignore
+    stub_api = StubTargetAPI()
+    handler.target_s = [("stub", stub_api)]  # type: ignore
+    report = replay_decision_log(handler, read_decision_log(path))
+    assert report.num_cycle == 2
+    assert [x[0] for x in handler.crowdsec_client_s] == ["http://a/", "http://b/"]
+    # 10.0.0.1 仍然被 http://b/ 封禁
+    assert report.final_ban_count == 2
+    assert stub_api.num_apply == 1
+
+
+def test_replay_fake_target(tmp_path):
+    path = str(tmp_path / "decision.jsonl")
+    recorder = DecisionRecorder(path)
+    recorder.record([_decision(f"10.{i // 200}.{i % 200}.1") for i in range(300)], [], ts=100)
+    recorder.record([_decision("10.9.0.1")], [], ts=110)
+    recorder.close()
+
+    config = AppSettings(crowdsec_lapi_key="key", tencent_teo_max_rule=1)
+    handler = CrowdsecDecisionHandler(crowdsec_client=ReplayDecisionClient(), config=config)  # type: ignore
+    fake_backend, handler.target_s = create_fake_target_s(config)
+    report = replay_decision_log(handler, read_decision_log(path), fake_backend=fake_backend)
+    # 报告模拟后端中实际的规则状态，CDN黑名单最多200个
+    assert report.final_rule_d == {"fake-cdn-domain": 200, "fake-teo-zone": 301}
+    assert report.api_stat_d["ModifySecurityPolicy"].num_call == 2
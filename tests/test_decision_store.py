@@ -0,0 +1,299 @@
+import math
+
+import pytest
+
+from app.aliyun_cdn_api import AliyunCdnAPI
+from app.config import AppSettings
+from app.decision_handler import CrowdsecDecisionHandler, get_lapi_s
+from app.decision_replay import ReplayDecisionClient, StubTargetAPI
+from app.decision_recorder import DecisionBatch
+from app.decision_store import DecisionStore, GraceLRU, parse_duration
+from app.fake_aliyun import FakeAliyunCdnBackend
+from app.target_backend import AggregationCache, IpListSpec
+
+
+def _decision(ip: str, duration: str = "1h"):
+    return {"duration": duration, "scope": "Ip", "type": "ban", "value": ip}
+
+
+def test_parse_duration():
+    assert parse_duration("1m43s") == 103
+    assert parse_duration("3h59m58.5s") == 3 * 3600 + 59 * 60 + 58.5
+    assert parse_duration("150ms") == pytest.approx(0.15)
+    assert parse_duration("-5s") == -5
+    assert parse_duration("") == math.inf
+    assert parse_duration("1d") == math.inf
+
+
+def test_decision_store_multi_source():
+    store = DecisionStore()
+    assert store.add(_decision("1.1.1.1", "1h"), source="a", now=0)
+    assert not store.add(_decision("1.1.1.1", "2h"), source="b", now=0)
+    assert store.add(_decision("2.2.2.2", "1m"), source="b", now=0)
+    assert len(store) == 2
+    assert store.get_expire_at("1.1.1.1") == 7200
+    # 只有所有来源都删除后才解封
+    assert not store.remove(_decision("1.1.1.1"), source="a")
+    assert "1.1.1.1" in store
+    assert store.remove(_decision("1.1.1.1"), source="b")
+    assert "1.1.1.1" not in store
+    assert store.ip_list() == ["2.2.2.2"]
+
+
+def test_decision_store_expire():
+    store = DecisionStore()
+    store.add(_decision("1.1.1.1", "1m"), source="a", now=0)
+    store.add(_decision("1.1.1.1", "1h"), source="b", now=0)
+    store.add(_decision("2.2.2.2", "1m"), source="a", now=0)
+    # 续期
+    store.add(_decision("2.2.2.2", "1m"), source="a", now=30)
+    assert store.expire(now=60) == []
+    assert store.expire(now=90) == ["2.2.2.2"]
+    assert store.ip_list() == ["1.1.1.1"]
+    assert store.expire(now=3600) == ["1.1.1.1"]
+    assert len(store) == 0
+
+
+def test_grace_lru():
+    grace = GraceLRU(ttl=60, max_size=2)
+    assert grace.add("1.1.1.1", now=0) == []
+    assert grace.add("2.2.2.2", now=10) == []
+    assert grace.ip_list() == ["2.2.2.2", "1.1.1.1"]
+    # 超过容量时淘汰最早解封的IP
+    assert grace.add("3.3.3.3", now=20) == ["1.1.1.1"]
+    assert grace.pop("2.2.2.2")
+    assert not grace.pop("2.2.2.2")
+    assert grace.expire(now=70) == []
+    assert grace.expire(now=80) == ["3.3.3.3"]
+    assert len(grace) == 0
+    # 未开启宽限期时直接解封
+    assert GraceLRU(ttl=0, max_size=10).add("1.1.1.1", now=0) == ["1.1.1.1"]
+
+
+def test_get_lapi_s():
+    def _config(url: str, key: str):
+        return AppSettings(
+            crowdsec_lapi_url=url,
+            crowdsec_lapi_key=key,
+            tencent_secret_id="id",
+            tencent_secret_key="key",
+        )
+
+    assert get_lapi_s(_config("http://a/", "k")) == [("http://a/", "k")]
+    assert get_lapi_s(_config("http://a/, http://b/", "k")) == [
+        ("http://a/", "k"),
+        ("http://b/", "k"),
+    ]
+    assert get_lapi_s(_config("http://a/,http://b/", "k1,k2"))[1] == ("http://b/", "k2")
+    with pytest.raises(ValueError):
+        get_lapi_s(_config("http://a/,http://b/", "k1,k2,k3"))
+
+
+def test_handler_fan_in():
+    handler = CrowdsecDecisionHandler(crowdsec_client=ReplayDecisionClient())  # type: ignore
+    client_a = ReplayDecisionClient()
+    client_b = ReplayDecisionClient()
+    handler.crowdsec_client_s = [("a", client_a), ("b", client_b)]  # type: ignore
+    stub_api = StubTargetAPI()
+    handler.target_s = [("stub", stub_api)]  # type: ignore
+
+    client_a.load(DecisionBatch(ts=0, new_s=[_decision("1.1.1.1")], deleted_s=[]))
+    client_b.load(
+        DecisionBatch(ts=0, new_s=[_decision("1.1.1.1"), _decision("2.2.2.2")], deleted_s=[])
+    )
+    handler._handle_crowdsec_decision(now=0)
+    # 两个LAPI合并后只下发一次
+    assert stub_api.num_apply == 1
+    assert sorted(stub_api.ban_ip_list_d["stub"]) == ["1.1.1.1", "2.2.2.2"]
+
+    # 已经被另一个LAPI封禁的IP，不会重复下发
+    client_a.load(DecisionBatch(ts=10, new_s=[_decision("2.2.2.2")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=10)
+    assert stub_api.num_apply == 1
+
+    client_b.load(DecisionBatch(ts=20, new_s=[], deleted_s=[_decision("1.1.1.1")]))
+    handler._handle_crowdsec_decision(now=20)
+    assert sorted(handler._get_ban_ip_list()) == ["1.1.1.1", "2.2.2.2"]
+    client_a.load(DecisionBatch(ts=30, new_s=[], deleted_s=[_decision("1.1.1.1")]))
+    handler._handle_crowdsec_decision(now=30)
+    assert handler._get_ban_ip_list() == ["2.2.2.2"]
+
+
+def _grace_handler(grace_window: int):
+    config = AppSettings(
+        crowdsec_lapi_key="key",
+        tencent_secret_id="id",
+        tencent_secret_key="key",
+        decision_grace_window=grace_window,
+    )
+    client = ReplayDecisionClient()
+    handler = CrowdsecDecisionHandler(crowdsec_client=client, config=config)  # type: ignore
+    stub_api = StubTargetAPI()
+    handler.target_s = [("stub", stub_api)]  # type: ignore
+    return handler, client, stub_api
+
+
+def test_handler_grace_window():
+    handler, client, stub_api = _grace_handler(300)
+    client.load(DecisionBatch(ts=0, new_s=[_decision("1.1.1.1", "1m")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=0)
+    assert stub_api.num_apply == 1
+
+    # 过期后进入宽限期，不修改规则，仍然在下发列表末尾
+    client.load(DecisionBatch(ts=10, new_s=[_decision("2.2.2.2")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=10)
+    handler._handle_crowdsec_decision(now=70)
+    assert stub_api.num_apply == 2
+    assert handler._get_ban_ip_list() == ["2.2.2.2", "1.1.1.1"]
+
+    # 宽限期内再次封禁，IP已经在规则中
+    client.load(DecisionBatch(ts=80, new_s=[_decision("1.1.1.1", "1m")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=80)
+    assert stub_api.num_apply == 2
+    assert handler._get_ban_ip_list() == ["1.1.1.1", "2.2.2.2"]
+
+    # 宽限期结束后才移除
+    handler._handle_crowdsec_decision(now=140)
+    handler._handle_crowdsec_decision(now=400)
+    assert stub_api.num_apply == 2
+    handler._handle_crowdsec_decision(now=440)
+    assert stub_api.num_apply == 3
+    assert stub_api.ban_ip_list_d["stub"] == ["2.2.2.2"]
+
+
+def test_handler_grace_budget_per_target():
+    handler, client, _ = _grace_handler(300)
+    small_api = StubTargetAPI(max_ip=2)
+    large_api = StubTargetAPI(max_ip=10)
+    handler.target_s = [("small", small_api), ("large", large_api)]  # type: ignore
+    client.load(
+        DecisionBatch(ts=0, new_s=[_decision("1.1.1.1"), _decision("2.2.2.2")], deleted_s=[])
+    )
+    handler._handle_crowdsec_decision(now=0)
+    client.load(DecisionBatch(ts=10, new_s=[], deleted_s=[_decision("1.1.1.1")]))
+    handler._handle_crowdsec_decision(now=10)
+    client.load(DecisionBatch(ts=20, new_s=[_decision("3.3.3.3")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=20)
+    # 容量小的目标移除宽限期IP，不影响容量大的目标
+    assert small_api.ban_ip_list_d["small"] == ["2.2.2.2", "3.3.3.3"]
+    assert large_api.ban_ip_list_d["large"] == ["1.1.1.1", "2.2.2.2", "3.3.3.3"]
+
+
+def test_aggregation_cache_grace():
+    cache = AggregationCache(
+        ["10.0.0.1", "10.0.1.1"], grace_ip_list=["10.0.2.1", "10.0.3.1"]
+    )
+    result = cache.get(IpListSpec(max_size=3))
+    assert result.ip_s == ["10.0.0.1", "10.0.1.1", "10.0.2.1"]
+    # 放不下的宽限期IP不记录为丢弃
+    assert result.discard_ip_s == []
+    result = cache.get(IpListSpec(max_size=1))
+    assert result.ip_s == ["10.0.0.1"]
+    assert result.discard_ip_s == [("10.0.1.1", "full")]
+
+
+class _PartialStubAPI(StubTargetAPI):
+    def __init__(self):
+        super().__init__()
+        self.fail_domain_s: set[str] = set()
+
+    def commit_decision(self, prepared, result):
+        if prepared.domain in self.fail_domain_s:
+            raise RuntimeError("api error")
+        return super().commit_decision(prepared, result)
+
+
+def test_handler_grace_reban_per_target():
+    handler, client, _ = _grace_handler(300)
+    stub_api = _PartialStubAPI()
+    handler.target_s = [("a", stub_api), ("b", stub_api)]  # type: ignore
+    client.load(DecisionBatch(ts=0, new_s=[_decision("1.1.1.1")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=0)
+    stub_api.fail_domain_s = {"a"}
+    client.load(DecisionBatch(ts=10, new_s=[_decision("2.2.2.2", "1m")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=10)
+    assert stub_api.ban_ip_list_d == {"a": ["1.1.1.1"], "b": ["1.1.1.1", "2.2.2.2"]}
+    stub_api.fail_domain_s = set()
+    handler._handle_crowdsec_decision(now=80)
+    num_apply = stub_api.num_apply
+    # 宽限期内再次封禁，a的规则中没有该IP，需要重新下发
+    client.load(DecisionBatch(ts=90, new_s=[_decision("2.2.2.2")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=90)
+    assert stub_api.num_apply == num_apply + 2
+    assert stub_api.ban_ip_list_d["a"] == ["1.1.1.1", "2.2.2.2"]
+
+
+def test_handler_grace_window_disabled():
+    handler, client, stub_api = _grace_handler(0)
+    client.load(DecisionBatch(ts=0, new_s=[_decision("1.1.1.1", "1m")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=0)
+    handler._handle_crowdsec_decision(now=70)
+    assert handler._get_ban_ip_list() == []
+    client.load(DecisionBatch(ts=80, new_s=[_decision("1.1.1.1", "1m")], deleted_s=[]))
+    handler._handle_crowdsec_decision(now=80)
+    assert stub_api.num_apply == 2
+
+
+def test_handler_grace_budget():
+    backend = FakeAliyunCdnBackend(access_key_secret="secret", max_ip=3)
+    backend.add_domain("a.example.com")
+    handler, client, _ = _grace_handler(300)
+    with backend.serve() as server:
+        api = AliyunCdnAPI(
+            access_key_id="id", access_key_secret="secret", endpoint=server.endpoint, max_ip=3
+        )
+        handler.target_s = [("a.example.com", api)]
+        ip_s = ["10.0.0.1", "10.0.1.1", "10.0.2.1"]
+        client.load(DecisionBatch(ts=0, new_s=[_decision(x, "1m") for x in ip_s], deleted_s=[]))
+        handler._handle_crowdsec_decision(now=0)
+        client.load(DecisionBatch(ts=10, new_s=[], deleted_s=[_decision("10.0.0.1")]))
+        handler._handle_crowdsec_decision(now=10)
+        assert set(backend.get_domain_blacklist("a.example.com")) == set(ip_s)
+        # 新的封禁需要容量时，宽限期内的IP被移除
+        client.load(DecisionBatch(ts=20, new_s=[_decision("10.0.3.1")], deleted_s=[]))
+        handler._handle_crowdsec_decision(now=20)
+        assert set(backend.get_domain_blacklist("a.example.com")) == {
+            "10.0.1.1",
+            "10.0.2.1",
+            "10.0.3.1",
+        }
+        assert backend.stat_d["BatchSetCdnDomainConfig"].num_call == 2
+
+
+class _FlakyStreamClient(ReplayDecisionClient):
+    def __init__(self, lapi_url: str, available: bool):
+        super().__init__()
+        self.lapi_url = lapi_url
+        self.available = available
+        self.running = False
+        self.num_run = 0
+
+    def run(self):
+        self.num_run += 1
+        if not self.available:
+            raise ConnectionError("connection refused")
+        self.running = True
+
+    def is_running(self):
+        return self.running
+
+
+def test_handler_start_partial_lapi(monkeypatch):
+    handler = CrowdsecDecisionHandler(crowdsec_client=ReplayDecisionClient())  # type: ignore
+    monkeypatch.setattr(handler, "_check_crowdsec_client", lambda client: None)
+    client_a = _FlakyStreamClient("http://a/", available=True)
+    client_b = _FlakyStreamClient("http://b/", available=False)
+    handler.crowdsec_client_s = [("a", client_a), ("b", client_b)]  # type: ignore
+    # 一个LAPI不可用时继续运行
+    assert handler._start_crowdsec_client_s(now=0) == 1
+    client_b.available = True
+    # 重试间隔内不重试
+    assert handler._start_crowdsec_client_s(now=30) == 1
+    assert client_b.num_run == 1
+    assert handler._start_crowdsec_client_s(now=60) == 2
+    # stream线程退出后重新启动
+    client_a.running = False
+    client_a.available = False
+    assert handler._start_crowdsec_client_s(now=70) == 1
+    client_b.running = False
+    assert handler._start_crowdsec_client_s(now=80) == 0
@@ -0,0 +1,191 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import decision_handler, decision_stream
+from app.config import AppSettings
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_recorder import DecisionBatch, read_decision_log
+from app.decision_replay import ReplayDecisionClient, StubTargetAPI, replay_decision_log
+from app.decision_stream import StreamingDecisionClient, iter_stream_decision
+
+
+def _decision(ip: str):
+    return {
+        "duration": "1h",
+        "id": 1,
+        "origin": "crowdsec",
+        "scenario": "crowdsecurity/http-probing 探测",
+        "scope": "Ip",
+        "type": "ban",
+        "uuid": "0999cdb8-833c-49ec-8054-876d574eead2",
+        "value": ip,
+    }
+
+
+def _chunk_s(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def test_iter_stream_decision():
+    response = {
+        "deleted": [_decision("1.1.1.1")],
+        "new": [_decision(f"10.0.0.{i}") for i in range(20)],
+        "extra": {"a": [1, 2]},
+    }
+    data = json.dumps(response, indent=1, ensure_ascii=False).encode()
+    expect_s = [("deleted", _decision("1.1.1.1"))]
+    expect_s += [("new", _decision(f"10.0.0.{i}")) for i in range(20)]
+    # 每次1个字节，多字节字符也会被切开
+    for size in [1, 7, 1024, len(data)]:
+        assert list(iter_stream_decision(_chunk_s(data, size))) == expect_s
+
+    assert list(iter_stream_decision([b'{"new": null, "deleted": []}'])) == []
+    with pytest.raises(ValueError):
+        list(iter_stream_decision([b'{"new": [{"value": "1.1.1.1"}']))
+
+
+class _StreamRequestHandler(BaseHTTPRequestHandler):
+    body = b""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+
+def test_streaming_decision_client():
+    response = {"new": [_decision(f"10.0.0.{i}") for i in range(100)], "deleted": None}
+    _StreamRequestHandler.body = json.dumps(response).encode()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StreamRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        client = StreamingDecisionClient(api_key="key", lapi_url=f"http://{host}:{port}/")
+        client.cycle("true")
+    finally:
+        server.shutdown()
+        server.server_close()
+    new_s = list(client.get_new_decision())
+    assert len(new_s) == 100
+    # 只保留需要的字段
+    assert new_s[0] == {"value": "10.0.0.0", "duration": "1h", "type": "ban", "scope": "Ip"}
+    assert list(client.get_deleted_decision()) == []
+
+
+def test_streaming_decision_sink(monkeypatch):
+    monkeypatch.setattr(decision_stream, "SINK_CHUNK_SIZE", 30)
+    response = {
+        "new": [_decision(f"10.0.0.{i}") for i in range(100)],
+        "deleted": [_decision("10.0.1.1")],
+    }
+    _StreamRequestHandler.body = json.dumps(response).encode()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StreamRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        config = AppSettings(
+            crowdsec_lapi_key="key",
+            crowdsec_lapi_url=f"http://{host}:{port}/",
+            crowdsec_stream_direct=True,
+        )
+        handler = CrowdsecDecisionHandler(config=config)
+        stub_api = StubTargetAPI()
+        handler.target_s = [("stub", stub_api)]  # type: ignore
+        client = handler.crowdsec_client_s[0][1]
+        chunk_s = []
+        sink = client.sink
+
+        def _sink(new_s, deleted_s, ts):
+            chunk_s.append((len(new_s), ts))
+            sink(new_s, deleted_s, ts)
+
+        client.sink = _sink
+        client.cycle("true")
+    finally:
+        server.shutdown()
+        server.server_close()
+    # stream线程直接写入DecisionStore，不经过队列
+    # 同一次请求的所有块时间相同
+    assert [x[0] for x in chunk_s] == [30, 30, 30, 10]
+    assert len({x[1] for x in chunk_s}) == 1
+    assert len(handler._decision_store) == 100
+    assert client.new_decisions.empty()
+    handler._handle_crowdsec_decision()
+    assert stub_api.num_apply == 1
+    assert len(stub_api.ban_ip_list_d["stub"]) > 0
+    handler._handle_crowdsec_decision()
+    assert stub_api.num_apply == 1
+
+
+def test_stream_direct_disabled():
+    config = AppSettings(crowdsec_lapi_key="key", crowdsec_lapi_url="http://127.0.0.1:1/")
+    handler = CrowdsecDecisionHandler(config=config)
+    assert handler.crowdsec_client_s[0][1].sink is None
+
+
+def test_streaming_decision_sink_replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(decision_stream, "SINK_CHUNK_SIZE", 30)
+    response = {"new": [_decision(f"10.0.0.{i}") for i in range(100)], "deleted": None}
+    _StreamRequestHandler.body = json.dumps(response).encode()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StreamRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    path = str(tmp_path / "decision.jsonl")
+    try:
+        host, port = server.server_address[:2]
+        config = AppSettings(
+            crowdsec_lapi_key="key",
+            crowdsec_lapi_url=f"http://{host}:{port}/a/,http://{host}:{port}/b/",
+            crowdsec_stream_direct=True,
+            crowdsec_record_path=path,
+        )
+        handler = CrowdsecDecisionHandler(config=config)
+        handler.target_s = [("stub", StubTargetAPI())]  # type: ignore
+        # 两个LAPI分块写入，请求时间不同
+        for _, client in handler.crowdsec_client_s:
+            client.cycle("true")
+        handler._handle_crowdsec_decision()
+        handler.recorder.close()  # type: ignore
+    finally:
+        server.shutdown()
+        server.server_close()
+    batch_s = list(read_decision_log(path))
+    assert len(batch_s) == 8
+    assert len({x.source for x in batch_s}) == 2
+    assert len({x.cycle for x in batch_s}) == 1
+    # 启动时多个LAPI的全部块回放为一个周期
+    replay_handler = CrowdsecDecisionHandler(crowdsec_client=ReplayDecisionClient())  # type: ignore
+    replay_handler.target_s = [("stub", StubTargetAPI())]  # type: ignore
+    report = replay_decision_log(replay_handler, batch_s)
+    assert report.num_cycle == 1
+    assert report.num_new == 200
+
+
+def test_handle_decision_in_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr(decision_handler, "DECISION_CHUNK_SIZE", 3)
+    client = ReplayDecisionClient()
+    handler = CrowdsecDecisionHandler(crowdsec_client=client)  # type: ignore
+    stub_api = StubTargetAPI()
+    handler.target_s = [("stub", stub_api)]  # type: ignore
+    path = str(tmp_path / "decision.jsonl")
+    handler.recorder = decision_handler.DecisionRecorder(path)
+    new_s = [_decision(f"10.0.0.{i}") for i in range(7)]
+    client.load(DecisionBatch(ts=100, new_s=new_s, deleted_s=[_decision("1.1.1.1")]))
+    handler._handle_crowdsec_decision(now=100)
+    handler.recorder.close()
+    assert len(handler._decision_store) == 7
+    assert stub_api.num_apply == 1
+    batch_s = list(read_decision_log(path))
+    assert [len(x.new_s) for x in batch_s] == [3, 3, 1]
+    assert [len(x.deleted_s) for x in batch_s] == [1, 0, 0]
+    assert {x.ts for x in batch_s} == {100}
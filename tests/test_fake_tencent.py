@@ -0,0 +1,107 @@
+import pytest
+from tencentcloud.cdn.v20180606 import models as cdn_models
+from tencentcloud.common.exception.tencent_cloud_sdk_exception import (
+    TencentCloudSDKException,
+)
+
+from app.fake_tencent import FakeTencentBackend
+from app.tencent_cdn_api import TencentCdnAPI
+from app.tencent_edgeone_api import TencentEdgeoneAPI
+
+
+def _ip_list(num: int):
+    # 每个/24网段只有一个IP，避免被合并
+    return [f"10.{i // 250}.{i % 250}.1" for i in range(num)]
+
+
+def test_cdn_apply_decision():
+    backend = FakeTencentBackend()
+    backend.add_domain(
+        "a.example.com",
+        ip_filter={
+            "Switch": "on",
+            "FilterType": "blacklist",
+            "FilterRules": [
+                {"FilterType": "blacklist", "Filters": ["1.1.1.1"], "RuleType": "all"},
+            ],
+        },
+    )
+    api = backend.create_cdn_api()
+    assert api.apply_decision("a.example.com", _ip_list(300))
+    blacklist = backend.get_domain_blacklist("a.example.com")
+    # 已有的黑名单规则保留，总数不超过200
+    assert len(blacklist) == 200
+    assert blacklist[0] == "1.1.1.1"
+    assert backend.stat_d["ModifyDomainConfig"].num_call == 1
+
+    # IP列表不变时不会修改配置
+    assert api.apply_decision("a.example.com", _ip_list(300))
+    assert backend.stat_d["ModifyDomainConfig"].num_call == 1
+    assert backend.stat_d["DescribeDomainsConfig"].num_call == 2
+
+
+def test_cdn_blacklist_limit():
+    backend = FakeTencentBackend()
+    backend.add_domain("a.example.com")
+    client = backend.create_cdn_client()
+    req = cdn_models.ModifyDomainConfigRequest()
+    req.Domain = "a.example.com"
+    req.Route = "IpFilter"
+    filter_s = '","'.join(_ip_list(201))
+    req.Value = (
+        '{"update":{"Switch":"on","FilterRules":[{"FilterType":"blacklist",'
+        f'"Filters":["{filter_s}"]}}]}}}}'
+    )
+    with pytest.raises(TencentCloudSDKException) as ex_info:
+        client.ModifyDomainConfig(req)
+    assert ex_info.value.code == "LimitExceeded"
+
+
+def test_teo_apply_decision():
+    backend = FakeTencentBackend()
+    backend.add_zone("zone-1")
+    api = backend.create_teo_api()
+    assert api.apply_decision("zone-1", _ip_list(2500))
+    ip_list_d = backend.get_zone_rule_ip_list("zone-1")
+    assert sorted(len(x) for x in ip_list_d.values()) == [500, 2000]
+    assert backend.get_rule_state() == {"zone-1": 2500}
+
+    # 规则ID保持不变
+    id_s = {x["Id"] for x in backend.zone_d["zone-1"]["CustomRules"]["Rules"]}
+    assert api.apply_decision("zone-1", _ip_list(2600))
+    new_id_s = {x["Id"] for x in backend.zone_d["zone-1"]["CustomRules"]["Rules"]}
+    assert new_id_s == id_s
+    assert backend.get_rule_state() == {"zone-1": 2600}
+
+
+def test_error_injection_and_throttle():
+    backend = FakeTencentBackend(throttle_qps=2)
+    backend.add_zone("zone-1")
+    api = backend.create_teo_api()
+    backend.inject_error("DescribeSecurityPolicy", "InternalError")
+    with pytest.raises(TencentCloudSDKException) as ex_info:
+        api.get_zone_config("zone-1")
+    assert ex_info.value.code == "InternalError"
+    api.get_zone_config("zone-1")
+    with pytest.raises(TencentCloudSDKException) as ex_info:
+        api.get_zone_config("zone-1")
+    assert ex_info.value.code == "RequestLimitExceeded"
+    assert backend.stat_d["DescribeSecurityPolicy"].num_error == 2
+
+
+def test_fake_http_server():
+    backend = FakeTencentBackend()
+    backend.add_domain("a.example.com")
+    backend.add_zone("zone-1")
+    with backend.serve() as server:
+        cdn_api = TencentCdnAPI(secret_id="a", secret_key="b", endpoint=server.endpoint)
+        teo_api = TencentEdgeoneAPI(secret_id="a", secret_key="b", endpoint=server.endpoint)
+        assert [x.Domain for x in cdn_api.list_domain()] == ["a.example.com"]
+        assert cdn_api.apply_decision("a.example.com", _ip_list(10))
+        assert teo_api.apply_decision("zone-1", _ip_list(10))
+        with pytest.raises(TencentCloudSDKException):
+            teo_api.get_zone_config("zone-2")
+    assert backend.get_rule_state() == {"a.example.com": 10, "zone-1": 10}
+    stat = backend.stat_d["ModifySecurityPolicy"]
+    assert stat.num_call == 1
+    assert stat.request_bytes > 10 * len("10.0.0.1")
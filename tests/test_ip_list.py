@@ -1,4 +1,4 @@
-from app.ip_list import IpListBuilder
+from app.ip_list import AppliedIpList, IpListBuilder
 
 
 def test_ip_list_builder_initialization():
@@ -90,3 +90,12 @@ def test_to_list_sorted_output():
     builder = IpListBuilder(max_size=5)
     builder.update(["10.0.2.1", "10.0.1.1", "10.0.0.1"])
     assert builder.to_list() == ["10.0.0.1", "10.0.1.1", "10.0.2.1"]
+
+
+def test_applied_ip_list():
+    applied = AppliedIpList(["1.1.1.1", "10.0.0.2/31"])
+    assert "1.1.1.1" in applied
+    assert "10.0.0.3" in applied
+    assert "10.0.0.4" not in applied
+    assert "invalid" not in applied
+    assert "1.1.1.1" in AppliedIpList(["1.1.1.1"])
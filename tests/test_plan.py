@@ -0,0 +1,102 @@
+import json
+
+from app.decision_recorder import DecisionRecorder
+from app.decision_replay import StubTargetAPI
+from app.fake_tencent import FakeTencentBackend
+from app.plan import (
+    get_ban_ip_list,
+    load_decision_store,
+    load_target_state,
+    plan_decision,
+    save_target_state,
+)
+
+
+def _decision(ip: str, duration: str = "1h"):
+    return {"duration": duration, "origin": "crowdsec", "scope": "Ip", "type": "ban", "value": ip}
+
+
+def _teo_rule(name: str, ip_s: list[str]):
+    condition = "${http.request.ip} in [" + ",".join(f"'{x}'" for x in ip_s) + "]"
+    return {
+        "Name": name,
+        "Condition": condition,
+        "Action": {"Name": "Deny"},
+        "Enabled": "on",
+        "Id": name,
+        "RuleType": "BasicAccessRule",
+        "Priority": 0,
+    }
+
+
+def test_load_decision_store(tmp_path):
+    path = str(tmp_path / "decision.jsonl")
+    recorder = DecisionRecorder(path)
+    recorder.record([_decision("1.1.1.1"), _decision("2.2.2.2", "1m")], [], ts=100)
+    recorder.record([_decision("3.3.3.3")], [_decision("1.1.1.1")], ts=200)
+    recorder.close()
+    # 2.2.2.2 在最后一个批次时已经过期
+    assert get_ban_ip_list(load_decision_store(path)) == ["3.3.3.3"]
+    assert get_ban_ip_list(load_decision_store(path, now=4000)) == []
+
+    snapshot_path = tmp_path / "snapshot.json"
+    snapshot_path.write_text(
+        json.dumps({"new": [_decision("1.1.1.1"), _decision("2.2.2.2")], "deleted": None})
+    )
+    store = load_decision_store(str(snapshot_path), lapi_snapshot=True)
+    assert get_ban_ip_list(store) == ["2.2.2.2", "1.1.1.1"]
+
+
+def test_plan_from_cached_state(tmp_path):
+    backend = FakeTencentBackend()
+    backend.add_domain("a.example.com")
+    backend.add_zone("zone-1", [_teo_rule("crowdsec-0", ["10.0.0.1", "10.0.0.5"])])
+    cdn_api = backend.create_cdn_api()
+    teo_api = backend.create_teo_api()
+    prepared_s = [
+        (cdn_api, cdn_api.prepare_decision("a.example.com")),
+        (teo_api, teo_api.prepare_decision("zone-1")),
+    ]
+    state_path = str(tmp_path / "state.json")
+    save_target_state(state_path, prepared_s, ts=100)  # type: ignore
+
+    state_ts, state_d = load_target_state(state_path)
+    assert state_ts == 100
+    cached_s = [
+        (cdn_api, cdn_api.load_state("a.example.com", state_d[("tencent_cdn", "a.example.com")])),
+        (teo_api, teo_api.load_state("zone-1", state_d[("tencent_teo", "zone-1")])),
+    ]
+    assert cached_s[1][1].current_ip_s == ["10.0.0.1", "10.0.0.5"]
+    report = plan_decision(["10.0.0.5", "10.0.0.9"], cached_s)
+    cdn_plan, teo_plan = report.plan_s
+    assert cdn_plan.changed
+    assert cdn_plan.budget == 200
+    assert sorted(cdn_plan.added) == ["10.0.0.5", "10.0.0.9"]
+    assert teo_plan.changed
+    assert teo_plan.added == ["10.0.0.9"]
+    assert teo_plan.removed == ["10.0.0.1"]
+    # 复用原规则ID
+    assert "id=crowdsec-0 num_ip=2 modified" in teo_plan.detail_s[0]
+    # 两个目标的聚合参数不同
+    assert report.num_aggregation == 2
+    assert report.num_change == 2
+    assert "[tencent_teo] zone-1 change" in report.format()
+    # 只读取远端状态，不调用修改接口
+    assert set(backend.stat_d) == {"DescribeDomainsConfig", "DescribeSecurityPolicy"}
+
+    report = plan_decision(["10.0.0.1", "10.0.0.5"], cached_s[1:])
+    assert not report.plan_s[0].changed
+    assert report.to_dict()["targets"][0]["num_ip"] == 2
+
+
+def test_plan_stub_state(tmp_path):
+    stub_api = StubTargetAPI(max_ip=2)
+    stub_api.ban_ip_list_d["stub"] = ["10.0.0.1"]
+    state_path = str(tmp_path / "state.json")
+    save_target_state(state_path, [(stub_api, stub_api.prepare_decision("stub"))], ts=100)
+    _, state_d = load_target_state(state_path)
+    prepared = stub_api.load_state("stub", state_d[("stub", "stub")])
+    report = plan_decision(["10.0.0.5", "10.0.0.9", "10.0.1.1"], [(stub_api, prepared)])
+    assert report.plan_s[0].removed == ["10.0.0.1"]
+    assert len(report.plan_s[0].discard_ip_s) == 1
+    assert stub_api.num_apply == 0
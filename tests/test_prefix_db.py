@@ -0,0 +1,89 @@
+import pytest
+
+from app.ip_list import IpListBuilder
+from app.prefix_db import PrefixDB, build_prefix_db, main, parse_prefix_line
+
+
+def _prefix(cidr: str, asn: int):
+    line = parse_prefix_line(f"{cidr} {asn}")
+    assert line is not None
+    return line
+
+
+def test_parse_prefix_line():
+    assert parse_prefix_line("1.0.0.0\t24\t13335") == (0x01000000, 24, 13335)
+    assert parse_prefix_line("1.0.0.0/24 13335_209242") == (0x01000000, 24, 13335)
+    assert parse_prefix_line("2001:db8::/32 64500") is None
+    assert parse_prefix_line("# comment") is None
+
+
+def test_prefix_db_lookup(tmp_path):
+    path = str(tmp_path / "prefix.db")
+    prefix_s = [
+        _prefix("10.0.0.0/8", 100),
+        _prefix("10.1.0.0/16", 200),
+        _prefix("10.1.2.0/24", 300),
+        _prefix("10.1.255.0/24", 400),
+        _prefix("192.168.0.0/16", 500),
+    ]
+    # 嵌套前缀展开后: 10/8 被 10.1/16 分成两段，10.1/16 被两个/24分成三段
+    assert build_prefix_db(prefix_s, path) == 7
+    with PrefixDB(path) as db:
+        assert len(db) == 7
+        assert db.lookup("10.0.0.1").cidr == "10.0.0.0/8"
+        assert db.lookup("10.1.1.1").asn == 200
+        assert db.lookup("10.1.2.3").cidr == "10.1.2.0/24"
+        assert db.lookup("10.1.3.3").asn == 200
+        assert db.lookup("10.1.255.255").asn == 400
+        assert db.lookup("10.2.0.0").asn == 100
+        assert db.lookup("192.168.255.255").asn == 500
+        assert db.lookup("9.255.255.255") is None
+        assert db.lookup("11.0.0.0") is None
+        assert db.lookup("::1") is None
+
+
+def test_prefix_db_invalid(tmp_path):
+    path = tmp_path / "prefix.db"
+    path.write_bytes(b"x" * 16)
+    with pytest.raises(ValueError):
+        PrefixDB(str(path))
+
+
+def test_prefix_db_cli(tmp_path, capsys):
+    input_path = tmp_path / "pfx2as.txt"
+    input_path.write_text("1.0.0.0\t24\t13335\n8.8.8.0\t24\t15169\n")
+    db_path = str(tmp_path / "prefix.db")
+    main(["build", str(input_path), db_path])
+    main(["lookup", db_path, "8.8.8.8", "9.9.9.9"])
+    output = capsys.readouterr().out
+    assert "8.8.8.8 8.8.8.0/24 AS15169" in output
+    assert "9.9.9.9 not found" in output
+
+
+def test_ip_list_prefix_merge(tmp_path):
+    path = str(tmp_path / "prefix.db")
+    build_prefix_db([_prefix("10.1.0.0/20", 100), _prefix("10.2.0.0/16", 200)], path)
+    # 分散在10.1.0.0/20中8个/24网段的IP，每个网段不到10个，不会按/24合并
+    ip_list = [f"10.1.{i}.{j}" for i in range(8) for j in (1, 3)]
+    sparse_ip_list = [f"10.2.{i}.1" for i in range(20)]
+    with PrefixDB(path) as db:
+        builder = IpListBuilder(max_size=100)
+        builder.update(ip_list + sparse_ip_list)
+        assert len(builder.to_list()) == 36
+
+        builder = IpListBuilder(max_size=100, prefix_db=db, prefix_merge_density=0.5)
+        builder.update(ip_list + sparse_ip_list)
+        # 8/16个/24网段命中，合并为公告前缀；10.2.0.0/16 命中比例太低不合并
+        result = builder.to_list()
+        assert "10.1.0.0/20" in result
+        assert len(result) == 21
+
+        # 前缀内有忽略的IP时不合并
+        builder = IpListBuilder(
+            max_size=100,
+            ignore_ip_s=["10.1.15.1"],
+            prefix_db=db,
+            prefix_merge_density=0.5,
+        )
+        builder.update(ip_list)
+        assert "10.1.0.0/20" not in builder.to_list()
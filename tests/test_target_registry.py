@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app.aliyun_cdn_api import AliyunCdnAPI
+from app.config import AppSettings
+from app.decision_replay import StubTargetAPI
+from app.target_backend import AggregationCache
+from app.target_registry import create_target_s, get_backend_spec, update_target_s
+from app.tencent_cdn_api import TencentCdnAPI
+from app.tencent_edgeone_api import TencentEdgeoneAPI
+
+
+def _config(**kwargs):
+    return AppSettings(
+        crowdsec_lapi_key="key",
+        tencent_secret_id="id",
+        tencent_secret_key="key",
+        aliyun_access_key_id="id",
+        aliyun_access_key_secret="secret",
+        **kwargs,
+    )
+
+
+def test_create_target_s():
+    assert create_target_s(_config()) == []
+    target_s = create_target_s(
+        _config(tencent_cdn_domain="a.example.com", tencent_teo_zone_id="zone-1")
+    )
+    assert [x[0] for x in target_s] == ["a.example.com", "zone-1"]
+    assert isinstance(target_s[0][1], TencentCdnAPI)
+    assert isinstance(target_s[1][1], TencentEdgeoneAPI)
+    with pytest.raises(KeyError):
+        get_backend_spec("unknown")
+
+    # 同一种后端的多个目标共用一个api
+    target_s = create_target_s(_config(aliyun_cdn_domain="a.example.com, b.example.com"))
+    assert [x[0] for x in target_s] == ["a.example.com", "b.example.com"]
+    assert isinstance(target_s[0][1], AliyunCdnAPI)
+    assert target_s[0][1] is target_s[1][1]
+
+
+def test_update_target_s_key_by_kind():
+    # 同一个域名配置在不同类型的后端中
+    config = _config(tencent_cdn_domain="a.example.com", aliyun_cdn_domain="a.example.com")
+    target_s = create_target_s(config)
+    new_config = config.model_copy(update={"aliyun_cdn_max_ip": 100})
+    new_target_s, changed_key_s = update_target_s(target_s, config, new_config)
+    assert changed_key_s == [("aliyun_cdn", "a.example.com")]
+    assert new_target_s[0][1] is target_s[0][1]
+
+
+def _loaded_module_s(code: str, **env: str):
+    code += "\nprint(json.dumps(sorted(sys.modules)))"
+    output = subprocess.check_output(
+        [sys.executable, "-c", "import json, sys\n" + code],
+        env={**os.environ, **env},
+    )
+    return set(json.loads(output))
+
+
+class _Ipv6StubAPI(StubTargetAPI):
+    supports_ipv6 = True
+
+
+def test_backend_shape_limit():
+    teo_api = TencentEdgeoneAPI(secret_id="id", secret_key="key", max_rule=3)
+    assert teo_api.max_ip_per_rule == 2000
+    assert teo_api.get_ip_list_spec().max_size == 6000
+    assert not teo_api.get_ip_list_spec().ipv6
+    cdn_api = TencentCdnAPI(secret_id="id", secret_key="key")
+    assert cdn_api.max_ip_per_rule is None
+    # 聚合参数不超过后端声明的容量
+    assert cdn_api.get_ip_list_spec(max_size=10**6).max_size == cdn_api.max_ip
+    # IpListBuilder 只输出IPv4
+    spec = _Ipv6StubAPI().get_ip_list_spec()
+    assert spec.ipv6
+    with pytest.raises(NotImplementedError):
+        AggregationCache(["1.1.1.1"]).get(spec)
+
+
+def test_lazy_import():
+    module_s = _loaded_module_s("import app.main")
+    assert "app.config" not in module_s
+    assert "pycrowdsec" not in module_s
+    assert "tencentcloud" not in module_s
+
+    code = (
+        "from app.config import get_config\n"
+        "from app.target_registry import create_target_s\n"
+        "create_target_s(get_config())"
+    )
+    module_s = _loaded_module_s(code, CSCDN_TENCENT_CDN_DOMAIN="a.example.com")
+    assert "tencentcloud.cdn" in module_s
+    assert "tencentcloud.teo" not in module_s
@@ -0,0 +1,111 @@
+import logging
+
+import pytest
+
+from app.config import AppSettings
+from app.decision_handler import CrowdsecDecisionHandler
+from app.decision_replay import ReplayDecisionClient
+from app.fake_tencent import FakeTencentBackend
+from app.tencent_cdn_api import TencentCdnAPI
+from app.tencent_client import (
+    SharedConnection,
+    TencentSession,
+    TransportOptions,
+    attach_session,
+    close_shared_session_s,
+    get_shared_session,
+    parse_action_timeout,
+)
+from app.tencent_edgeone_api import TencentEdgeoneAPI
+
+
+def test_transport_options():
+    assert parse_action_timeout(None) == ()
+    assert parse_action_timeout("ModifySecurityPolicy=120, DescribeZones=10") == (
+        ("ModifySecurityPolicy", 120.0),
+        ("DescribeZones", 10.0),
+    )
+    with pytest.raises(ValueError):
+        parse_action_timeout("ModifySecurityPolicy")
+    options = TransportOptions(action_timeout_s=(("ModifySecurityPolicy", 120),))
+    session = TencentSession(options)
+    assert session.get_timeout("ModifySecurityPolicy") == (5, 120)
+    assert session.get_timeout("DescribeZones") == (5, 60)
+    assert get_shared_session(options) is get_shared_session(TransportOptions(**options.__dict__))
+    assert get_shared_session() is not get_shared_session(options)
+
+
+def _ip_list(num: int):
+    return [f"10.{i // 250}.{i % 250}.1" for i in range(num)]
+
+
+@pytest.mark.parametrize("compress_min_bytes", [0, 1024])
+def test_shared_session(compress_min_bytes):
+    backend = FakeTencentBackend()
+    backend.add_domain("a.example.com")
+    backend.add_domain("b.example.com")
+    backend.add_zone("zone-1")
+    session = TencentSession(TransportOptions(compress_min_bytes=compress_min_bytes))
+    with backend.serve() as server:
+        api_s = [
+            TencentCdnAPI(secret_id="a", secret_key="b", endpoint=server.endpoint, session=session),
+            TencentCdnAPI(secret_id="a", secret_key="b", endpoint=server.endpoint, session=session),
+            TencentEdgeoneAPI(secret_id="a", secret_key="b", endpoint=server.endpoint, session=session),
+        ]
+        for _ in range(3):
+            assert api_s[0].apply_decision("a.example.com", _ip_list(10))
+            assert api_s[1].apply_decision("b.example.com", _ip_list(10))
+            assert api_s[2].apply_decision("zone-1", _ip_list(3000))
+        # 所有客户端共用一个长连接
+        assert server.num_connection == 1
+    assert backend.get_rule_state() == {"a.example.com": 10, "b.example.com": 10, "zone-1": 3000}
+    request_bytes = backend.stat_d["ModifySecurityPolicy"].request_bytes
+    if compress_min_bytes:
+        assert request_bytes < 3000 * len("10.0.0.1")
+    else:
+        assert request_bytes > 3000 * len("10.0.0.1")
+
+
+def test_attach_session_fallback(caplog):
+    caplog.set_level(logging.INFO, logger="app.tencent_client")
+    backend = FakeTencentBackend()
+    backend.add_domain("a.example.com")
+    session = TencentSession(TransportOptions(read_timeout=30))
+    with backend.serve() as server:
+        api = TencentCdnAPI(secret_id="a", secret_key="b", endpoint=server.endpoint, session=session)
+        client = api._get_client()
+        assert isinstance(client.request.conn, SharedConnection)
+        assert "overridden by connect=5s read=30s" in caplog.text
+        assert api.check_target("a.example.com") is None
+        assert client.request.request_size > 0
+
+        # SDK连接结构变化时继续使用SDK默认的连接
+        client = api._create_client()
+        client.request.conn = object()
+        assert attach_session(client, session).request.conn.__class__ is object
+        assert "shared session disabled" in caplog.text
+
+
+def test_reload_close_shared_session():
+    old_session = get_shared_session(TransportOptions(read_timeout=30))
+    new_session = get_shared_session(TransportOptions(read_timeout=40))
+    close_shared_session_s([TransportOptions(read_timeout=40)])
+    assert get_shared_session(TransportOptions(read_timeout=40)) is new_session
+    assert get_shared_session(TransportOptions(read_timeout=30)) is not old_session
+
+    config = AppSettings(
+        crowdsec_lapi_key="key",
+        tencent_secret_id="id",
+        tencent_secret_key="key",
+        tencent_cdn_domain="a.example.com",
+        tencent_http_read_timeout=30,
+    )
+    handler = CrowdsecDecisionHandler(
+        crowdsec_client=ReplayDecisionClient(), config=config  # type: ignore
+    )
+    session = handler.target_s[0][1]._session  # type: ignore
+    handler.reload_config(config.model_copy(update={"tencent_http_read_timeout": 50}))
+    new_session = handler.target_s[0][1]._session  # type: ignore
+    assert new_session is not session
+    assert get_shared_session(TransportOptions.from_config(handler.config)) is new_session
+    assert get_shared_session(TransportOptions(read_timeout=30)) is not session